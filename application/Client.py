@@ -6,25 +6,10 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 from django import forms
 import json
-import io
 
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.units import inch
-
-from .models import CLIENT, User, Commande, AuditLog, Facture
-
-# Custom login required decorator
-def custom_login_required(view_func):
-    def wrapper(request, *args, **kwargs):
-        if not request.session.get('user_id'):
-            messages.error(request, 'Vous devez être connecté pour accéder à cette page.')
-            return redirect('login')
-        return view_func(request, *args, **kwargs)
-    return wrapper
+from . import audit, pdf
+from .models import CLIENT, Commande, Facture
+from .authentification import connexion_requise
 
 # Forms
 class ClientForm(forms.ModelForm):
@@ -67,10 +52,9 @@ class ClientSearchForm(forms.Form):
     )
 
 # Views
-@custom_login_required
+@connexion_requise
 def client_dashboard(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     # Statistiques générales
     total_clients = CLIENT.objects.filter(actif=True).count()
@@ -116,10 +100,9 @@ def client_dashboard(request):
     
     return render(request, 'clients/dashboard.html', context)
 
-@custom_login_required
+@connexion_requise
 def liste_clients(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     clients = CLIENT.objects.filter(actif=True).order_by('nom_societe')
     
@@ -161,10 +144,9 @@ def liste_clients(request):
     
     return render(request, 'clients/liste_clients.html', context)
 
-@custom_login_required
+@connexion_requise
 def ajouter_client(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     if request.method == 'POST':
         form = ClientForm(request.POST)
@@ -172,7 +154,7 @@ def ajouter_client(request):
             client = form.save()
             
             # Log audit
-            AuditLog.objects.create(
+            audit.journaliser(
                 utilisateur=user,
                 action='CREATE',
                 model_name='CLIENT',
@@ -195,10 +177,9 @@ def ajouter_client(request):
         'user': user
     })
 
-@custom_login_required
+@connexion_requise
 def detail_client(request, client_id):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     client = get_object_or_404(CLIENT, id=client_id, actif=True)
     
@@ -260,10 +241,9 @@ def detail_client(request, client_id):
     
     return render(request, 'clients/detail_client.html', context)
 
-@custom_login_required
+@connexion_requise
 def modifier_client(request, client_id):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     client = get_object_or_404(CLIENT, id=client_id, actif=True)
     
@@ -280,7 +260,7 @@ def modifier_client(request, client_id):
             client = form.save()
             
             # Log audit
-            AuditLog.objects.create(
+            audit.journaliser(
                 utilisateur=user,
                 action='UPDATE',
                 model_name='CLIENT',
@@ -309,10 +289,9 @@ def modifier_client(request, client_id):
     
     return render(request, 'clients/modifier_client.html', context)
 
-@custom_login_required
+@connexion_requise
 def desactiver_client(request, client_id):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     client = get_object_or_404(CLIENT, id=client_id, actif=True)
     
@@ -321,7 +300,7 @@ def desactiver_client(request, client_id):
         client.save()
         
         # Log audit
-        AuditLog.objects.create(
+        audit.journaliser(
             utilisateur=user,
             action='UPDATE',
             model_name='CLIENT',
@@ -338,40 +317,16 @@ def desactiver_client(request, client_id):
         'user': user
     })
 
-@custom_login_required
+@connexion_requise
 def rapport_clients_pdf(request):
     """Génère un rapport PDF des clients"""
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     # Créer la réponse HTTP pour PDF
     response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="rapport_clients_{timezone.now().strftime("%Y%m%d_%H%M")}.pdf"'
     
-    # Créer le document PDF
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    story = []
-    
-    # Styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=30,
-        alignment=1  # Center
-    )
-    
-    # Titre
-    title = Paragraph("RAPPORT CLIENTS", title_style)
-    story.append(title)
-    story.append(Spacer(1, 12))
-    
-    # Date et heure
-    date_rapport = Paragraph(f"Généré le {timezone.now().strftime('%d/%m/%Y à %H:%M')}", styles['Normal'])
-    story.append(date_rapport)
-    story.append(Spacer(1, 20))
+    story = pdf.entete_rapport("RAPPORT CLIENTS")
     
     # Données des clients
     clients = CLIENT.objects.filter(actif=True).order_by('nom_societe')
@@ -384,32 +339,16 @@ def rapport_clients_pdf(request):
     }
     
     # Tableau des statistiques
-    stats_data = [
-        ['Statistiques Générales', ''],
+    story.append(pdf.tableau_statistiques([
         ['Total clients actifs', str(stats['total_clients'])],
         ['Clients acheteurs', str(stats['clients_acheteurs'])],
         ['Fournisseurs', str(stats['fournisseurs'])],
-    ]
-    
-    stats_table = Table(stats_data, colWidths=[3*inch, 2*inch])
-    stats_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
     ]))
-    
-    story.append(stats_table)
-    story.append(Spacer(1, 30))
+    story.append(pdf.espace(30))
     
     # Titre détail des clients
-    detail_title = Paragraph("LISTE DES CLIENTS", styles['Heading2'])
-    story.append(detail_title)
-    story.append(Spacer(1, 12))
+    story.append(pdf.paragraphe("LISTE DES CLIENTS", 'Heading2'))
+    story.append(pdf.espace(12))
     
     # Tableau des clients
     data = [['Code', 'Société', 'Email', 'Pays', 'Rôle', 'Date Création']]
@@ -424,40 +363,12 @@ def rapport_clients_pdf(request):
             client.date_creation.strftime('%d/%m/%Y')
         ])
     
-    table = Table(data, colWidths=[1*inch, 2*inch, 2*inch, 1*inch, 1*inch, 1*inch])
-    table.setStyle(TableStyle([
-        # En-tête
-        ('BACKGROUND', (0, 0), (-1, 0), colors.navy),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        
-        # Corps du tableau
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-    
-    story.append(table)
-    
-    # Pied de page
-    story.append(Spacer(1, 30))
-    footer = Paragraph(f"Rapport généré par {user.username} - FishFlow Manager", styles['Italic'])
-    story.append(footer)
-    
-    # Construire le PDF
-    doc.build(story)
-    
-    # Récupérer le contenu du buffer
-    pdf = buffer.getvalue()
-    buffer.close()
-    response.write(pdf)
+    story.append(pdf.tableau_rapport(data, [1, 2, 2, 1, 1, 1]))
+    story += pdf.pied_rapport(user.username)
+    response.write(pdf.construire(story, rapport=True))
     
     # Log de l'action
-    AuditLog.objects.create(
+    audit.journaliser(
         utilisateur=user,
         action='EXPORT',
         model_name='CLIENT',
@@ -468,7 +379,7 @@ def rapport_clients_pdf(request):
     
     return response
 
-@custom_login_required
+@connexion_requise
 def api_clients_stats(request):
     """API pour les statistiques clients"""
     try:
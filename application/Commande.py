@@ -2,37 +2,54 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.core.paginator import Paginator
 from django.db.models import Q, Sum, Count
-from django.http import JsonResponse, HttpResponse, Http404
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.conf import settings
 from django.template.loader import render_to_string
+from django.urls import reverse
 from django.http import FileResponse
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
+import csv
+import json
 from .models import (
-    Commande, LigneCommande, CLIENT, POISSON, User, Document, 
-    Facture, Livraison, EtapeTransport, MouvementStock
+    Commande, LigneCommande, CLIENT, POISSON, Document, 
+    Facture, Livraison, EtapeTransport, MouvementStock, FaitVente, FaitCommande, Televersement
 )
 from .forms import (
     CommandeForm, LigneCommandeForm, DocumentForm, FactureForm, 
-    LivraisonForm, EtapeTransportForm
+    LivraisonForm, EtapeTransportForm, ImportCommandesForm, TeleversementForm,
+    FacturationLotForm, ExportFacturesForm, ReleveBancaireForm
 )
+from .services import (
+    changer_statut, ajouter_lignes, charger_detail_commande, StockInsuffisantError
+)
+from .recherche import filtrer_recherche
+from .telechargement import reponse_fichier
+from .stockage import empreinte
+from .factures_pdf import obtenir_facture_pdf
+from .bons_commande import bon_a_jour, demander_bon_commande
+from .dossiers import obtenir_dossier
+from .facturation import commandes_a_facturer, facturer_commandes_livrees
+from .creances import TRANCHES, balance_agee, resume_retards
+from .tva import MONTANTS, declaration_tva, rendre_declaration_pdf
+from . import rapprochement
+from .journal import ecritures_a_exporter, exporter_journal_stockage, journaux_exportes
+from .exports import factures_a_exporter, zip_factures, nouvel_export, executer_export, etat_export
+from .jobs import lancer_apres_commit
+from .authentification import connexion_requise, connexion_requise_api
+from .televersements import (
+    creer_televersement, ecrire_bloc, terminer_televersement, TeleversementError
+)
+from .imports import analyser_csv, importer_commandes, COLONNES_OBLIGATOIRES, COLONNES_OPTIONNELLES
 from decimal import Decimal
 import os
 from datetime import datetime, timedelta
 from django.db import transaction
 
+@connexion_requise
 def commande_dashboard(request):
     """Dashboard des commandes avec statistiques"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     # Statistiques générales
     total_commandes = Commande.objects.count()
     commandes_en_cours = Commande.objects.filter(
@@ -77,11 +94,9 @@ def commande_dashboard(request):
     
     return render(request, 'commandes/dashboard.html', context)
 
+@connexion_requise
 def liste_commandes(request):
     """Liste des commandes avec filtres et pagination"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     commandes = Commande.objects.select_related('client').order_by('-date_creation')
     
     # Filtres
@@ -93,11 +108,7 @@ def liste_commandes(request):
     date_fin = request.GET.get('date_fin', '')
     
     if search:
-        commandes = commandes.filter(
-            Q(numero_commande__icontains=search) |
-            Q(client__nom_societe__icontains=search) |
-            Q(commentaire__icontains=search)
-        )
+        commandes = filtrer_recherche(commandes, search, 'numero_commande')
     
     if statut_filter:
         commandes = commandes.filter(statut=statut_filter)
@@ -139,17 +150,14 @@ def liste_commandes(request):
     
     return render(request, 'commandes/liste.html', context)
 
+@connexion_requise
 def ajouter_commande(request):
     """Ajouter une nouvelle commande"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     if request.method == 'POST':
         form = CommandeForm(request.POST)
         if form.is_valid():
             commande = form.save(commit=False)
-            user = User.objects.get(id=request.session['user_id'])
-            commande.utilisateur_creation = user
+            commande.utilisateur_creation = request.user
             commande.save()
             
             messages.success(request, f'Commande {commande.numero_commande} créée avec succès.')
@@ -159,38 +167,74 @@ def ajouter_commande(request):
     
     return render(request, 'commandes/ajouter.html', {'form': form})
 
-def detail_commande(request, commande_id):
-    """Détail d'une commande avec ses lignes et documents"""
-    if not request.session.get('user_id'):
-        return redirect('login')
+@connexion_requise
+def importer_commandes_csv(request):
+    """Importer des commandes et leurs lignes depuis un fichier CSV"""
+    chemin = request.session.get('import_commandes')
+    form = ImportCommandesForm()
+    rapport = None
+    
+    if request.method == 'POST' and 'annuler' in request.POST:
+        if chemin and default_storage.exists(chemin):
+            default_storage.delete(chemin)
+        request.session.pop('import_commandes', None)
+        messages.info(request, 'Import annulé.')
+        return redirect('importer_commandes_csv')
+    
+    if request.method == 'POST' and 'confirmer' in request.POST:
+        if not chemin or not default_storage.exists(chemin):
+            messages.error(request, 'Aucun fichier en attente d\'import.')
+            return redirect('importer_commandes_csv')
+        
+        # Le fichier est revalidé : le stock de produits ou de clients a pu changer
+        with default_storage.open(chemin) as fichier:
+            rapport = analyser_csv(fichier)
+        
+        if not rapport['erreurs']:
+            commandes = importer_commandes(rapport, request.user)
+            default_storage.delete(chemin)
+            request.session.pop('import_commandes', None)
+            messages.success(request, f'{len(commandes)} commande(s) importée(s) ({rapport["nb_lignes"]} lignes).')
+            return redirect('liste_commandes')
+    
+    elif request.method == 'POST':
+        form = ImportCommandesForm(request.POST, request.FILES)
+        if form.is_valid():
+            if chemin and default_storage.exists(chemin):
+                default_storage.delete(chemin)
+            chemin = default_storage.save(
+                f"imports/commandes_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                form.cleaned_data['fichier']
+            )
+            request.session['import_commandes'] = chemin
+            with default_storage.open(chemin) as fichier:
+                rapport = analyser_csv(fichier)
     
-    commande = get_object_or_404(Commande, id=commande_id)
-    lignes = LigneCommande.objects.filter(commande=commande).select_related('poisson')
-    documents = Document.objects.filter(commande=commande).order_by('-date_ajout')
-    factures = Facture.objects.filter(commande=commande)
-    livraisons = Livraison.objects.filter(commande=commande)
-    etapes_transport = EtapeTransport.objects.filter(commande=commande).order_by('date_depart')
+    context = {
+        'form': form,
+        'rapport': rapport,
+        'colonnes_obligatoires': COLONNES_OBLIGATOIRES,
+        'colonnes_optionnelles': COLONNES_OPTIONNELLES,
+    }
     
-    # Calcul du total
-    total_commande = sum(ligne.total_ligne or 0 for ligne in lignes)
+    return render(request, 'commandes/importer.html', context)
+
+@connexion_requise
+def detail_commande(request, commande_id):
+    """Détail d'une commande avec ses lignes et documents"""
+    commande, version = charger_detail_commande(commande_id)
     
     context = {
         'commande': commande,
-        'lignes': lignes,
-        'documents': documents,
-        'factures': factures,
-        'livraisons': livraisons,
-        'etapes_transport': etapes_transport,
-        'total_commande': total_commande,
+        'version': version,
+        'cache_timeout': settings.COMMANDE_DETAIL_CACHE_TIMEOUT,
     }
     
     return render(request, 'commandes/detail.html', context)
 
+@connexion_requise
 def modifier_commande(request, commande_id):
     """Modifier une commande existante"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     commande = get_object_or_404(Commande, id=commande_id)
     
     if request.method == 'POST':
@@ -209,11 +253,9 @@ def modifier_commande(request, commande_id):
     
     return render(request, 'commandes/modifier.html', context)
 
+@connexion_requise
 def ajouter_ligne_commande(request, commande_id):
     """Ajouter une ligne à une commande"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     commande = get_object_or_404(Commande, id=commande_id)
     
     if request.method == 'POST':
@@ -235,11 +277,49 @@ def ajouter_ligne_commande(request, commande_id):
     
     return render(request, 'commandes/ajouter_ligne.html', context)
 
-def modifier_ligne_commande(request, ligne_id):
-    """Modifier une ligne de commande"""
-    if not request.session.get('user_id'):
+def ajouter_lignes_commande(request, commande_id):
+    """Saisie en lot des lignes d'une commande (grille + API JSON)"""
+    if not request.user.is_authenticated:
+        if request.method == 'POST':
+            return JsonResponse({'error': 'Non autorisé'}, status=401)
         return redirect('login')
     
+    commande = get_object_or_404(Commande.objects.select_related('client'), id=commande_id)
+    
+    if request.method == 'POST':
+        try:
+            lignes_data = json.loads(request.body).get('lignes', [])
+        except (ValueError, AttributeError):
+            return JsonResponse({'success': False, 'error': 'Requête JSON invalide'}, status=400)
+        if not isinstance(lignes_data, list) or not lignes_data:
+            return JsonResponse({'success': False, 'error': 'Aucune ligne fournie'}, status=400)
+        
+        lignes, erreurs, total_commande = ajouter_lignes(commande, lignes_data)
+        if erreurs:
+            return JsonResponse({'success': False, 'erreurs': erreurs}, status=400)
+        
+        messages.success(request, f'{len(lignes)} ligne(s) ajoutée(s) à la commande.')
+        return JsonResponse({
+            'success': True,
+            'lignes_creees': len(lignes),
+            'total_commande': float(total_commande),
+            'redirect': reverse('detail_commande', args=[commande.id]),
+        })
+    
+    produits = POISSON.objects.filter(actif=True).order_by('type').values(
+        'id', 'code_produit', 'type', 'prix', 'unite_mesure'
+    )
+    
+    context = {
+        'commande': commande,
+        'produits': produits,
+    }
+    
+    return render(request, 'commandes/ajouter_lignes.html', context)
+
+@connexion_requise
+def modifier_ligne_commande(request, ligne_id):
+    """Modifier une ligne de commande"""
     ligne = get_object_or_404(LigneCommande, id=ligne_id)
     
     if request.method == 'POST':
@@ -259,11 +339,9 @@ def modifier_ligne_commande(request, ligne_id):
     
     return render(request, 'commandes/modifier_ligne.html', context)
 
+@connexion_requise
 def supprimer_ligne_commande(request, ligne_id):
     """Supprimer une ligne de commande"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     ligne = get_object_or_404(LigneCommande, id=ligne_id)
     commande_id = ligne.commande.id
     
@@ -276,11 +354,9 @@ def supprimer_ligne_commande(request, ligne_id):
 
 # === GESTION DES DOCUMENTS ===
 
+@connexion_requise
 def ajouter_document(request, commande_id):
     """Ajouter un document à une commande"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     commande = get_object_or_404(Commande, id=commande_id)
     
     if request.method == 'POST':
@@ -288,8 +364,7 @@ def ajouter_document(request, commande_id):
         if form.is_valid():
             document = form.save(commit=False)
             document.commande = commande
-            user = User.objects.get(id=request.session['user_id'])
-            document.utilisateur = user
+            document.utilisateur = request.user
             document.save()
             
             messages.success(request, 'Document ajouté avec succès.')
@@ -299,41 +374,121 @@ def ajouter_document(request, commande_id):
     
     context = {
         'form': form,
-        'commande': commande
+        'commande': commande,
+        'taille_bloc': settings.TELEVERSEMENT_TAILLE_BLOC,
+        'taille_max': settings.TELEVERSEMENT_TAILLE_MAX,
     }
     
     return render(request, 'commandes/ajouter_document.html', context)
 
+def _etat_televersement(televersement):
+    return {
+        'id': str(televersement.id),
+        'taille_bloc': televersement.taille_bloc,
+        'nb_blocs': televersement.nb_blocs,
+        'blocs_recus': televersement.blocs_recus,
+    }
+
+@connexion_requise_api
+def televersement_document(request, commande_id):
+    """Ouvre un téléversement par blocs (API JSON)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
+    
+    commande = get_object_or_404(Commande, id=commande_id)
+    try:
+        donnees = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Requête JSON invalide'}, status=400)
+    
+    form = TeleversementForm(donnees)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'erreurs': form.errors}, status=400)
+    
+    televersement = creer_televersement(commande, request.user, form.cleaned_data)
+    return JsonResponse({'success': True, **_etat_televersement(televersement)}, status=201)
+
+@connexion_requise_api
+def bloc_televersement(request, televersement_id, numero=None):
+    """
+    GET : état du téléversement (pour reprendre après une coupure).
+    PUT : envoi du bloc `numero`, corps brut application/octet-stream.
+    """
+    televersement = get_object_or_404(Televersement, id=televersement_id)
+    if request.method == 'GET':
+        return JsonResponse({'success': True, **_etat_televersement(televersement)})
+    if request.method != 'PUT' or numero is None:
+        return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
+    
+    try:
+        televersement.blocs_recus = ecrire_bloc(televersement, numero, request)
+    except TeleversementError as e:
+        return JsonResponse({'success': False, 'error': str(e), **_etat_televersement(televersement)}, status=409)
+    return JsonResponse({'success': True, **_etat_televersement(televersement)})
+
+@connexion_requise_api
+def terminer_televersement_document(request, televersement_id):
+    """Assemble les blocs reçus et crée le Document (API JSON)"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
+    
+    televersement = get_object_or_404(Televersement, id=televersement_id)
+    try:
+        document = terminer_televersement(televersement)
+    except TeleversementError as e:
+        return JsonResponse({'success': False, 'error': str(e), **_etat_televersement(televersement)}, status=409)
+    
+    messages.success(request, 'Document ajouté avec succès.')
+    return JsonResponse({
+        'success': True,
+        'document_id': document.id,
+        'redirect': reverse('detail_commande', args=[document.commande_id]),
+    })
+
+@connexion_requise
 def telecharger_document(request, document_id):
     """Télécharger un document"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     document = get_object_or_404(Document, id=document_id)
     
-    if default_storage.exists(document.fichier.name):
-        response = HttpResponse(
-            default_storage.open(document.fichier.name).read(),
-            content_type='application/octet-stream'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{document.nom_document}"'
-        return response
-    else:
-        raise Http404("Document non trouvé")
+    # Le nom affiché peut ne pas avoir d'extension : on reprend celle du fichier stocké
+    nom = document.nom_document
+    extension = os.path.splitext(document.fichier.name)[1]
+    if extension and not nom.lower().endswith(extension.lower()):
+        nom += extension
+    # Un fichier adressé par contenu a son empreinte comme ETag
+    sha = empreinte(document.fichier.name)
+    return reponse_fichier(
+        request, document.fichier.name, nom, etag=f'"{sha}"' if sha else None,
+        storage=document.fichier.storage
+    )
+
+@connexion_requise
+def apercu_document(request, document_id):
+    """Miniature d'un document, affichée sur la page détail commande"""
+    document = get_object_or_404(Document.objects.only('apercu'), id=document_id)
+    if not document.apercu:
+        raise Http404("Aperçu non disponible")
+    
+    sha = empreinte(document.apercu.name)
+    response = reponse_fichier(
+        request, document.apercu.name, f'apercu_{document.id}.jpg',
+        content_type='image/jpeg', etag=f'"{sha}"' if sha else None, en_ligne=True,
+        storage=document.apercu.storage
+    )
+    # Le nom du fichier est l'empreinte de son contenu : il ne change jamais
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
 
+@connexion_requise
 def supprimer_document(request, document_id):
     """Supprimer un document"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     document = get_object_or_404(Document, id=document_id)
     commande_id = document.commande.id
     
     if request.method == 'POST':
-        # Supprimer le fichier physique
-        if default_storage.exists(document.fichier.name):
-            default_storage.delete(document.fichier.name)
-        
+        # Le fichier physique peut être partagé avec d'autres documents : il
+        # reste en place, la commande purger_fichiers_orphelins l'efface une
+        # fois qu'aucun document ne le référence plus
         document.delete()
         messages.success(request, 'Document supprimé avec succès.')
         return redirect('detail_commande', commande_id=commande_id)
@@ -345,11 +500,9 @@ def supprimer_document(request, document_id):
 
 # === GESTION DES FACTURES ===
 
+@connexion_requise
 def generer_facture(request, commande_id):
     """Générer une facture pour une commande"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     commande = get_object_or_404(Commande, id=commande_id)
     lignes = LigneCommande.objects.filter(commande=commande)
     
@@ -360,8 +513,7 @@ def generer_facture(request, commande_id):
                 facture = form.save(commit=False)
                 facture.commande = commande
                 facture.client = commande.client
-                user = User.objects.get(id=request.session['user_id'])
-                facture.utilisateur_creation = user
+                facture.utilisateur_creation = request.user
                 
                 # Calculer les montants
                 montant_ht = sum(ligne.total_ligne or 0 for ligne in lignes)
@@ -396,11 +548,9 @@ def generer_facture(request, commande_id):
     
     return render(request, 'commandes/generer_facture.html', context)
 
+@connexion_requise
 def detail_facture(request, facture_id):
     """Détail d'une facture"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     facture = get_object_or_404(Facture, id=facture_id)
     lignes = facture.ligne_commande.all()
     
@@ -411,11 +561,86 @@ def detail_facture(request, facture_id):
     
     return render(request, 'commandes/detail_facture.html', context)
 
+@connexion_requise
+def facturation_lot(request):
+    """Facturer en une fois toutes les commandes livrées sans facture"""
+    factures = None
+    if request.method == 'POST':
+        form = FacturationLotForm(request.POST)
+        if form.is_valid():
+            factures = facturer_commandes_livrees(request.user, **form.cleaned_data)
+            if factures:
+                messages.success(request, f'{len(factures)} facture(s) générée(s).')
+            else:
+                messages.info(request, 'Aucune commande livrée à facturer.')
+    else:
+        form = FacturationLotForm()
+    
+    a_facturer = commandes_a_facturer()
+    resume = a_facturer.aggregate(
+        nombre=Count('id', distinct=True),
+        total_ht=Sum('lignecommande__total_ligne'),
+    )
+    apercu = a_facturer.select_related('client').annotate(
+        total_ht=Sum('lignecommande__total_ligne')
+    ).order_by('id')[:50]
+    
+    context = {
+        'form': form,
+        'resume': resume,
+        'apercu': apercu,
+        'factures': factures,
+    }
+    
+    return render(request, 'commandes/facturation_lot.html', context)
+
+@connexion_requise
+def export_factures(request):
+    """Export des factures filtrées en archive ZIP de PDF"""
+    suivi = request.GET.get('suivi')
+    form = ExportFacturesForm(request.GET if request.GET and not suivi else None)
+    if form.is_bound and form.is_valid():
+        filtres = {
+            'date_debut': form.cleaned_data['date_debut'],
+            'date_fin': form.cleaned_data['date_fin'],
+            'client': form.cleaned_data['client'],
+            'statut': form.cleaned_data['statut'],
+        }
+        factures = factures_a_exporter(**filtres)
+        if not factures.exists():
+            messages.warning(request, 'Aucune facture ne correspond aux filtres.')
+        elif 'arriere_plan' in request.GET:
+            # Export en tâche de fond avec suivi de l'avancement
+            export_id = nouvel_export(factures.count())
+            filtres['client'] = filtres['client'].id if filtres['client'] else None
+            lancer_apres_commit(executer_export, export_id, filtres)
+            return redirect(f"{reverse('export_factures')}?suivi={export_id}")
+        else:
+            # Archive envoyée au fur et à mesure du rendu des PDF
+            response = StreamingHttpResponse(zip_factures(factures), content_type='application/zip')
+            response['Content-Disposition'] = f'attachment; filename="factures_{timezone.now():%Y%m%d_%H%M%S}.zip"'
+            return response
+    
+    context = {
+        'form': form,
+        'suivi': suivi,
+    }
+    
+    return render(request, 'commandes/export_factures.html', context)
+
+@connexion_requise_api
+def etat_export_factures(request, export_id):
+    """Avancement d'un export en tâche de fond (JSON), ou l'archive une fois prête"""
+    etat = etat_export(export_id)
+    if etat is None:
+        raise Http404("Export inconnu ou expiré")
+    if 'telecharger' in request.GET and etat.get('fichier'):
+        return reponse_fichier(request, etat['fichier'], f'factures_{export_id[:8]}.zip', content_type='application/zip')
+    return JsonResponse(etat)
+
+@connexion_requise
 def liste_factures(request):
     """Liste des factures"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     factures = Facture.objects.select_related('client', 'commande').order_by('-date_emission')
     
     # Filtres
@@ -424,10 +649,7 @@ def liste_factures(request):
     client_filter = request.GET.get('client', '')
     
     if search:
-        factures = factures.filter(
-            Q(numero_facture__icontains=search) |
-            Q(client__nom_societe__icontains=search)
-        )
+        factures = filtrer_recherche(factures, search, 'numero_facture')
     
     if statut_filter:
         factures = factures.filter(statut=statut_filter)
@@ -440,22 +662,198 @@ def liste_factures(request):
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
+    maintenant = timezone.now()
     context = {
         'page_obj': page_obj,
         'search': search,
         'statut_filter': statut_filter,
         'client_filter': client_filter,
+        'maintenant': maintenant,
+        'retards': resume_retards(maintenant),
     }
     
     return render(request, 'commandes/liste_factures.html', context)
 
+@connexion_requise
+def rapprochement_bancaire(request):
+    """Rapprocher un relevé bancaire (CSV) des factures ouvertes et enregistrer les règlements"""
+    chemin = request.session.get('rapprochement')
+    form = ReleveBancaireForm()
+    rapport = None
+    
+    if request.method == 'POST' and 'annuler' in request.POST:
+        if chemin and default_storage.exists(chemin):
+            default_storage.delete(chemin)
+        request.session.pop('rapprochement', None)
+        messages.info(request, 'Rapprochement annulé.')
+        return redirect('rapprochement_bancaire')
+    
+    if request.method == 'POST' and 'confirmer' in request.POST:
+        if not chemin or not default_storage.exists(chemin):
+            messages.error(request, 'Aucun relevé en attente de rapprochement.')
+            return redirect('rapprochement_bancaire')
+        
+        # Les propositions appliquées sont celles de l'aperçu, conservées à
+        # l'analyse ; celles dont une facture a changé depuis sont refusées
+        with default_storage.open(chemin) as fichier:
+            figees = json.load(fichier)
+        acceptees = {int(ligne) for ligne in request.POST.getlist('accepter') if ligne.isdigit()}
+        nb_lignes, factures, refusees = rapprochement.appliquer_rapprochement(figees, acceptees, request.user)
+        default_storage.delete(chemin)
+        request.session.pop('rapprochement', None)
+        payees = sum(1 for facture in factures if facture.statut == 'payee')
+        messages.success(
+            request,
+            f'{nb_lignes} règlement(s) enregistré(s) : {len(factures)} facture(s) mise(s) à jour, dont {payees} soldée(s).'
+        )
+        if refusees:
+            messages.warning(
+                request,
+                f"Ligne(s) {', '.join(str(ligne) for ligne in refusees)} non enregistrée(s) : "
+                "facture modifiée ou relevé déjà rapproché depuis l'analyse."
+            )
+        return redirect('liste_factures')
+    
+    elif request.method == 'POST':
+        form = ReleveBancaireForm(request.POST, request.FILES)
+        if form.is_valid():
+            if chemin and default_storage.exists(chemin):
+                default_storage.delete(chemin)
+            rapport = rapprochement.analyser_releve(form.cleaned_data['fichier'])
+            chemin = default_storage.save(
+                f"imports/rapprochement_{timezone.now().strftime('%Y%m%d_%H%M%S')}.json",
+                ContentFile(json.dumps(rapprochement.figer_propositions(rapport)).encode())
+            )
+            request.session['rapprochement'] = chemin
+    
+    context = {
+        'form': form,
+        'rapport': rapport,
+        'colonnes_obligatoires': rapprochement.COLONNES_OBLIGATOIRES,
+        'colonnes_optionnelles': rapprochement.COLONNES_OPTIONNELLES,
+        # Propositions cochées par défaut : rapprochement sûr
+        'resultats_surs': [rapprochement.EXACT, rapprochement.MULTIPLE],
+    }
+    
+    return render(request, 'commandes/rapprochement.html', context)
+
+@connexion_requise
+def journal_comptable(request):
+    """Export du journal des ventes : écritures comptables non encore exportées"""
+    if request.method == 'POST':
+        nom, total = exporter_journal_stockage()
+        if total:
+            messages.success(request, f'{total} écriture(s) exportée(s) dans {os.path.basename(nom)}.')
+        else:
+            messages.info(request, 'Aucune écriture à exporter.')
+        return redirect('journal_comptable')
+    
+    context = {
+        'a_exporter': ecritures_a_exporter().count(),
+        'journaux': [os.path.basename(nom) for nom in journaux_exportes()],
+    }
+    return render(request, 'commandes/journal_comptable.html', context)
+
+@connexion_requise
+def telecharger_journal(request, nom):
+    """Télécharger un journal déjà exporté"""
+    chemin = f'journaux/{nom}'
+    if chemin not in journaux_exportes():
+        raise Http404("Journal introuvable")
+    return reponse_fichier(request, chemin, nom, content_type='text/csv')
+
+@connexion_requise
+def balance_agee_factures(request):
+    """Balance âgée des créances par client et tranche de retard (HTML ou CSV)"""
+    maintenant = timezone.now()
+    lignes, total = balance_agee(maintenant)
+    
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="balance_agee_{maintenant.strftime("%Y%m%d")}.csv"'
+        response.write('\ufeff')  # BOM : accents lisibles dans Excel
+        writer = csv.writer(response, delimiter=';')
+        writer.writerow(['Client'] + [libelle for _, libelle, *_ in TRANCHES] + ['Total', 'Factures'])
+        for ligne in lignes + [dict(total, client__nom_societe='TOTAL')]:
+            writer.writerow(
+                [ligne['client__nom_societe']]
+                + [f"{ligne[cle]:.2f}" for cle, *_ in TRANCHES]
+                + [f"{ligne['total']:.2f}", ligne['nombre']]
+            )
+        return response
+    
+    # Montants et nombres par tranche, dans l'ordre des colonnes
+    for ligne in lignes + [total]:
+        ligne['tranches'] = [(ligne[cle], ligne[f'{cle}_nombre']) for cle, *_ in TRANCHES]
+    
+    context = {
+        'lignes': lignes,
+        'total': total,
+        'tranches': TRANCHES,
+        'maintenant': maintenant,
+    }
+    return render(request, 'commandes/balance_agee.html', context)
+
+def _mois_parametre(valeur, defaut):
+    """Mois saisi au format AAAA-MM (champ <input type="month">), premier jour du mois"""
+    try:
+        return datetime.strptime(valeur, '%Y-%m').date()
+    except (TypeError, ValueError):
+        return defaut
+
+@connexion_requise
+def declaration_tva_factures(request):
+    """Déclaration de TVA d'une période, lue dans les cumuls mensuels (HTML, CSV ou PDF)"""
+    # Par défaut : le dernier mois terminé
+    mois_courant = timezone.localdate().replace(day=1)
+    mois_precedent = (mois_courant - timedelta(days=1)).replace(day=1)
+    debut = _mois_parametre(request.GET.get('debut'), mois_precedent)
+    fin = _mois_parametre(request.GET.get('fin'), debut)
+    if fin < debut:
+        debut, fin = fin, debut
+    
+    par_taux, par_mois, total = declaration_tva(debut, fin)
+    nom_fichier = f"declaration_tva_{debut:%Y%m}_{fin:%Y%m}"
+    
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{nom_fichier}.csv"'
+        response.write('\ufeff')  # BOM : accents lisibles dans Excel
+        writer = csv.writer(response, delimiter=';')
+        writer.writerow(['Mois', 'Taux TVA', 'Factures', 'Montant HT', 'TVA', 'Montant TTC'])
+        for ligne in par_mois:
+            writer.writerow(
+                [ligne['mois'].strftime('%m/%Y'), f"{ligne['taux_tva']:.2f}", ligne['nombre']]
+                + [f"{ligne[champ]:.2f}" for champ in MONTANTS]
+            )
+        for ligne in par_taux:
+            writer.writerow(
+                ['TOTAL', f"{ligne['taux_tva']:.2f}", ligne['nombre']]
+                + [f"{ligne[champ]:.2f}" for champ in MONTANTS]
+            )
+        writer.writerow(['TOTAL', '', total['nombre']] + [f"{total[champ]:.2f}" for champ in MONTANTS])
+        return response
+    
+    if request.GET.get('format') == 'pdf':
+        response = HttpResponse(content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{nom_fichier}.pdf"'
+        response.write(rendre_declaration_pdf(debut, fin, par_taux, par_mois, total, request.user.username))
+        return response
+    
+    context = {
+        'debut': debut,
+        'fin': fin,
+        'par_taux': par_taux,
+        'par_mois': par_mois,
+        'total': total,
+    }
+    return render(request, 'commandes/declaration_tva.html', context)
+
 # === GESTION DES LIVRAISONS ===
 
+@connexion_requise
 def ajouter_livraison(request, commande_id):
     """Ajouter une livraison à une commande"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     commande = get_object_or_404(Commande, id=commande_id)
     
     if request.method == 'POST':
@@ -479,11 +877,9 @@ def ajouter_livraison(request, commande_id):
 
 # === GESTION DU TRANSPORT ===
 
+@connexion_requise
 def ajouter_etape_transport(request, commande_id):
     """Ajouter une étape de transport"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     commande = get_object_or_404(Commande, id=commande_id)
     
     # Vérifier que ce n'est pas une commande locale
@@ -510,186 +906,70 @@ def ajouter_etape_transport(request, commande_id):
     
     return render(request, 'commandes/ajouter_etape_transport.html', context)
 
+@connexion_requise
 def changer_statut_commande(request, commande_id):
     """Changer le statut d'une commande"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
     commande = get_object_or_404(Commande, id=commande_id)
     nouveau_statut = request.POST.get('statut')
-    ancien_statut = commande.statut
     
     if nouveau_statut in dict(Commande.STATUT_CHOICES):
-        commande.statut = nouveau_statut
-        commande.save()
-        
-        # Gestion automatique des mouvements de stock selon le type de commande
-        if nouveau_statut == 'CONFIRMEE' and ancien_statut != 'CONFIRMEE':
-            # Quand une commande est confirmée, gérer le stock selon le type
-            for ligne in commande.lignecommande_set.all():
-                if commande.type_commande == 'EXPORT':
-                    # Pour l'export : diminuer le stock (sortie de produits)
-                    if ligne.poisson.quantite_stock >= ligne.quantite:
-                        MouvementStock.objects.create(
-                            poisson=ligne.poisson,
-                            type_mouvement='SORTIE',
-                            quantite=ligne.quantite,
-                            commande=commande,
-                            utilisateur_id=request.session['user_id'],
-                            motif=f'Confirmation commande EXPORT {commande.numero_commande}'
-                        )
-                        # Mettre à jour le stock
-                        ligne.poisson.quantite_stock -= ligne.quantite
-                        ligne.poisson.save()
-                        
-                        messages.info(request, f'Stock diminué de {ligne.quantite} {ligne.poisson.unite_mesure} pour {ligne.poisson.type}')
-                    else:
-                        messages.warning(request, f'Stock insuffisant pour {ligne.poisson.type} (disponible: {ligne.poisson.quantite_stock}, demandé: {ligne.quantite})')
-                
-                elif commande.type_commande == 'IMPORT':
-                    # Pour l'import : augmenter le stock (entrée de produits)
-                    MouvementStock.objects.create(
-                        poisson=ligne.poisson,
-                        type_mouvement='ENTREE',
-                        quantite=ligne.quantite,
-                        commande=commande,
-                        utilisateur_id=request.session['user_id'],
-                        motif=f'Confirmation commande IMPORT {commande.numero_commande}'
-                    )
-                    # Mettre à jour le stock
-                    ligne.poisson.quantite_stock += ligne.quantite
-                    ligne.poisson.save()
-                    
-                    messages.info(request, f'Stock augmenté de {ligne.quantite} {ligne.poisson.unite_mesure} pour {ligne.poisson.type}')
-                
-                elif commande.type_commande == 'LOCAL':
-                    # Pour le local : diminuer le stock (vente locale)
-                    if ligne.poisson.quantite_stock >= ligne.quantite:
-                        MouvementStock.objects.create(
-                            poisson=ligne.poisson,
-                            type_mouvement='SORTIE',
-                            quantite=ligne.quantite,
-                            commande=commande,
-                            utilisateur_id=request.session['user_id'],
-                            motif=f'Confirmation commande LOCAL {commande.numero_commande}'
-                        )
-                        # Mettre à jour le stock
-                        ligne.poisson.quantite_stock -= ligne.quantite
-                        ligne.poisson.save()
-                        
-                        messages.info(request, f'Stock diminué de {ligne.quantite} {ligne.poisson.unite_mesure} pour {ligne.poisson.type}')
-                    else:
-                        messages.warning(request, f'Stock insuffisant pour {ligne.poisson.type} (disponible: {ligne.poisson.quantite_stock}, demandé: {ligne.quantite})')
-        
-        # Gestion pour annulation d'une commande confirmée (restaurer le stock)
-        elif nouveau_statut == 'ANNULEE' and ancien_statut == 'CONFIRMEE':
-            for ligne in commande.lignecommande_set.all():
-                if commande.type_commande in ['EXPORT', 'LOCAL']:
-                    # Restaurer le stock (annuler la sortie)
-                    MouvementStock.objects.create(
-                        poisson=ligne.poisson,
-                        type_mouvement='RETOUR',
-                        quantite=ligne.quantite,
-                        commande=commande,
-                        utilisateur_id=request.session['user_id'],
-                        motif=f'Annulation commande {commande.type_commande} {commande.numero_commande}'
-                    )
-                    # Remettre le stock
-                    ligne.poisson.quantite_stock += ligne.quantite
-                    ligne.poisson.save()
-                    
-                    messages.info(request, f'Stock restauré: +{ligne.quantite} {ligne.poisson.unite_mesure} pour {ligne.poisson.type}')
-                
-                elif commande.type_commande == 'IMPORT':
-                    # Annuler l'entrée de stock
-                    MouvementStock.objects.create(
-                        poisson=ligne.poisson,
-                        type_mouvement='AJUSTEMENT',
-                        quantite=-ligne.quantite,
-                        commande=commande,
-                        utilisateur_id=request.session['user_id'],
-                        motif=f'Annulation commande IMPORT {commande.numero_commande}'
-                    )
-                    # Diminuer le stock (annuler l'import)
-                    ligne.poisson.quantite_stock -= ligne.quantite
-                    if ligne.poisson.quantite_stock < 0:
-                        ligne.poisson.quantite_stock = 0
-                    ligne.poisson.save()
-                    
-                    messages.info(request, f'Stock ajusté: -{ligne.quantite} {ligne.poisson.unite_mesure} pour {ligne.poisson.type}')
-        
-        # Gestion pour livraison (si pas déjà fait à la confirmation)
-        elif nouveau_statut == 'LIVREE' and commande.type_commande in ['EXPORT', 'LOCAL'] and ancien_statut != 'CONFIRMEE':
-            # Seulement si le stock n'a pas été déjà géré à la confirmation
-            for ligne in commande.lignecommande_set.all():
-                # Vérifier si un mouvement de stock existe déjà pour cette commande
-                mouvement_existant = MouvementStock.objects.filter(
-                    commande=commande,
-                    poisson=ligne.poisson,
-                    type_mouvement='SORTIE'
-                ).exists()
-                
-                if not mouvement_existant:
-                    if ligne.poisson.quantite_stock >= ligne.quantite:
-                        MouvementStock.objects.create(
-                            poisson=ligne.poisson,
-                            type_mouvement='SORTIE',
-                            quantite=ligne.quantite,
-                            commande=commande,
-                            utilisateur_id=request.session['user_id'],
-                            motif=f'Livraison commande {commande.numero_commande}'
-                        )
-                        # Mettre à jour le stock
-                        ligne.poisson.quantite_stock -= ligne.quantite
-                        ligne.poisson.save()
-                    else:
-                        messages.warning(request, f'Stock insuffisant pour livraison: {ligne.poisson.type}')
+        try:
+            mouvements = changer_statut(commande.id, nouveau_statut, request.user.id)
+        except StockInsuffisantError as e:
+            for manque in e.manques:
+                messages.warning(request, f"Stock insuffisant pour {manque['produit']} (disponible: {manque['disponible']}, demandé: {manque['demande']})")
+            messages.error(request, 'Statut inchangé : le stock ne couvre pas toute la commande.')
+            return redirect('detail_commande', commande_id=commande_id)
         
+        if mouvements:
+            messages.info(request, f'{len(mouvements)} mouvement(s) de stock enregistré(s).')
+        if nouveau_statut == 'CONFIRMEE':
+            # Le bon de commande est produit en arrière-plan, la réponse n'attend pas
+            demander_bon_commande(commande.id, request.user.id)
         messages.success(request, f'Statut changé vers "{dict(Commande.STATUT_CHOICES)[nouveau_statut]}"')
     
     return redirect('detail_commande', commande_id=commande_id)
 
+@connexion_requise
 def rapport_commandes(request):
-    """Rapport des commandes"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
+    """Rapport des commandes, calculé sur les tables de faits"""
     # Filtres de date
     date_debut = request.GET.get('date_debut', (timezone.now() - timedelta(days=30)).date())
     date_fin = request.GET.get('date_fin', timezone.now().date())
     
-    commandes = Commande.objects.filter(
-        date_creation__date__range=[date_debut, date_fin]
-    ).select_related('client')
-    
-    # Statistiques
-    ca_total = commandes.filter(statut='LIVREE').aggregate(
-        total=Sum('lignecommande__total_ligne')
-    )['total'] or 0
+    # Comptages sur les faits de commande (une ligne par commande, même sans
+    # ligne de commande), chiffre d'affaires sur les faits de vente
+    ventes = FaitVente.objects.filter(date__range=[date_debut, date_fin])
+    commandes = FaitCommande.objects.filter(date__range=[date_debut, date_fin])
     
-    total_commandes = commandes.count()
-    panier_moyen = ca_total / total_commandes if total_commandes > 0 else 0
+    totaux = commandes.aggregate(
+        total_commandes=Count('id'),
+        commandes_livrees=Count('id', filter=Q(statut='LIVREE')),
+    )
+    ca_total = ventes.filter(statut='LIVREE').aggregate(total=Sum('montant'))['total'] or 0
+    commandes_livrees = totaux['commandes_livrees']
+    panier_moyen = ca_total / commandes_livrees if commandes_livrees > 0 else 0
+    
+    top_clients = list(ventes.values('client_id', 'client__nom_societe').annotate(
+        ca=Sum('montant')
+    ).order_by('-ca')[:10])
+    nb_commandes = dict(
+        commandes.filter(client_id__in=[client['client_id'] for client in top_clients])
+        .values('client_id').annotate(n=Count('id')).values_list('client_id', 'n')
+    )
+    for client in top_clients:
+        client['nb_commandes'] = nb_commandes.get(client['client_id'], 0)
     
     stats = {
-        'total_commandes': total_commandes,
+        'total_commandes': totaux['total_commandes'],
         'ca_total': ca_total,
         'panier_moyen': panier_moyen,
-        'commandes_par_statut': commandes.values('statut').annotate(
-            count=Count('id')
-        ),
-        'commandes_par_type': commandes.values('type_commande').annotate(
-            count=Count('id')
-        ),
-        'top_clients': commandes.values(
-            'client__nom_societe'
-        ).annotate(
-            nb_commandes=Count('id'),
-            ca=Sum('lignecommande__total_ligne')
-        ).order_by('-ca')[:10]
+        'commandes_par_statut': commandes.values('statut').annotate(count=Count('id')).order_by('statut'),
+        'commandes_par_type': commandes.values('type_commande').annotate(count=Count('id')).order_by('type_commande'),
+        'top_clients': top_clients,
     }
     
     context = {
-        'commandes': commandes,
         'stats': stats,
         'date_debut': date_debut,
         'date_fin': date_fin,
@@ -697,11 +977,9 @@ def rapport_commandes(request):
     
     return render(request, 'commandes/rapport.html', context)
 
+@connexion_requise_api
 def api_commandes_data(request):
     """API pour les données de commandes (graphiques)"""
-    if not request.session.get('user_id'):
-        return JsonResponse({'error': 'Non autorisé'}, status=401)
-    
     periode = int(request.GET.get('periode', 30))
     date_debut = timezone.now() - timedelta(days=periode)
     
@@ -720,380 +998,56 @@ def api_commandes_data(request):
         'ca_quotidien': ca_quotidien
     })
 
+@connexion_requise
 def telecharger_facture_pdf(request, facture_id):
     """Générer et télécharger une facture en PDF"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
-    facture = get_object_or_404(Facture, id=facture_id)
-    lignes = facture.ligne_commande.all()
-    
-    # Créer un buffer pour le PDF
-    buffer = io.BytesIO()
-    
-    # Créer le document PDF
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72,
-                           topMargin=72, bottomMargin=18)
-    
-    # Styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        textColor=colors.HexColor('#2563eb'),
-        alignment=1  # Center alignment
+    facture = get_object_or_404(
+        Facture.objects.select_related('client').prefetch_related('ligne_commande__poisson'),
+        id=facture_id
     )
-    
-    header_style = ParagraphStyle(
-        'HeaderStyle',
-        parent=styles['Normal'],
-        fontSize=12,
-        textColor=colors.HexColor('#1e40af'),
-        spaceAfter=12
-    )
-    
-    # Contenu du PDF
-    elements = []
-    
-    # En-tête avec logo virtuel
-    elements.append(Paragraph(f"FACTURE {facture.numero_facture}", title_style))
-    elements.append(Spacer(1, 20))
-    
-    # Informations de l'entreprise et du client
-    company_data = [
-        ['VOTRE ENTREPRISE', f'Facturé à: {facture.client.nom_societe}'],
-        ['Export/Import Poisson', facture.client.adresse or 'Adresse non renseignée'],
-        ['Casablanca, Maroc', f'Email: {facture.client.email}'],
-        ['Tél: +212 xxx xxx xxx', f'ICE: {facture.client.numero_ice or "N/A"}'],
-        ['Email: contact@entreprise.ma', f'RC: {facture.client.numero_registre_commerce or "N/A"}'],
-        ['', ''],
-        ['Date émission:', facture.date_emission.strftime("%d/%m/%Y")],
-        ['Date échéance:', facture.date_echeance.strftime("%d/%m/%Y")],
-        ['Mode de paiement:', facture.get_mode_paiement_display()],
-        ['Statut:', facture.get_statut_display()],
-    ]
-    
-    company_table = Table(company_data, colWidths=[3*inch, 3*inch])
-    company_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, 4), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BACKGROUND', (0, 0), (0, 4), colors.HexColor('#f0f9ff')),
-        ('BACKGROUND', (1, 0), (1, 0), colors.HexColor('#f0f9ff')),
-        ('LINEBELOW', (0, 5), (-1, 5), 1, colors.HexColor('#e2e8f0')),
-        ('FONTNAME', (0, 6), (-1, -1), 'Helvetica-Bold'),
-        ('TEXTCOLOR', (0, 6), (-1, -1), colors.HexColor('#2563eb')),
-    ]))
-    
-    elements.append(company_table)
-    elements.append(Spacer(1, 30))
-    
-    # Titre du tableau des articles
-    elements.append(Paragraph("DÉTAIL DES ARTICLES", header_style))
-    elements.append(Spacer(1, 10))
-    
-    # Tableau des articles
-    articles_data = [['Produit', 'Code', 'Quantité', 'Prix Unitaire', 'Total HT']]
-    
-    for ligne in lignes:
-        articles_data.append([
-            ligne.poisson.type,
-            ligne.poisson.code_produit,
-            f"{ligne.quantite} {ligne.poisson.unite_mesure}",
-            f"{ligne.prix_unitaire} MAD",
-            f"{ligne.total_ligne} MAD"
-        ])
-    
-    articles_table = Table(articles_data, colWidths=[2*inch, 1*inch, 1.5*inch, 1.5*inch, 1.5*inch])
-    articles_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2563eb')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8fafc')]),
-        ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),  # Aligner les montants à droite
-    ]))
-    
-    elements.append(articles_table)
-    elements.append(Spacer(1, 30))
-    
-    # Totaux
-    totaux_data = [
-        ['', '', '', 'Sous-total HT:', f"{facture.montant_ht} MAD"],
-        ['', '', '', f'TVA ({facture.taux_tva}%):', f"{facture.montant_tva} MAD"],
-        ['', '', '', 'Total TTC:', f"{facture.montant_ttc} MAD"],
-    ]
-    
-    totaux_table = Table(totaux_data, colWidths=[1.5*inch, 1.5*inch, 1.5*inch, 1.5*inch, 1.5*inch])
-    totaux_table.setStyle(TableStyle([
-        ('ALIGN', (3, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (3, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (3, 0), (-1, -1), 11),
-        ('FONTNAME', (3, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (3, -1), (-1, -1), 14),
-        ('BACKGROUND', (3, -1), (-1, -1), colors.HexColor('#f0fdf4')),
-        ('TEXTCOLOR', (3, -1), (-1, -1), colors.HexColor('#059669')),
-        ('LINEABOVE', (3, -1), (-1, -1), 2, colors.HexColor('#059669')),
-        ('BOTTOMPADDING', (3, 0), (-1, -1), 10),
-        ('TOPPADDING', (3, 0), (-1, -1), 10),
-        ('GRID', (3, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),
-    ]))
-    
-    elements.append(totaux_table)
-    elements.append(Spacer(1, 40))
-    
-    # Pied de page avec conditions
-    footer_text = """
-    <para align="center" fontSize="8" textColor="#6b7280">
-    <b>CONDITIONS DE PAIEMENT:</b><br/>
-    Paiement à réception de facture - Tout retard de paiement entraînera des pénalités<br/>
-    En cas de retard de paiement, une pénalité de 3 fois le taux d'intérêt légal sera appliquée<br/>
-    <br/>
-    <b>Merci de votre confiance</b>
-    </para>
-    """
-    elements.append(Paragraph(footer_text, styles['Normal']))
-    
-    # Construire le PDF
-    doc.build(elements)
-    
-    # Récupérer le contenu du buffer
-    buffer.seek(0)
-    
-    # Créer la réponse HTTP avec headers pour forcer le téléchargement
-    response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
+    # PDF stocké par clé de contenu : rendu seulement si la facture a changé
+    nom, cle = obtenir_facture_pdf(facture)
     filename = f"facture_{facture.numero_facture}_{facture.client.nom_societe.replace(' ', '_')}.pdf"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    response['Content-Length'] = len(buffer.getvalue())
-    
-    return response
+    return reponse_fichier(request, nom, filename, content_type='application/pdf', etag=f'"{cle}"')
 
+@connexion_requise
+def telecharger_dossier(request, commande_id):
+    """Dossier complet de la commande (bon de commande, factures, documents) en un seul PDF"""
+    commande = get_object_or_404(Commande.objects.select_related('client'), id=commande_id)
+    nom, cle = obtenir_dossier(commande)
+    return reponse_fichier(
+        request, nom, f'dossier_{commande.numero_commande}.pdf',
+        content_type='application/pdf', etag=f'"{cle}"'
+    )
+
+@connexion_requise
 def generer_bon_commande(request, commande_id):
-    """Générer un bon de commande en PDF et le stocker automatiquement"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
-    commande = get_object_or_404(Commande, id=commande_id)
-    lignes = LigneCommande.objects.filter(commande=commande).select_related('poisson')
-    
-    # Vérifier si un bon de commande existe déjà
-    bon_existant = Document.objects.filter(
-        commande=commande,
-        type='bon_commande'
-    ).first()
-    
-    if bon_existant:
-        messages.warning(request, 'Un bon de commande existe déjà pour cette commande.')
-        return redirect('detail_commande', commande_id=commande.id)
+    """Lancer la génération du bon de commande en arrière-plan"""
+    commande = get_object_or_404(Commande.objects.select_related('client'), id=commande_id)
     
-    try:
-        # Créer un buffer pour le PDF
-        buffer = io.BytesIO()
-        
-        # Créer le document PDF
-        doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72,
-                               topMargin=72, bottomMargin=18)
-        
-        # Styles
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            spaceAfter=30,
-            textColor=colors.HexColor('#2563eb'),
-            alignment=1  # Center alignment
-        )
-        
-        header_style = ParagraphStyle(
-            'HeaderStyle',
-            parent=styles['Normal'],
-            fontSize=12,
-            textColor=colors.HexColor('#1e40af'),
-            spaceAfter=12
-        )
-        
-        # Contenu du PDF
-        elements = []
-        
-        # En-tête
-        elements.append(Paragraph(f"BON DE COMMANDE N° {commande.numero_commande}", title_style))
-        elements.append(Spacer(1, 20))
-        
-        # Informations de l'entreprise et du client
-        company_data = [
-            ['VOTRE ENTREPRISE', f'Client: {commande.client.nom_societe}'],
-            ['Export/Import Poisson', commande.client.adresse or 'Adresse non renseignée'],
-            ['Casablanca, Maroc', f'Email: {commande.client.email}'],
-            ['Tél: +212 xxx xxx xxx', f'Téléphone: {commande.client.telephone or "N/A"}'],
-            ['Email: contact@entreprise.ma', f'ICE: {commande.client.numero_ice or "N/A"}'],
-            ['', ''],
-            ['Date de commande:', commande.date_creation.strftime("%d/%m/%Y")],
-            ['Type de commande:', commande.get_type_commande_display()],
-            ['Statut:', commande.get_statut_display()],
-        ]
-        
-        # Ajouter Incoterm seulement pour Export/Import
-        if commande.type_commande != 'LOCAL':
-            company_data.append(['Incoterm:', commande.get_incoterm_display() if commande.incoterm else "N/A"])
-        
-        company_table = Table(company_data, colWidths=[3*inch, 3*inch])
-        company_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, 4), 'Helvetica-Bold'),
-            ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-            ('TOPPADDING', (0, 0), (-1, -1), 8),
-            ('BACKGROUND', (0, 0), (0, 4), colors.HexColor('#f0f9ff')),
-            ('BACKGROUND', (1, 0), (1, 0), colors.HexColor('#f0f9ff')),
-            ('LINEBELOW', (0, 5), (-1, 5), 1, colors.HexColor('#e2e8f0')),
-            ('FONTNAME', (0, 6), (-1, -1), 'Helvetica-Bold'),
-            ('TEXTCOLOR', (0, 6), (-1, -1), colors.HexColor('#2563eb')),
-        ]))
-        
-        elements.append(company_table)
-        elements.append(Spacer(1, 30))
-        
-        # Titre du tableau des articles
-        elements.append(Paragraph("DÉTAIL DE LA COMMANDE", header_style))
-        elements.append(Spacer(1, 10))
-        
-        # Tableau des articles
-        articles_data = [['Produit', 'Code', 'Quantité', 'Prix Unitaire (MAD)', 'Total (MAD)']]
-        
-        total_general = 0
-        for ligne in lignes:
-            total_ligne = ligne.total_ligne or 0
-            total_general += total_ligne
-            articles_data.append([
-                ligne.poisson.type,
-                ligne.poisson.code_produit,
-                f"{ligne.quantite} {ligne.poisson.unite_mesure}",
-                f"{ligne.prix_unitaire}",
-                f"{total_ligne}"
-            ])
-        
-        # Ajouter ligne de total
-        articles_data.append(['', '', '', 'TOTAL GÉNÉRAL:', f"{total_general}"])
-        
-        articles_table = Table(articles_data, colWidths=[2*inch, 1*inch, 1.5*inch, 1.5*inch, 1.5*inch])
-        articles_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2563eb')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 11),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('TOPPADDING', (0, 0), (-1, 0), 12),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('ROWBACKGROUNDS', (0, 1), (-2, -1), [colors.white, colors.HexColor('#f8fafc')]),
-            ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),
-            # Style pour la ligne de total
-            ('BACKGROUND', (-1, -1), (-1, -1), colors.HexColor('#f0fdf4')),
-            ('FONTNAME', (-2, -1), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (-2, -1), (-1, -1), 11),
-        ]))
-        
-        elements.append(articles_table)
-        elements.append(Spacer(1, 30))
-        
-        # Commentaires si disponibles
-        if commande.commentaire:
-            elements.append(Paragraph("COMMENTAIRES:", header_style))
-            elements.append(Paragraph(commande.commentaire, styles['Normal']))
-            elements.append(Spacer(1, 20))
-        
-        # Conditions générales
-        conditions_text = """
-        <para align="left" fontSize="10" textColor="#374151">
-        <b>CONDITIONS GÉNÉRALES:</b><br/>
-        • Les prix sont exprimés en dirhams marocains (MAD)<br/>
-        • La livraison sera effectuée selon les termes convenus<br/>
-        • Toute modification de cette commande doit faire l'objet d'un avenant<br/>
-        • Ce bon de commande est valable 30 jours à compter de sa date d'émission<br/>
-        <br/>
-        <b>Signature et cachet du client requis pour validation</b>
-        </para>
-        """
-        elements.append(Paragraph(conditions_text, styles['Normal']))
-        
-        # Construire le PDF
-        doc.build(elements)
-        
-        # Récupérer le contenu du buffer
-        buffer.seek(0)
-        pdf_content = buffer.getvalue()
-        buffer.close()
-        
-        # Créer le fichier temporaire
-        import tempfile
-        import os
-        from django.core.files.base import ContentFile
-        
-        # Nom du fichier
-        filename = f"bon_commande_{commande.numero_commande}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        
-        # Créer le document dans la base de données
-        document = Document()
-        document.commande = commande
-        document.nom_document = f"Bon de commande - {commande.numero_commande}"
-        document.type = 'bon_commande'
-        document.numero_document = commande.numero_commande
-        document.utilisateur = User.objects.get(id=request.session['user_id'])
-        
-        # Sauvegarder le fichier PDF
-        document.fichier.save(
-            filename,
-            ContentFile(pdf_content),
-            save=True
-        )
-        
-        messages.success(request, f'Bon de commande généré et enregistré avec succès: {filename}')
-        return redirect('detail_commande', commande_id=commande.id)
-        
-    except Exception as e:
-        messages.error(request, f'Erreur lors de la génération du bon de commande: {str(e)}')
-        return redirect('detail_commande', commande_id=commande.id)
+    if bon_a_jour(commande):
+        messages.info(request, 'Le bon de commande est déjà à jour.')
+    else:
+        demander_bon_commande(commande.id, request.user.id)
+        messages.success(request, 'Génération du bon de commande lancée.')
+    return redirect('detail_commande', commande_id=commande.id)
 
+@connexion_requise
 def telecharger_bon_commande(request, commande_id):
-    """Télécharger le bon de commande existant ou le générer s'il n'existe pas"""
-    if not request.session.get('user_id'):
-        return redirect('login')
-    
-    commande = get_object_or_404(Commande, id=commande_id)
-    
-    # Chercher le bon de commande existant
-    bon_commande = Document.objects.filter(
-        commande=commande,
-        type='bon_commande'
-    ).first()
+    """Télécharger le bon de commande de la version actuelle de la commande.
+    S'il n'est pas encore prêt, sa génération est lancée et une page d'attente
+    (rechargée automatiquement) est affichée."""
+    commande = get_object_or_404(Commande.objects.select_related('client'), id=commande_id)
     
+    bon_commande = bon_a_jour(commande)
     if bon_commande:
-        # Télécharger le bon existant
-        if default_storage.exists(bon_commande.fichier.name):
-            response = HttpResponse(
-                default_storage.open(bon_commande.fichier.name).read(),
-                content_type='application/pdf'
-            )
-            response['Content-Disposition'] = f'attachment; filename="bon_commande_{commande.numero_commande}.pdf"'
-            return response
-        else:
-            messages.error(request, 'Le fichier du bon de commande est introuvable.')
-            return redirect('detail_commande', commande_id=commande.id)
-    else:
-        # Générer un nouveau bon de commande
-        return generer_bon_commande(request, commande_id)
+        sha = empreinte(bon_commande.fichier.name)
+        return reponse_fichier(
+            request, bon_commande.fichier.name,
+            f'bon_commande_{commande.numero_commande}.pdf',
+            content_type='application/pdf', etag=f'"{sha}"' if sha else None,
+            storage=bon_commande.fichier.storage
+        )
+    
+    demander_bon_commande(commande.id, request.user.id)
+    return render(request, 'commandes/bon_commande_attente.html', {'commande': commande}, status=202)
@@ -7,25 +7,10 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 from django import forms
 import json
-import io
 
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.units import inch
-
-from .models import POISSON, MouvementStock, User, Commande, AuditLog
-
-# Custom login required decorator
-def custom_login_required(view_func):
-    def wrapper(request, *args, **kwargs):
-        if not request.session.get('user_id'):
-            messages.error(request, 'Vous devez être connecté pour accéder à cette page.')
-            return redirect('login')
-        return view_func(request, *args, **kwargs)
-    return wrapper
+from . import audit, pdf
+from .models import POISSON, MouvementStock, Commande
+from .authentification import connexion_requise
 
 # Forms
 class MouvementStockForm(forms.ModelForm):
@@ -78,10 +63,9 @@ class PoissonForm(forms.ModelForm):
         }
 
 # Views
-@custom_login_required
+@connexion_requise
 def stock_dashboard(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     # Statistiques générales
     total_produits = POISSON.objects.filter(actif=True).count()
@@ -161,10 +145,9 @@ def stock_dashboard(request):
     
     return render(request, 'stock/dashboard.html', context)
 
-@custom_login_required
+@connexion_requise
 def liste_produits(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     produits = POISSON.objects.filter(actif=True).order_by('type')
     
@@ -193,10 +176,9 @@ def liste_produits(request):
     
     return render(request, 'stock/liste_produits.html', context)
 
-@custom_login_required
+@connexion_requise
 def ajouter_produit(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     if request.method == 'POST':
         form = PoissonForm(request.POST)
@@ -214,7 +196,7 @@ def ajouter_produit(request):
                 )
             
             # Log audit
-            AuditLog.objects.create(
+            audit.journaliser(
                 utilisateur=user,
                 action='CREATE',
                 model_name='POISSON',
@@ -232,10 +214,9 @@ def ajouter_produit(request):
         'user': user
     })
 
-@custom_login_required
+@connexion_requise
 def mouvement_stock_form(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     if request.method == 'POST':
         form = MouvementStockForm(request.POST)
@@ -265,12 +246,12 @@ def mouvement_stock_form(request):
             mouvement.save()
             
             # Log audit
-            AuditLog.objects.create(
+            audit.journaliser(
                 utilisateur=user,
                 action='CREATE',
                 model_name='MouvementStock',
                 object_id=mouvement.id,
-                object_repr=str(mouvement),
+                object_repr=f"{mouvement.type_mouvement} - {poisson.type} - {mouvement.quantite}",
                 details={
                     'ancienne_quantite': float(ancienne_quantite),
                     'nouvelle_quantite': float(poisson.quantite_stock),
@@ -288,10 +269,9 @@ def mouvement_stock_form(request):
         'user': user
     })
 
-@custom_login_required
+@connexion_requise
 def historique_mouvements(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     mouvements = MouvementStock.objects.select_related(
         'poisson', 'utilisateur', 'commande'
@@ -335,7 +315,7 @@ def historique_mouvements(request):
     
     return render(request, 'stock/historique_mouvements.html', context)
 
-@custom_login_required
+@connexion_requise
 def api_stock_data(request):
     """API pour les données des graphiques"""
     periode = request.GET.get('periode', '7')  # jours
@@ -377,10 +357,9 @@ def api_stock_data(request):
             'error': str(e)
         })
 
-@custom_login_required
+@connexion_requise
 def detail_produit(request, produit_id):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     produit = get_object_or_404(POISSON, id=produit_id, actif=True)
     
@@ -411,10 +390,9 @@ def detail_produit(request, produit_id):
     
     return render(request, 'stock/detail_produit.html', context)
 
-@custom_login_required
+@connexion_requise
 def rapport_stock(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     # Rapport détaillé du stock
     produits = POISSON.objects.filter(actif=True).annotate(
@@ -447,40 +425,16 @@ def rapport_stock(request):
     
     return render(request, 'stock/rapport.html', context)
 
-@custom_login_required
+@connexion_requise
 def rapport_stock_pdf(request):
     """Génère un rapport PDF du stock"""
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     # Créer la réponse HTTP pour PDF
     response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="rapport_stock_{timezone.now().strftime("%Y%m%d_%H%M")}.pdf"'
     
-    # Créer le document PDF
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    story = []
-    
-    # Styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=30,
-        alignment=1  # Center
-    )
-    
-    # Titre
-    title = Paragraph("RAPPORT DE STOCK", title_style)
-    story.append(title)
-    story.append(Spacer(1, 12))
-    
-    # Date et heure
-    date_rapport = Paragraph(f"Généré le {timezone.now().strftime('%d/%m/%Y à %H:%M')}", styles['Normal'])
-    story.append(date_rapport)
-    story.append(Spacer(1, 20))
+    story = pdf.entete_rapport("RAPPORT DE STOCK")
     
     # Données du stock
     produits = POISSON.objects.filter(actif=True).annotate(
@@ -496,33 +450,17 @@ def rapport_stock_pdf(request):
     }
     
     # Tableau des statistiques
-    stats_data = [
-        ['Statistiques Générales', ''],
+    story.append(pdf.tableau_statistiques([
         ['Total produits actifs', str(stats['total_produits'])],
         ['Valeur totale du stock', f"{stats['valeur_totale']:.2f} MAD"],
         ['Produits en alerte', str(stats['produits_alerte'])],
         ['Produits en rupture', str(stats['stock_zero'])],
-    ]
-    
-    stats_table = Table(stats_data, colWidths=[3*inch, 2*inch])
-    stats_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
     ]))
-    
-    story.append(stats_table)
-    story.append(Spacer(1, 30))
+    story.append(pdf.espace(30))
     
     # Titre détail des produits
-    detail_title = Paragraph("DÉTAIL DES STOCKS", styles['Heading2'])
-    story.append(detail_title)
-    story.append(Spacer(1, 12))
+    story.append(pdf.paragraphe("DÉTAIL DES STOCKS", 'Heading2'))
+    story.append(pdf.espace(12))
     
     # Tableau des produits
     data = [['Code', 'Type', 'Prix Unit.', 'Stock', 'Seuil', 'Valeur', 'Statut']]
@@ -552,54 +490,24 @@ def rapport_stock_pdf(request):
         'TOTAL'
     ])
     
-    table = Table(data, colWidths=[1*inch, 1.5*inch, 0.8*inch, 0.8*inch, 0.8*inch, 1*inch, 0.8*inch])
-    table.setStyle(TableStyle([
-        # En-tête
-        ('BACKGROUND', (0, 0), (-1, 0), colors.navy),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        
-        # Corps du tableau
-        ('BACKGROUND', (0, 1), (-1, -2), colors.white),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        
-        # Ligne de total
-        ('BACKGROUND', (0, -1), (-1, -1), colors.lightgrey),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-        
-        # Coloration conditionnelle pour les statuts
-        ('TEXTCOLOR', (6, 1), (6, -2), colors.red),  # Colonne statut en rouge par défaut
-    ]))
+    table = pdf.tableau_rapport(data, [1, 1.5, 0.8, 0.8, 0.8, 1, 0.8], avec_total=True)
     
-    # Appliquer les couleurs selon le statut
+    # Colonne statut en rouge par défaut, lignes colorées selon le statut
+    r = pdf.rl()
+    couleurs = [('TEXTCOLOR', (6, 1), (6, -2), r.colors.red)]
     for i, produit in enumerate(produits, 1):
         if produit.quantite_stock <= 0:
-            table.setStyle(TableStyle([('BACKGROUND', (0, i), (-1, i), colors.pink)]))
+            couleurs.append(('BACKGROUND', (0, i), (-1, i), r.colors.pink))
         elif produit.quantite_stock <= produit.seuil_alerte:
-            table.setStyle(TableStyle([('BACKGROUND', (0, i), (-1, i), colors.yellow)]))
+            couleurs.append(('BACKGROUND', (0, i), (-1, i), r.colors.yellow))
+    table.setStyle(r.TableStyle(couleurs))
     
     story.append(table)
-    
-    # Pied de page
-    story.append(Spacer(1, 30))
-    footer = Paragraph(f"Rapport généré par {user.username} - FishFlow Manager", styles['Italic'])
-    story.append(footer)
-    
-    # Construire le PDF
-    doc.build(story)
-    
-    # Récupérer le contenu du buffer
-    pdf = buffer.getvalue()
-    buffer.close()
-    response.write(pdf)
+    story += pdf.pied_rapport(user.username)
+    response.write(pdf.construire(story, rapport=True))
     
     # Log de l'action
-    AuditLog.objects.create(
+    audit.journaliser(
         utilisateur=user,
         action='EXPORT',
         model_name='Stock',
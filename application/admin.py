@@ -7,7 +7,7 @@ from .models import (
     EtapeTransport, Document, Vehicule, Livraison, 
     Facture, Notification, Historique, Rapport, 
     Expedition, MouvementStock, Tarif, AuditLog, 
-    Comptabilite
+    Comptabilite, FaitVente, FaitCommande
 )
 
 @admin.register(User)
@@ -224,6 +224,22 @@ class ComptabiliteAdmin(admin.ModelAdmin):
     search_fields = ('commande__numero_commande', 'facture__numero_facture')
     readonly_fields = ('date_enregistrement',)
 
+@admin.register(FaitVente)
+class FaitVenteAdmin(admin.ModelAdmin):
+    list_display = ('date', 'commande', 'client', 'poisson', 'statut', 'quantite', 'montant')
+    list_filter = ('statut', 'type_commande', 'date')
+    search_fields = ('commande__numero_commande', 'client__nom_societe')
+    list_select_related = ('commande', 'client', 'poisson')
+    readonly_fields = ('ligne', 'commande', 'client', 'poisson', 'date', 'type_commande', 'statut', 'quantite', 'montant')
+
+@admin.register(FaitCommande)
+class FaitCommandeAdmin(admin.ModelAdmin):
+    list_display = ('date', 'commande', 'client', 'type_commande', 'statut')
+    list_filter = ('statut', 'type_commande', 'date')
+    search_fields = ('commande__numero_commande', 'client__nom_societe')
+    list_select_related = ('commande', 'client')
+    readonly_fields = ('commande', 'client', 'date', 'type_commande', 'statut')
+
 # Customize admin site
 admin.site.site_header = "Administration FishFlow Manager"
 admin.site.site_title = "FishFlow Admin"
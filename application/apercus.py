@@ -0,0 +1,127 @@
+import importlib.util
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Commande, Document
+
+EXTENSIONS_IMAGES = {'.jpg', '.jpeg', '.png'}
+
+
+def _enregistrer_image(image, format_sortie, qualite):
+    buffer = io.BytesIO()
+    if format_sortie == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(buffer, 'JPEG', quality=qualite, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def compresser_image(contenu, extension):
+    """
+    Redresse l'image selon son orientation EXIF, la réduit à
+    DOCUMENTS_IMAGE_MAX_PX de côté et la recompresse. Retourne le nouveau
+    contenu, ou None si le résultat n'est pas plus léger que l'original.
+    """
+    with Image.open(io.BytesIO(contenu)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((settings.DOCUMENTS_IMAGE_MAX_PX, settings.DOCUMENTS_IMAGE_MAX_PX))
+        format_sortie = 'PNG' if extension == '.png' else 'JPEG'
+        resultat = _enregistrer_image(image, format_sortie, settings.DOCUMENTS_IMAGE_QUALITE)
+    return resultat if len(resultat) < len(contenu) else None
+
+
+def apercu_pdf_disponible():
+    """
+    Les aperçus de PDF demandent PyMuPDF (fitz). Il n'est volontairement pas
+    dans requirements.txt (licence AGPL) : sans lui, les PDF n'ont pas
+    d'aperçu, ce qui ne gêne que l'affichage de la liste des documents.
+    """
+    return importlib.util.find_spec('fitz') is not None
+
+
+def _premiere_page_pdf(contenu):
+    """Rendu de la première page d'un PDF si PyMuPDF est installé, sinon None."""
+    try:
+        import fitz
+    except ImportError:
+        return None
+    with fitz.open(stream=contenu, filetype='pdf') as pdf:
+        if not pdf.page_count:
+            return None
+        pixmap = pdf[0].get_pixmap(dpi=72)
+        return Image.open(io.BytesIO(pixmap.tobytes('png')))
+
+
+def generer_apercu(contenu, extension):
+    """Miniature JPEG du document (image ou première page de PDF), ou None."""
+    if extension in EXTENSIONS_IMAGES:
+        image = Image.open(io.BytesIO(contenu))
+        image = ImageOps.exif_transpose(image)
+    elif extension == '.pdf':
+        image = _premiere_page_pdf(contenu)
+    else:
+        image = None
+    if image is None:
+        return None
+    taille = settings.DOCUMENTS_APERCU_PX
+    image.thumbnail((taille, taille))
+    if image.mode in ('RGBA', 'LA', 'P'):
+        fond = Image.new('RGB', image.size, 'white')
+        fond.paste(image.convert('RGBA'), mask=image.convert('RGBA').split()[-1])
+        image = fond
+    return _enregistrer_image(image, 'JPEG', 70)
+
+
+def traiter_document(document_id):
+    """
+    Tâche de fond lancée à l'ajout d'un document : compresse les images et
+    génère l'aperçu. Une image recompressée remplace le fichier téléversé
+    seulement si elle est plus légère : un seul fichier est conservé par
+    document, l'original devenu orphelin est effacé par
+    purger_fichiers_orphelins. Le fichier n'est lu que s'il y a quelque chose
+    à produire pour son type. Les documents partageant le même fichier sont
+    mis à jour ensemble, puis la commande est « touchée » pour invalider le
+    cache de sa page détail.
+    """
+    document = Document.objects.filter(id=document_id).only('id', 'commande_id', 'fichier', 'apercu').first()
+    if document is None or not document.fichier:
+        return
+
+    ancien = document.fichier.name
+    extension = os.path.splitext(ancien)[1].lower()
+    image = extension in EXTENSIONS_IMAGES
+    a_apercevoir = not document.apercu and (image or (extension == '.pdf' and apercu_pdf_disponible()))
+    if not (image or a_apercevoir):
+        return
+
+    storage = document.fichier.storage
+    with storage.open(ancien, 'rb') as fichier:
+        contenu = fichier.read()
+
+    valeurs = {}
+    if image:
+        compresse = compresser_image(contenu, extension)
+        if compresse is not None:
+            # L'aperçu est calculé depuis la version compressée, plus rapide à décoder
+            contenu = compresse
+            valeurs['fichier'] = storage.save(f'documents/document{extension}', ContentFile(compresse))
+
+    if a_apercevoir:
+        apercu = generer_apercu(contenu, extension)
+        if apercu is not None:
+            valeurs['apercu'] = storage.save('apercus/apercu.jpg', ContentFile(apercu))
+
+    if not valeurs:
+        return
+
+    partages = Document.objects.filter(fichier=ancien)
+    commande_ids = list(partages.values_list('commande_id', flat=True).distinct())
+    partages.update(**valeurs)
+    Commande.objects.filter(id__in=commande_ids).update(date_modification=timezone.now())
@@ -0,0 +1,108 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+# Entrées de la requête en cours (une liste par thread, ouverte par AuditMiddleware)
+_requete = threading.local()
+
+# Entrées en attente du flusher (mode différé)
+_attente = []
+_verrou = threading.Lock()
+_flusher = None
+
+
+def journaliser(**champs):
+    """
+    Met une entrée du journal d'audit en file (mêmes champs que AuditLog).
+
+    Pendant une requête, les entrées sont écrites en un bulk_create à la fin
+    de la réponse (AuditMiddleware), ou dès que AUDIT_TAILLE_LOT entrées sont
+    en attente. Hors requête (tâche de fond, commande), l'entrée est écrite
+    aussitôt, sauf en mode différé où elle rejoint la file du flusher.
+    """
+    entree = AuditLog(**champs)
+    entree.object_repr = entree.object_repr[:200]
+    entrees = getattr(_requete, 'entrees', None)
+    if entrees is None:
+        if settings.AUDIT_DIFFERE:
+            _mettre_en_attente([entree])
+        else:
+            _ecrire([entree])
+        return entree
+    entrees.append(entree)
+    if len(entrees) >= settings.AUDIT_TAILLE_LOT:
+        _ecrire(entrees[:])
+        entrees.clear()
+    return entree
+
+
+def ouvrir_requete():
+    _requete.entrees = []
+
+
+def fermer_requete():
+    """Fin de réponse : écrit les entrées de la requête, ou les confie au flusher en mode différé."""
+    entrees = getattr(_requete, 'entrees', None)
+    _requete.entrees = None
+    if not entrees:
+        return
+    if settings.AUDIT_DIFFERE:
+        _mettre_en_attente(entrees)
+    else:
+        _ecrire(entrees)
+
+
+def _ecrire(entrees):
+    try:
+        AuditLog.objects.bulk_create(entrees, batch_size=settings.AUDIT_TAILLE_LOT)
+    except Exception:
+        # L'audit ne fait pas échouer la réponse
+        logger.exception("Échec de l'écriture de %d entrée(s) d'audit", len(entrees))
+
+
+def _mettre_en_attente(entrees):
+    with _verrou:
+        _attente.extend(entrees)
+        plein = len(_attente) >= settings.AUDIT_TAILLE_LOT
+    if plein:
+        vider()
+    else:
+        _demarrer_flusher()
+
+
+def vider():
+    """Écrit toutes les entrées en attente dans le processus. Retourne leur nombre."""
+    with _verrou:
+        entrees = _attente[:]
+        _attente.clear()
+    if entrees:
+        _ecrire(entrees)
+    return len(entrees)
+
+
+def _boucle_flusher():
+    while True:
+        time.sleep(settings.AUDIT_INTERVALLE)
+        vider()
+        # Thread de longue durée : pas de connexion gardée entre deux écritures
+        connections.close_all()
+
+
+def _demarrer_flusher():
+    global _flusher
+    with _verrou:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_boucle_flusher, name='audit', daemon=True)
+            _flusher.start()
+
+
+# Arrêt du worker (sortie normale de gunicorn, fin d'une commande) : rien n'est perdu
+atexit.register(vider)
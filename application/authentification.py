@@ -0,0 +1,72 @@
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import DEFAULT_DB_ALIAS
+from django.http import JsonResponse
+from django.shortcuts import redirect
+
+from .models import User
+
+# Champs de l'utilisateur connecté gardés en cache ; les autres sont chargés
+# à la demande (profil)
+CHAMPS = ['id', 'username', 'role', 'actif']
+
+# Cache du processus : id -> (expiration, valeurs de CHAMPS)
+_utilisateurs = {}
+_verrou = threading.Lock()
+
+
+def _valeurs(user_id):
+    maintenant = time.monotonic()
+    entree = _utilisateurs.get(user_id)
+    if entree and entree[0] > maintenant:
+        return entree[1]
+    valeurs = User.objects.filter(id=user_id).values_list(*CHAMPS).first()
+    with _verrou:
+        _utilisateurs[user_id] = (maintenant + settings.UTILISATEURS_CACHE_DUREE, valeurs)
+    return valeurs
+
+
+def oublier_utilisateur(user_id):
+    """Retire un utilisateur du cache (enregistrement ou suppression)."""
+    with _verrou:
+        _utilisateurs.pop(user_id, None)
+
+
+def utilisateur_session(user_id):
+    """
+    Utilisateur actif d'id `user_id`, ou None. Sans requête tant que
+    l'utilisateur est dans le cache du processus.
+
+    L'instance n'a que les champs de CHAMPS chargés : elle s'utilise telle
+    quelle comme clé étrangère (AuditLog, Facture...) ; un autre champ est lu
+    en base à son premier accès.
+    """
+    valeurs = _valeurs(user_id)
+    if valeurs is None or not valeurs[CHAMPS.index('actif')]:
+        return None
+    return User.from_db(DEFAULT_DB_ALIAS, CHAMPS, valeurs)
+
+
+def connexion_requise(view_func):
+    """Redirige vers la page de connexion quand aucun utilisateur n'est connecté."""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            messages.error(request, 'Vous devez être connecté pour accéder à cette page.')
+            return redirect('login')
+        return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def connexion_requise_api(view_func):
+    """Variante de connexion_requise pour les vues appelées en JavaScript : 401 en JSON."""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Non autorisé'}, status=401)
+        return view_func(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,197 @@
+import hashlib
+
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from . import pdf
+from .jobs import lancer_apres_commit
+from .models import Commande, Document, LigneCommande
+
+# Incrémenter quand la mise en page du bon change, pour le faire régénérer
+VERSION_BON = 1
+
+# Durée maximale de l'état « en cours de génération » (tâche perdue)
+DUREE_ATTENTE = 10 * 60
+
+CONDITIONS_GENERALES = """
+        <para align="left" fontSize="10" textColor="#374151">
+        <b>CONDITIONS GÉNÉRALES:</b><br/>
+        • Les prix sont exprimés en dirhams marocains (MAD)<br/>
+        • La livraison sera effectuée selon les termes convenus<br/>
+        • Toute modification de cette commande doit faire l'objet d'un avenant<br/>
+        • Ce bon de commande est valable 30 jours à compter de sa date d'émission<br/>
+        <br/>
+        <b>Signature et cachet du client requis pour validation</b>
+        </para>
+        """
+
+
+def rendre_bon_commande_pdf(commande, lignes):
+    """
+    Construit le PDF du bon de commande et retourne son contenu (bytes).
+
+    Mode `invariant` : pas d'horodatage ni d'identifiant aléatoire dans le PDF,
+    un bon identique donne le même fichier et n'est stocké qu'une fois.
+    """
+    client = commande.client
+    elements = pdf.entete_document(f"BON DE COMMANDE N° {commande.numero_commande}")
+
+    # Informations de l'entreprise et du client
+    informations = [
+        ['Date de commande:', commande.date_creation.strftime("%d/%m/%Y")],
+        ['Type de commande:', commande.get_type_commande_display()],
+        ['Statut:', commande.get_statut_display()],
+    ]
+    # Incoterm seulement pour Export/Import
+    if commande.type_commande != 'LOCAL':
+        informations.append(['Incoterm:', commande.get_incoterm_display() if commande.incoterm else "N/A"])
+    elements.append(pdf.bloc_parties(
+        [
+            f'Client: {client.nom_societe}',
+            client.adresse or 'Adresse non renseignée',
+            f'Email: {client.email}',
+            f'Téléphone: {client.telephone or "N/A"}',
+            f'ICE: {client.numero_ice or "N/A"}',
+        ],
+        informations
+    ))
+    elements.append(pdf.espace(30))
+
+    # Tableau des articles, avec la ligne de total
+    articles = []
+    total_general = 0
+    for ligne in lignes:
+        total_ligne = ligne.total_ligne or 0
+        total_general += total_ligne
+        articles.append([
+            ligne.poisson.type,
+            ligne.poisson.code_produit,
+            f"{ligne.quantite} {ligne.poisson.unite_mesure}",
+            f"{ligne.prix_unitaire}",
+            f"{total_ligne}"
+        ])
+    elements += pdf.titre_section("DÉTAIL DE LA COMMANDE")
+    elements.append(pdf.tableau_lignes(
+        ['Produit', 'Code', 'Quantité', 'Prix Unitaire (MAD)', 'Total (MAD)'],
+        articles,
+        total=('TOTAL GÉNÉRAL:', f"{total_general}")
+    ))
+    elements.append(pdf.espace(30))
+
+    # Commentaires si disponibles
+    if commande.commentaire:
+        elements.append(pdf.paragraphe("COMMENTAIRES:", 'TitreSection'))
+        elements.append(pdf.paragraphe(commande.commentaire))
+        elements.append(pdf.espace(20))
+
+    elements.append(pdf.paragraphe(CONDITIONS_GENERALES))
+    return pdf.construire(elements)
+
+
+def _lignes(commande):
+    return list(
+        LigneCommande.objects.filter(commande=commande).select_related('poisson').order_by('id')
+    )
+
+
+def cle_bon_commande(commande, lignes):
+    """
+    Empreinte des valeurs imprimées sur le bon (en-tête, client, lignes). Un
+    bon dont la clé n'a pas changé n'est pas régénéré.
+    """
+    client = commande.client
+    valeurs = [
+        VERSION_BON,
+        commande.numero_commande, commande.date_creation, commande.type_commande,
+        commande.statut, commande.incoterm, commande.commentaire,
+        client.nom_societe, client.adresse, client.email, client.telephone, client.numero_ice,
+    ]
+    for ligne in lignes:
+        valeurs += [
+            ligne.poisson.type, ligne.poisson.code_produit, ligne.poisson.unite_mesure,
+            ligne.quantite, ligne.prix_unitaire, ligne.total_ligne,
+        ]
+    return hashlib.sha256('|'.join(str(v) for v in valeurs).encode()).hexdigest()
+
+
+def bons_generes(commande):
+    """Bons de commande produits par l'application (les bons téléversés sont exclus)."""
+    return Document.objects.filter(commande=commande, type='bon_commande').exclude(cle_generation='')
+
+
+def bon_a_jour(commande):
+    """Bon de commande généré correspondant à l'état actuel de la commande, ou None."""
+    cle = cle_bon_commande(commande, _lignes(commande))
+    return bons_generes(commande).filter(cle_generation=cle).first()
+
+
+def _cache():
+    # La demande est faite par un worker, la tâche tourne peut-être dans un
+    # autre : l'état « en cours » doit être dans le cache commun aux processus.
+    # Si deux demandes passent quand même (add non atomique du cache fichier),
+    # le verrou sur la commande dans generer_bon_commande évite un second bon.
+    return caches['partage']
+
+
+def cle_attente(commande_id):
+    return f'bon_commande:{commande_id}'
+
+
+def en_generation(commande_id):
+    return _cache().get(cle_attente(commande_id)) is not None
+
+
+def demander_bon_commande(commande_id, utilisateur_id=None):
+    """
+    Programme la génération du bon après la transaction courante. Une seule
+    tâche par commande est en attente à la fois ; retourne False si une
+    génération était déjà programmée.
+    """
+    if not _cache().add(cle_attente(commande_id), True, DUREE_ATTENTE):
+        return False
+    lancer_apres_commit(generer_bon_commande, commande_id, utilisateur_id)
+    return True
+
+
+def generer_bon_commande(commande_id, utilisateur_id=None):
+    """
+    Tâche de fond : enregistre le bon de commande de la version actuelle de la
+    commande. Sans effet si le bon stocké est à jour ; sinon le nouveau
+    Document remplace les bons générés précédemment.
+    """
+    try:
+        with transaction.atomic():
+            # Verrou sur la commande : deux tâches ne produisent pas deux bons
+            commande = (
+                Commande.objects.select_for_update(of=('self',))
+                .select_related('client').filter(id=commande_id).first()
+            )
+            if commande is None:
+                return None
+            lignes = _lignes(commande)
+            cle = cle_bon_commande(commande, lignes)
+            anciens = list(bons_generes(commande))
+            for bon in anciens:
+                if bon.cle_generation == cle:
+                    return bon
+
+            document = Document(
+                commande=commande,
+                nom_document=f"Bon de commande - {commande.numero_commande}",
+                type='bon_commande',
+                numero_document=commande.numero_commande,
+                utilisateur_id=utilisateur_id,
+                cle_generation=cle,
+            )
+            document.fichier.save(
+                f"bon_commande_{commande.numero_commande}.pdf",
+                ContentFile(rendre_bon_commande_pdf(commande, lignes)),
+                save=False
+            )
+            document.save()
+            for bon in anciens:
+                bon.delete()
+        return document
+    finally:
+        _cache().delete(cle_attente(commande_id))
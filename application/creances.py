@@ -0,0 +1,83 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Facture
+
+# Factures dues par le client (ni brouillon, ni payée, ni annulée)
+STATUTS_OUVERTS = ['emise', 'envoyee']
+
+# Tranches de retard : (clé, libellé, retard de plus de `minimum` jours, d'au plus `maximum`)
+TRANCHES = [
+    ('courant', 'Non échu', None, None),
+    ('j1_30', '1-30 jours', 0, 30),
+    ('j31_60', '31-60 jours', 30, 60),
+    ('j61_90', '61-90 jours', 60, 90),
+    ('plus_90', '> 90 jours', 90, None),
+]
+
+
+def factures_ouvertes():
+    # Filtre couvert par l'index (statut, date_echeance)
+    return Facture.objects.filter(statut__in=STATUTS_OUVERTS)
+
+
+def _filtre_tranche(maintenant, minimum, maximum):
+    """Condition sur date_echeance pour un retard compris entre `minimum` et `maximum` jours."""
+    if minimum is None:
+        return Q(date_echeance__gte=maintenant)
+    condition = Q(date_echeance__lt=maintenant - timedelta(days=minimum))
+    if maximum is not None:
+        condition &= Q(date_echeance__gte=maintenant - timedelta(days=maximum))
+    return condition
+
+
+def _reste():
+    # Montant encore dû : TTC moins les règlements partiels déjà rapprochés
+    return ExpressionWrapper(
+        F('montant_ttc') - F('montant_regle'), output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
+
+
+def _agregats(maintenant):
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    agregats = {}
+    for cle, _, minimum, maximum in TRANCHES:
+        condition = _filtre_tranche(maintenant, minimum, maximum)
+        agregats[cle] = Coalesce(Sum(_reste(), filter=condition), zero)
+        agregats[f'{cle}_nombre'] = Count('id', filter=condition)
+    agregats['total'] = Coalesce(Sum(_reste()), zero)
+    agregats['nombre'] = Count('id')
+    return agregats
+
+
+def balance_agee(maintenant=None):
+    """
+    Balance âgée des créances : une ligne par client (montant restant dû et nombre
+    de factures ouvertes par tranche de retard) et le total général.
+
+    Une seule requête : les tranches sont des SUM / COUNT conditionnels sur
+    les factures ouvertes, groupées par client. Le total est la somme des
+    lignes. Retourne (lignes, total).
+    """
+    maintenant = maintenant or timezone.now()
+    agregats = _agregats(maintenant)
+    lignes = list(
+        factures_ouvertes()
+        .values('client_id', 'client__nom_societe')
+        .annotate(**agregats)
+        .order_by('client__nom_societe', 'client_id')
+    )
+    total = {cle: sum(ligne[cle] for ligne in lignes) for cle in agregats}
+    return lignes, total
+
+
+def resume_retards(maintenant=None):
+    """Nombre et montant restant dû des factures ouvertes dont l'échéance est passée."""
+    maintenant = maintenant or timezone.now()
+    return factures_ouvertes().filter(date_echeance__lt=maintenant).aggregate(
+        nombre=Count('id'), montant=Sum(_reste())
+    )
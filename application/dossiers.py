@@ -0,0 +1,256 @@
+import hashlib
+import io
+import os
+
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from pypdf import PdfReader
+from pypdf.errors import PyPdfError
+from pypdf.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject
+)
+
+from . import pdf
+from .apercus import EXTENSIONS_IMAGES
+from .factures_pdf import cle_facture, obtenir_facture_pdf
+from .stockage import publier_fichier, supprimer_versions_precedentes
+
+# Incrémenter quand la mise en forme du dossier change, pour invalider le cache
+VERSION_DOSSIER = 1
+
+
+def _pieces(commande):
+    """Bon de commande, factures puis autres documents, dans l'ordre du dossier."""
+    documents = list(commande.document_set.order_by('date_ajout', 'id'))
+    bons = [d for d in documents if d.type == 'bon_commande']
+    autres = [d for d in documents if d.type != 'bon_commande']
+    factures = list(
+        commande.facture_set.select_related('client')
+        .prefetch_related('ligne_commande__poisson').order_by('date_emission', 'id')
+    )
+    return bons, factures, autres
+
+
+def cle_dossier(commande, bons, factures, autres):
+    """
+    Empreinte du contenu du dossier. Les fichiers étant adressés par contenu,
+    leur nom suffit à détecter un changement ; les factures comptent par la
+    clé de leur PDF (factures_pdf.cle_facture).
+    """
+    sha = hashlib.sha256(
+        f'{VERSION_DOSSIER}|{commande.numero_commande}|{commande.client.nom_societe}'.encode()
+    )
+    for document in bons + autres:
+        sha.update(f'|d{document.id}:{document.nom_document}:{document.fichier.name}'.encode())
+    for facture in factures:
+        sha.update(f'|f{facture.id}:{cle_facture(facture)}'.encode())
+    return sha.hexdigest()
+
+
+def _page_image(fichier):
+    """Une page A4 contenant l'image, réduite pour tenir dans les marges."""
+    r = pdf.rl()
+    with Image.open(fichier) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        largeur_page, hauteur_page = r.A4
+        marge = 0.5 * r.inch
+        echelle = min(
+            (largeur_page - 2 * marge) / image.width,
+            (hauteur_page - 2 * marge) / image.height,
+            1,
+        )
+        largeur, hauteur = image.width * echelle, image.height * echelle
+        buffer = io.BytesIO()
+        page = r.canvas.Canvas(buffer, pagesize=r.A4, invariant=1)
+        page.drawImage(
+            r.ImageReader(image), (largeur_page - largeur) / 2, (hauteur_page - hauteur) / 2,
+            width=largeur, height=hauteur
+        )
+        page.save()
+    buffer.seek(0)
+    return buffer
+
+
+def _page_de_garde(commande, inclus, ignores):
+    r = pdf.rl()
+    buffer = io.BytesIO()
+    elements = [
+        pdf.paragraphe(f"Dossier de la commande {commande.numero_commande}", 'Title'),
+        pdf.paragraphe(f"Client: {commande.client.nom_societe}"),
+        pdf.espace(20),
+        pdf.paragraphe("Pièces jointes", 'Heading2'),
+    ]
+    elements += [pdf.paragraphe(f"• {nom}") for nom in inclus]
+    if ignores:
+        elements += [pdf.espace(12), pdf.paragraphe("Non incluses (format non convertible)", 'Heading2')]
+        elements += [pdf.paragraphe(f"• {nom}") for nom in ignores]
+    r.SimpleDocTemplate(buffer, pagesize=r.A4, invariant=1).build(elements)
+    buffer.seek(0)
+    return buffer
+
+
+class _FusionPdf:
+    """
+    Fusion de PDF écrite au fil de l'eau dans un fichier : chaque page ajoutée
+    est écrite tout de suite avec les objets qu'elle utilise (contenu, polices,
+    images), et le lecteur d'une pièce est libéré dès qu'elle a été recopiée.
+    La mémoire dépend de la plus grosse pièce, pas de la taille du dossier ;
+    seules la position de chaque objet et la liste des pages sont gardées
+    jusqu'à la table de références finale.
+    """
+
+    CATALOGUE = 1
+    PAGES = 2
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.position = 0
+        self.positions = {}
+        self.pages = []
+        self.suivant = 3
+        self._ecrire(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def _ecrire(self, donnees):
+        self.destination.write(donnees)
+        self.position += len(donnees)
+
+    def _ecrire_objet(self, numero, objet):
+        tampon = io.BytesIO()
+        objet.write_to_stream(tampon)
+        self.positions[numero] = self.position
+        self._ecrire(f'{numero} 0 obj\n'.encode() + tampon.getvalue() + b'\nendobj\n')
+
+    def ajouter(self, fichier, en_tete=False):
+        """Recopie toutes les pages du PDF `fichier`, à la fin du dossier ou en tête."""
+        lecteur = PdfReader(fichier)
+        if lecteur.is_encrypted:
+            raise PyPdfError('PDF chiffré')
+        # Numéro d'un objet de la pièce -> numéro dans le dossier
+        numeros = {}
+        a_ecrire = []
+
+        def reference(ref, objet=None):
+            cle = (ref.idnum, ref.generation)
+            if cle not in numeros:
+                numeros[cle] = self.suivant
+                self.suivant += 1
+                a_ecrire.append((numeros[cle], ref, objet))
+            return IndirectObject(numeros[cle], 0, None)
+
+        def copier(objet):
+            if isinstance(objet, IndirectObject):
+                return reference(objet)
+            if isinstance(objet, ArrayObject):
+                return ArrayObject(copier(valeur) for valeur in objet)
+            if not isinstance(objet, DictionaryObject):
+                return objet
+            ignores = {'/Length'}
+            if isinstance(objet, StreamObject):
+                # Données telles que stockées : les filtres sont conservés
+                copie = StreamObject()
+                copie.set_data(objet._data)
+            else:
+                copie = DictionaryObject()
+                if objet.get('/Type') == '/Page':
+                    # Rattachée à l'arbre des pages du dossier, pas à celui de la pièce
+                    ignores = {'/Parent'}
+                    copie[NameObject('/Parent')] = IndirectObject(self.PAGES, 0, None)
+            for cle, valeur in objet.items():
+                if cle not in ignores:
+                    copie[cle] = copier(valeur)
+            return copie
+
+        pages = []
+        for page in lecteur.pages:
+            pages.append(reference(page.indirect_reference, page).idnum)
+            while a_ecrire:
+                numero, ref, objet = a_ecrire.pop()
+                self._ecrire_objet(numero, copier(objet if objet is not None else ref.get_object()))
+        if en_tete:
+            self.pages[:0] = pages
+        else:
+            self.pages += pages
+
+    def terminer(self):
+        """Écrit l'arbre des pages, le catalogue et la table des références."""
+        self._ecrire_objet(self.PAGES, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(numero, 0, None) for numero in self.pages),
+            NameObject('/Count'): NumberObject(len(self.pages)),
+        }))
+        self._ecrire_objet(self.CATALOGUE, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(self.PAGES, 0, None),
+        }))
+        debut = self.position
+        self._ecrire(f'xref\n0 {self.suivant}\n0000000000 65535 f \n'.encode())
+        for numero in range(1, self.suivant):
+            # Objets d'une pièce illisible abandonnée en cours de copie : libres
+            if numero in self.positions:
+                self._ecrire(f'{self.positions[numero]:010d} 00000 n \n'.encode())
+            else:
+                self._ecrire(b'0000000000 65535 f \n')
+        self._ecrire(
+            f'trailer\n<< /Size {self.suivant} /Root {self.CATALOGUE} 0 R >>\n'
+            f'startxref\n{debut}\n%%EOF\n'.encode()
+        )
+
+
+def _construire(commande, bons, factures, autres, destination):
+    """
+    Assemble le dossier dans le fichier `destination`, une pièce après
+    l'autre (_FusionPdf) : chaque fichier est fermé dès qu'il est recopié.
+    La page de garde, qui liste les pièces, est ajoutée en tête à la fin.
+    """
+    fusion = _FusionPdf(destination)
+    inclus, ignores = [], []
+
+    def ajouter_piece(document):
+        extension = os.path.splitext(document.fichier.name)[1].lower()
+        if extension != '.pdf' and extension not in EXTENSIONS_IMAGES:
+            ignores.append(document.nom_document)
+            return
+        if not document.fichier or not document.fichier.storage.exists(document.fichier.name):
+            ignores.append(document.nom_document)
+            return
+        try:
+            with document.fichier.storage.open(document.fichier.name, 'rb') as fichier:
+                fusion.ajouter(fichier if extension == '.pdf' else _page_image(fichier))
+        except (PyPdfError, OSError):
+            ignores.append(document.nom_document)
+            return
+        inclus.append(document.nom_document)
+
+    for document in bons:
+        ajouter_piece(document)
+    for facture in factures:
+        nom, _ = obtenir_facture_pdf(facture)
+        with default_storage.open(nom, 'rb') as fichier:
+            fusion.ajouter(fichier)
+        inclus.append(f"Facture {facture.numero_facture}")
+    for document in autres:
+        ajouter_piece(document)
+
+    fusion.ajouter(_page_de_garde(commande, inclus, ignores), en_tete=True)
+    fusion.terminer()
+
+
+def obtenir_dossier(commande):
+    """
+    Retourne (nom du fichier dans le stockage, clé) du dossier PDF de la
+    commande. Le dossier est reconstruit seulement si son contenu a changé ;
+    les versions plus anciennes sont alors supprimées.
+    """
+    bons, factures, autres = _pieces(commande)
+    cle = cle_dossier(commande, bons, factures, autres)
+    nom = f'dossiers/{commande.id}/{cle}.pdf'
+    if default_storage.exists(nom):
+        return nom, cle
+
+    # Écriture atomique : deux constructions simultanées ne suppriment pas le
+    # fichier de l'autre, un téléchargement ne voit jamais un dossier partiel
+    nom = publier_fichier(nom, lambda fichier: _construire(commande, bons, factures, autres, fichier))
+    supprimer_versions_precedentes(nom)
+    return nom, cle
@@ -0,0 +1,215 @@
+import multiprocessing
+import os
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+
+from .factures_pdf import (
+    cle_facture, chemin_facture_pdf, enregistrer_facture_pdf, rendre_facture_pdf
+)
+from .models import Facture
+
+DUREE_ETAT = 60 * 60 * 24
+
+# Factures lues (avec leurs lignes préchargées) par lot de cette taille
+TAILLE_LOT = 200
+
+
+def factures_a_exporter(date_debut=None, date_fin=None, client=None, statut=None):
+    """
+    Factures correspondant aux filtres du formulaire d'export, lignes
+    préchargées. Le QuerySet est parcouru par lots (_pdfs) : ni les factures ni
+    leurs lignes ne sont toutes chargées à la fois.
+    """
+    factures = Facture.objects.select_related('client').prefetch_related('ligne_commande__poisson')
+    if date_debut:
+        factures = factures.filter(date_emission__date__gte=date_debut)
+    if date_fin:
+        factures = factures.filter(date_emission__date__lte=date_fin)
+    if client:
+        factures = factures.filter(client=client)
+    if statut:
+        factures = factures.filter(statut=statut)
+    return factures.order_by('date_emission', 'id')
+
+
+def _initialiser_processus():
+    # Processus neuf (spawn) : Django doit être chargé pour désérialiser les factures
+    django.setup()
+
+
+def _rendre(facture):
+    # Exécuté dans un processus du pool : la facture arrive avec ses lignes
+    # préchargées, aucune requête n'est faite ici
+    return rendre_facture_pdf(facture)
+
+
+def _nom_archive(facture):
+    client = facture.client.nom_societe.replace(' ', '_').replace('/', '_')
+    return f"facture_{facture.numero_facture}_{client}.pdf"
+
+
+def _pdfs(factures, progression=None):
+    """
+    Produit (facture, contenu PDF) au fur et à mesure.
+
+    Les PDF déjà stockés (factures_pdf.obtenir_facture_pdf) sont relus tels
+    quels ; les autres sont rendus dans un ProcessPoolExecutor sur tous les
+    cœurs, puis stockés. Au plus deux rendus par processus sont en attente à la
+    fois. Les factures sont lues par lots de TAILLE_LOT, le préchargement des
+    lignes étant fait lot par lot : la mémoire reste bornée quel que soit le
+    nombre de factures.
+    """
+    processus = settings.EXPORT_PROCESSUS or os.cpu_count() or 1
+    # Les processus sont démarrés par spawn et non fork : ils ne partagent ni
+    # les connexions à la base ni l'état des autres threads du worker, le pool
+    # n'étant créé qu'au premier rendu, pendant que d'autres requêtes tournent
+    executeur = ProcessPoolExecutor(
+        max_workers=processus,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_initialiser_processus,
+    )
+    en_cours = {}
+    faits = 0
+    try:
+        def recuperer(futures):
+            nonlocal faits
+            for future in futures:
+                facture, cle = en_cours.pop(future)
+                contenu = future.result()
+                enregistrer_facture_pdf(facture, cle, contenu)
+                faits += 1
+                if progression:
+                    progression(faits)
+                yield facture, contenu
+
+        for facture in factures.iterator(chunk_size=TAILLE_LOT):
+            cle = cle_facture(facture)
+            nom = chemin_facture_pdf(facture, cle)
+            if default_storage.exists(nom):
+                with default_storage.open(nom, 'rb') as fichier:
+                    contenu = fichier.read()
+                faits += 1
+                if progression:
+                    progression(faits)
+                yield facture, contenu
+                continue
+
+            en_cours[executeur.submit(_rendre, facture)] = (facture, cle)
+            if len(en_cours) >= 2 * processus:
+                termines, _ = wait(en_cours, return_when=FIRST_COMPLETED)
+                yield from recuperer(termines)
+
+        while en_cours:
+            termines, _ = wait(en_cours, return_when=FIRST_COMPLETED)
+            yield from recuperer(termines)
+    finally:
+        executeur.shutdown(wait=False, cancel_futures=True)
+
+
+class _Tampon:
+    """Flux en écriture seule : zipfile y écrit, le générateur vide le contenu."""
+
+    def __init__(self):
+        self.morceaux = []
+
+    def write(self, donnees):
+        self.morceaux.append(bytes(donnees))
+        return len(donnees)
+
+    def flush(self):
+        pass
+
+    def vider(self):
+        donnees = b''.join(self.morceaux)
+        self.morceaux = []
+        return donnees
+
+
+def zip_factures(factures, progression=None):
+    """
+    Génère l'archive ZIP des factures par morceaux (pour StreamingHttpResponse
+    ou une écriture sur disque). Chaque PDF est émis dès qu'il est prêt.
+    """
+    tampon = _Tampon()
+    with zipfile.ZipFile(tampon, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for facture, contenu in _pdfs(factures, progression):
+            archive.writestr(_nom_archive(facture), contenu)
+            yield tampon.vider()
+    yield tampon.vider()
+
+
+def _cache():
+    # L'export tourne dans un worker, la page de suivi dans un autre : l'état
+    # doit être dans le cache commun aux processus
+    return caches['partage']
+
+
+def cle_etat(export_id):
+    return f'export_factures:{export_id}'
+
+
+def etat_export(export_id):
+    """État d'un export (total, faits, termine, fichier ou erreur), None s'il a expiré."""
+    return _cache().get(cle_etat(export_id))
+
+
+def purger_exports(age=DUREE_ETAT):
+    """Supprime les archives d'export plus anciennes que `age` secondes, dont
+    l'état a expiré du cache. Retourne leur nombre."""
+    if not default_storage.exists('exports'):
+        return 0
+    limite = time.time() - age
+    supprimes = 0
+    for entree in os.scandir(default_storage.path('exports')):
+        try:
+            if entree.is_file() and entree.stat().st_mtime < limite:
+                os.unlink(entree.path)
+                supprimes += 1
+        except FileNotFoundError:
+            pass
+    return supprimes
+
+
+def nouvel_export(total):
+    purger_exports()
+    export_id = uuid.uuid4().hex
+    _cache().set(cle_etat(export_id), {'total': total, 'faits': 0, 'termine': False}, DUREE_ETAT)
+    return export_id
+
+
+def executer_export(export_id, filtres):
+    """
+    Tâche de fond : écrit l'archive dans le stockage (exports/<id>.zip) en
+    publiant l'avancement dans le cache, lu par la page de suivi. L'archive
+    est supprimée par purger_exports une fois son état expiré.
+    """
+    etat = etat_export(export_id) or {'total': 0}
+
+    def progression(faits):
+        _cache().set(cle_etat(export_id), {**etat, 'faits': faits, 'termine': False}, DUREE_ETAT)
+
+    nom = f'exports/{export_id}.zip'
+    chemin = default_storage.path(nom)
+    try:
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        with open(chemin, 'wb') as fichier:
+            for morceau in zip_factures(factures_a_exporter(**filtres), progression):
+                fichier.write(morceau)
+    except Exception as e:
+        # Archive partielle : jamais téléchargeable, supprimée tout de suite
+        if os.path.exists(chemin):
+            os.unlink(chemin)
+        _cache().set(cle_etat(export_id), {**etat, 'termine': True, 'erreur': str(e)}, DUREE_ETAT)
+        raise
+    _cache().set(
+        cle_etat(export_id),
+        {**etat, 'faits': etat['total'], 'termine': True, 'fichier': nom},
+        DUREE_ETAT
+    )
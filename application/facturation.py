@@ -0,0 +1,103 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Sum
+from django.utils import timezone
+
+from .models import Commande, LigneCommande, Facture
+from .services import allouer_numeros
+from .tva import mettre_a_jour_cumuls
+
+TAUX_TVA = Decimal('20')
+
+
+def commandes_a_facturer():
+    """Commandes livrées qui n'ont encore aucune facture."""
+    return Commande.objects.filter(statut='LIVREE').filter(
+        ~Exists(Facture.objects.filter(commande_id=OuterRef('pk')))
+    )
+
+
+def facturer_lot(utilisateur, taille_lot=500, mode_paiement='virement', delai_jours=30):
+    """
+    Facture au plus `taille_lot` commandes livrées non facturées, en une
+    transaction et un nombre fixe de requêtes quel que soit le nombre de
+    commandes :
+
+    - verrouillage des commandes (les lignes déjà prises par un autre
+      traitement en parallèle sont sautées) ;
+    - montant HT de chaque commande par une agrégation SUM ;
+    - numéros de facture réservés en bloc ;
+    - factures et lignes de la table M2M insérées avec bulk_create.
+
+    Retourne la liste des factures créées (vide quand il n'y a plus rien à facturer).
+    """
+    with transaction.atomic():
+        commandes = list(
+            commandes_a_facturer()
+            .select_for_update(skip_locked=True, of=('self',))
+            .select_related('client')
+            .only('id', 'numero_commande', 'client_id', 'client__nom_societe')
+            .order_by('id')[:taille_lot]
+        )
+        if not commandes:
+            return []
+        ids = [commande.id for commande in commandes]
+
+        montants = dict(
+            LigneCommande.objects.filter(commande_id__in=ids)
+            .values('commande_id').annotate(ht=Sum('total_ligne'))
+            .values_list('commande_id', 'ht')
+        )
+        lignes = defaultdict(list)
+        for ligne_id, commande_id in LigneCommande.objects.filter(
+            commande_id__in=ids
+        ).values_list('id', 'commande_id'):
+            lignes[commande_id].append(ligne_id)
+
+        maintenant = timezone.now()
+        numeros = allouer_numeros(Facture, 'numero_facture', 'FAC', len(commandes))
+        factures = []
+        for commande, numero in zip(commandes, numeros):
+            facture = Facture(
+                commande=commande,
+                client=commande.client,
+                numero_facture=numero,
+                montant_ht=montants.get(commande.id) or Decimal('0'),
+                taux_tva=TAUX_TVA,
+                date_emission=maintenant,
+                date_echeance=maintenant + timedelta(days=delai_jours),
+                mode_paiement=mode_paiement,
+                utilisateur_creation=utilisateur,
+            )
+            # bulk_create n'appelle pas save() : mêmes calculs que Facture.save
+            facture.montant_tva = facture.montant_ht * (facture.taux_tva / 100)
+            facture.montant_ttc = facture.montant_ht + facture.montant_tva
+            facture.recherche = facture.texte_recherche()
+            factures.append(facture)
+        Facture.objects.bulk_create(factures)
+        mettre_a_jour_cumuls(factures)
+
+        Lien = Facture.ligne_commande.through
+        Lien.objects.bulk_create([
+            Lien(facture_id=facture.id, lignecommande_id=ligne_id)
+            for facture in factures
+            for ligne_id in lignes[facture.commande_id]
+        ], batch_size=1000)
+
+        # Pas de signal post_save : la version des pages détail est mise à jour ici
+        Commande.objects.filter(id__in=ids).update(date_modification=maintenant)
+
+    return factures
+
+
+def facturer_commandes_livrees(utilisateur, taille_lot=500, **options):
+    """Facture toutes les commandes livrées non facturées, lot par lot."""
+    factures = []
+    while True:
+        lot = facturer_lot(utilisateur, taille_lot, **options)
+        if not lot:
+            return factures
+        factures += lot
@@ -0,0 +1,141 @@
+import hashlib
+
+from django.core.files.storage import default_storage
+
+from . import pdf
+from .models import Facture
+from .stockage import publier_fichier, supprimer_versions_precedentes
+
+# Incrémenter quand la mise en page de la facture change, pour invalider les PDF stockés
+VERSION_GABARIT = 1
+
+CONDITIONS_PAIEMENT = """
+    <para align="center" fontSize="8" textColor="#6b7280">
+    <b>CONDITIONS DE PAIEMENT:</b><br/>
+    Paiement à réception de facture - Tout retard de paiement entraînera des pénalités<br/>
+    En cas de retard de paiement, une pénalité de 3 fois le taux d'intérêt légal sera appliquée<br/>
+    <br/>
+    <b>Merci de votre confiance</b>
+    </para>
+    """
+
+
+def rendre_facture_pdf(facture):
+    """
+    Construit le PDF d'une facture et retourne son contenu (bytes).
+
+    Le document est produit en mode `invariant` : une facture inchangée
+    donne toujours les mêmes octets. Les appelants préchargent client et
+    lignes (`prefetch_related('ligne_commande__poisson')`) : le rendu ne fait
+    alors aucune requête et peut tourner dans un autre processus.
+    """
+    client = facture.client
+    elements = pdf.entete_document(f"FACTURE {facture.numero_facture}")
+
+    # Informations de l'entreprise et du client
+    elements.append(pdf.bloc_parties(
+        [
+            f'Facturé à: {client.nom_societe}',
+            client.adresse or 'Adresse non renseignée',
+            f'Email: {client.email}',
+            f'ICE: {client.numero_ice or "N/A"}',
+            f'RC: {client.numero_registre_commerce or "N/A"}',
+        ],
+        [
+            ['Date émission:', facture.date_emission.strftime("%d/%m/%Y")],
+            ['Date échéance:', facture.date_echeance.strftime("%d/%m/%Y")],
+            ['Mode de paiement:', facture.get_mode_paiement_display()],
+            ['Statut:', facture.get_statut_display()],
+        ]
+    ))
+    elements.append(pdf.espace(30))
+
+    # Tableau des articles
+    elements += pdf.titre_section("DÉTAIL DES ARTICLES")
+    elements.append(pdf.tableau_lignes(
+        ['Produit', 'Code', 'Quantité', 'Prix Unitaire', 'Total HT'],
+        [
+            [
+                ligne.poisson.type,
+                ligne.poisson.code_produit,
+                f"{ligne.quantite} {ligne.poisson.unite_mesure}",
+                f"{ligne.prix_unitaire} MAD",
+                f"{ligne.total_ligne} MAD"
+            ]
+            for ligne in facture.ligne_commande.all()
+        ]
+    ))
+    elements.append(pdf.espace(30))
+
+    # Totaux
+    elements.append(pdf.tableau_totaux([
+        ('Sous-total HT:', f"{facture.montant_ht} MAD"),
+        (f'TVA ({facture.taux_tva}%):', f"{facture.montant_tva} MAD"),
+        ('Total TTC:', f"{facture.montant_ttc} MAD"),
+    ]))
+    elements.append(pdf.espace(40))
+
+    # Pied de page avec conditions
+    elements.append(pdf.paragraphe(CONDITIONS_PAIEMENT))
+    return pdf.construire(elements)
+
+
+def cle_facture(facture):
+    """
+    Empreinte des valeurs imprimées sur la facture (montants, dates, statut,
+    client, lignes). Elle change dès que le PDF changerait.
+    """
+    client = facture.client
+    valeurs = [
+        VERSION_GABARIT,
+        facture.numero_facture, facture.montant_ht, facture.taux_tva, facture.montant_tva,
+        facture.montant_ttc, facture.date_emission, facture.date_echeance,
+        facture.mode_paiement, facture.statut,
+        client.nom_societe, client.adresse, client.email, client.numero_ice,
+        client.numero_registre_commerce,
+    ]
+    for ligne in facture.ligne_commande.all():
+        valeurs += [
+            ligne.poisson.type, ligne.poisson.code_produit, ligne.poisson.unite_mesure,
+            ligne.quantite, ligne.prix_unitaire, ligne.total_ligne,
+        ]
+    return hashlib.sha256('|'.join(str(v) for v in valeurs).encode()).hexdigest()
+
+
+def chemin_facture_pdf(facture, cle):
+    return f'factures/{facture.id}/{cle}.pdf'
+
+
+def enregistrer_facture_pdf(facture, cle, contenu):
+    """
+    Stocke le PDF rendu pour la clé `cle` (écriture atomique, voir
+    stockage.publier_fichier) et supprime les versions plus anciennes.
+    """
+    nom = publier_fichier(chemin_facture_pdf(facture, cle), lambda fichier: fichier.write(contenu))
+    supprimer_versions_precedentes(nom)
+    return nom
+
+
+def obtenir_facture_pdf(facture):
+    """
+    Retourne (nom du fichier dans le stockage, clé) du PDF de la facture.
+
+    Le PDF est conservé sous `factures/<id>/<clé>.pdf` : tant que la clé ne
+    change pas, il est servi tel quel sans repasser par ReportLab. Sinon il est
+    rendu, enregistré, et les versions plus anciennes sont supprimées.
+    """
+    cle = cle_facture(facture)
+    nom = chemin_facture_pdf(facture, cle)
+    if default_storage.exists(nom):
+        return nom, cle
+    return enregistrer_facture_pdf(facture, cle, rendre_facture_pdf(facture)), cle
+
+
+def prerendre_facture(facture_id):
+    """Tâche de fond : prépare le PDF d'une facture qui vient d'être émise."""
+    facture = (
+        Facture.objects.select_related('client')
+        .prefetch_related('ligne_commande__poisson').filter(id=facture_id).first()
+    )
+    if facture is not None:
+        obtenir_facture_pdf(facture)
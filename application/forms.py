@@ -1,10 +1,15 @@
 from django import forms
 from django.core.exceptions import ValidationError
+from django.conf import settings
+from decimal import Decimal
+import os
 from .models import (
     User, CLIENT, POISSON, Commande, LigneCommande, Document, 
-    Facture, Livraison, EtapeTransport, Vehicule, MouvementStock
+    Facture, Livraison, EtapeTransport, Vehicule, MouvementStock, Televersement
 )
 
+EXTENSIONS_DOCUMENTS = ['.pdf', '.doc', '.docx', '.jpg', '.jpeg', '.png', '.xls', '.xlsx']
+
 class LoginForm(forms.Form):
     username = forms.CharField(
         max_length=100,
@@ -248,6 +253,13 @@ class LigneCommandeForm(forms.ModelForm):
         self.fields['poisson'].queryset = POISSON.objects.filter(actif=True)
         self.fields['prix_unitaire'].required = False
 
+class LigneCommandeBatchForm(forms.Form):
+    """Une ligne de la saisie en lot : le produit est un simple identifiant,
+    résolu ensuite en une seule requête pour toutes les lignes."""
+    poisson = forms.IntegerField(min_value=1)
+    quantite = forms.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    prix_unitaire = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+
 class DocumentForm(forms.ModelForm):
     class Meta:
         model = Document
@@ -255,7 +267,7 @@ class DocumentForm(forms.ModelForm):
         widgets = {
             'fichier': forms.FileInput(attrs={
                 'class': 'form-control',
-                'accept': '.pdf,.doc,.docx,.jpg,.jpeg,.png,.xls,.xlsx'
+                'accept': ','.join(EXTENSIONS_DOCUMENTS)
             }),
             'nom_document': forms.TextInput(attrs={'class': 'form-control'}),
             'type': forms.Select(attrs={'class': 'form-control'}),
@@ -265,6 +277,93 @@ class DocumentForm(forms.ModelForm):
             }),
         }
 
+class TeleversementForm(forms.ModelForm):
+    """Ouverture d'un téléversement par blocs (données JSON, pas de widgets)"""
+    class Meta:
+        model = Televersement
+        fields = ['nom_fichier', 'taille', 'nom_document', 'type', 'numero_document']
+
+    def clean_nom_fichier(self):
+        nom = os.path.basename(self.cleaned_data['nom_fichier'])
+        if os.path.splitext(nom)[1].lower() not in EXTENSIONS_DOCUMENTS:
+            raise ValidationError(f"Type de fichier non autorisé. Formats acceptés: {', '.join(EXTENSIONS_DOCUMENTS)}")
+        return nom
+
+    def clean_taille(self):
+        taille = self.cleaned_data['taille']
+        if taille <= 0 or taille > settings.TELEVERSEMENT_TAILLE_MAX:
+            raise ValidationError(
+                f'Taille invalide (maximum {settings.TELEVERSEMENT_TAILLE_MAX // (1024 * 1024)} Mo).'
+            )
+        return taille
+
+class FacturationLotForm(forms.Form):
+    mode_paiement = forms.ChoiceField(
+        choices=Facture._meta.get_field('mode_paiement').choices,
+        initial='virement',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    delai_jours = forms.IntegerField(
+        min_value=0, initial=30,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+
+class ExportFacturesForm(forms.Form):
+    date_debut = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    date_fin = forms.DateField(
+        required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    client = forms.ModelChoiceField(
+        queryset=CLIENT.objects.filter(actif=True).order_by('nom_societe'),
+        required=False,
+        empty_label='Tous les clients',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    statut = forms.ChoiceField(
+        choices=[('', 'Tous les statuts')] + Facture._meta.get_field('statut').choices,
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_debut, date_fin = cleaned_data.get('date_debut'), cleaned_data.get('date_fin')
+        if date_debut and date_fin and date_debut > date_fin:
+            raise ValidationError('La date de début doit précéder la date de fin.')
+        return cleaned_data
+
+class ImportCommandesForm(forms.Form):
+    fichier = forms.FileField(
+        widget=forms.FileInput(attrs={
+            'class': 'form-control',
+            'accept': '.csv'
+        })
+    )
+
+    def clean_fichier(self):
+        fichier = self.cleaned_data['fichier']
+        if not fichier.name.lower().endswith('.csv'):
+            raise ValidationError('Le fichier doit être au format CSV.')
+        return fichier
+
+class ReleveBancaireForm(forms.Form):
+    fichier = forms.FileField(
+        widget=forms.FileInput(attrs={
+            'class': 'form-control',
+            'accept': '.csv'
+        })
+    )
+
+    def clean_fichier(self):
+        fichier = self.cleaned_data['fichier']
+        if not fichier.name.lower().endswith('.csv'):
+            raise ValidationError('Le fichier doit être au format CSV.')
+        return fichier
+
 class FactureForm(forms.ModelForm):
     class Meta:
         model = Facture
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class PBKDF2PasswordHasherReglable(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 dont le nombre d'itérations vient du réglage PBKDF2_ITERATIONS.
+
+    Même algorithme que le hacheur de Django : les mots de passe existants
+    restent valides, et ceux encodés avec un autre nombre d'itérations sont
+    réencodés à la connexion suivante.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PBKDF2_ITERATIONS
@@ -0,0 +1,214 @@
+import csv
+import io
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import CLIENT, POISSON, Commande, LigneCommande
+from .services import allouer_numeros
+from .ventes import synchroniser_faits_ventes
+
+# Colonnes attendues dans le fichier CSV des commandes
+COLONNES_OBLIGATOIRES = ['reference', 'client', 'produit', 'quantite']
+COLONNES_OPTIONNELLES = ['type_commande', 'date_expedition', 'incoterm', 'commentaire', 'prix_unitaire']
+
+
+def _lire_csv(fichier):
+    contenu = fichier.read()
+    if isinstance(contenu, bytes):
+        contenu = contenu.decode('utf-8-sig')
+    try:
+        dialecte = csv.Sniffer().sniff(contenu[:4096], delimiters=',;')
+    except csv.Error:
+        dialecte = csv.excel
+    lecteur = csv.DictReader(io.StringIO(contenu), dialect=dialecte)
+    lecteur.fieldnames = [(nom or '').strip().lower() for nom in (lecteur.fieldnames or [])]
+    return lecteur
+
+
+def _decimal(valeur):
+    try:
+        return Decimal(valeur.strip().replace(' ', '').replace(',', '.'))
+    except (InvalidOperation, AttributeError):
+        return None
+
+
+def _date(valeur):
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(valeur.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def analyser_csv(fichier):
+    """
+    Lit et valide un fichier CSV de commandes sans rien écrire en base.
+
+    Chaque ligne du fichier est une ligne de commande ; les lignes partageant
+    la même `reference` forment une commande. Les clients (par code_client ou
+    ICE) et les produits (par code_produit) sont chargés une seule fois dans
+    des dictionnaires, quel que soit le nombre de lignes.
+
+    Retourne un rapport : {'commandes': [...], 'erreurs': [...], 'nb_lignes': n}
+    """
+    rapport = {'commandes': [], 'erreurs': [], 'nb_lignes': 0}
+
+    try:
+        lecteur = _lire_csv(fichier)
+        lignes = list(lecteur)
+    except (UnicodeDecodeError, csv.Error) as e:
+        rapport['erreurs'].append({'ligne': 0, 'message': f'Fichier illisible: {e}'})
+        return rapport
+
+    manquantes = [c for c in COLONNES_OBLIGATOIRES if c not in lecteur.fieldnames]
+    if manquantes:
+        rapport['erreurs'].append({
+            'ligne': 0,
+            'message': f"Colonnes manquantes: {', '.join(manquantes)}",
+        })
+        return rapport
+
+    rapport['nb_lignes'] = len(lignes)
+
+    codes_clients = {(l.get('client') or '').strip() for l in lignes} - {''}
+    codes_produits = {(l.get('produit') or '').strip() for l in lignes} - {''}
+
+    clients = {}
+    for client in CLIENT.objects.filter(actif=True).filter(
+        Q(code_client__in=codes_clients) | Q(numero_ice__in=codes_clients)
+    ):
+        if client.numero_ice:
+            clients[client.numero_ice] = client
+        clients[client.code_client] = client
+    produits = POISSON.objects.filter(actif=True).in_bulk(codes_produits, field_name='code_produit')
+
+    types = dict(Commande.TYPE_CHOICES)
+    incoterms = dict(Commande.INCOTERM_CHOICES)
+    commandes = OrderedDict()
+
+    # La ligne 1 du fichier est l'en-tête
+    for numero_ligne, ligne in enumerate(lignes, start=2):
+        valeurs = {cle: (val or '').strip() for cle, val in ligne.items() if cle}
+        erreurs = []
+
+        reference = valeurs.get('reference')
+        if not reference:
+            erreurs.append('référence manquante')
+
+        client = clients.get(valeurs.get('client'))
+        if client is None:
+            erreurs.append(f"client inconnu: {valeurs.get('client') or '(vide)'}")
+
+        produit = produits.get(valeurs.get('produit'))
+        if produit is None:
+            erreurs.append(f"produit inconnu: {valeurs.get('produit') or '(vide)'}")
+
+        quantite = _decimal(valeurs.get('quantite'))
+        if quantite is None or quantite <= 0:
+            erreurs.append(f"quantité invalide: {valeurs.get('quantite') or '(vide)'}")
+
+        prix_unitaire = None
+        if valeurs.get('prix_unitaire'):
+            prix_unitaire = _decimal(valeurs['prix_unitaire'])
+            if prix_unitaire is None or prix_unitaire < 0:
+                erreurs.append(f"prix invalide: {valeurs['prix_unitaire']}")
+
+        type_commande = (valeurs.get('type_commande') or 'EXPORT').upper()
+        if type_commande not in types:
+            erreurs.append(f'type de commande invalide: {type_commande}')
+
+        incoterm = (valeurs.get('incoterm') or '').upper() or None
+        if incoterm and incoterm not in incoterms:
+            erreurs.append(f'incoterm invalide: {incoterm}')
+
+        date_expedition = None
+        if valeurs.get('date_expedition'):
+            date_expedition = _date(valeurs['date_expedition'])
+            if date_expedition is None:
+                erreurs.append(f"date d'expédition invalide: {valeurs['date_expedition']}")
+
+        if erreurs:
+            rapport['erreurs'].append({'ligne': numero_ligne, 'message': ', '.join(erreurs)})
+            continue
+
+        commande = commandes.get(reference)
+        if commande is None:
+            commande = commandes[reference] = {
+                'reference': reference,
+                'client': client,
+                'type_commande': type_commande,
+                'incoterm': incoterm,
+                'date_expedition': date_expedition,
+                'commentaire': valeurs.get('commentaire') or '',
+                'lignes': [],
+                'total': Decimal('0'),
+            }
+        elif commande['client'].id != client.id or commande['type_commande'] != type_commande:
+            rapport['erreurs'].append({
+                'ligne': numero_ligne,
+                'message': f'client ou type différent des autres lignes de la référence {reference}',
+            })
+            continue
+
+        prix_unitaire = prix_unitaire or produit.prix
+        commande['lignes'].append({
+            'produit': produit,
+            'quantite': quantite,
+            'prix_unitaire': prix_unitaire,
+            'total_ligne': quantite * prix_unitaire,
+        })
+        commande['total'] += quantite * prix_unitaire
+
+    rapport['commandes'] = list(commandes.values())
+    return rapport
+
+
+def importer_commandes(rapport, utilisateur):
+    """
+    Crée en une transaction toutes les commandes d'un rapport validé.
+
+    Les numéros de commande sont réservés en bloc, puis commandes et lignes
+    sont insérées avec bulk_create. Retourne la liste des commandes créées.
+    """
+    if rapport['erreurs']:
+        raise ValueError("Le rapport contient des erreurs, import refusé.")
+
+    donnees = rapport['commandes']
+    with transaction.atomic():
+        numeros = allouer_numeros(Commande, 'numero_commande', 'CMD', len(donnees))
+        commandes = [
+            Commande(
+                numero_commande=numero,
+                type_commande=data['type_commande'],
+                client=data['client'],
+                incoterm=data['incoterm'],
+                date_expedition=data['date_expedition'],
+                commentaire=f"{data['commentaire']}\nRéf. client: {data['reference']}".strip(),
+                utilisateur_creation=utilisateur,
+            )
+            for numero, data in zip(numeros, donnees)
+        ]
+        # bulk_create n'appelle pas save() : le texte de recherche est calculé ici
+        for commande in commandes:
+            commande.recherche = commande.texte_recherche()
+        Commande.objects.bulk_create(commandes, batch_size=500)
+
+        LigneCommande.objects.bulk_create([
+            LigneCommande(
+                commande=commande,
+                poisson=ligne['produit'],
+                quantite=ligne['quantite'],
+                prix_unitaire=ligne['prix_unitaire'],
+                total_ligne=ligne['total_ligne'],
+            )
+            for commande, data in zip(commandes, donnees)
+            for ligne in data['lignes']
+        ], batch_size=1000)
+        synchroniser_faits_ventes(commande.id for commande in commandes)
+
+    return commandes
@@ -0,0 +1,50 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executeur = None
+
+
+def _get_executeur():
+    global _executeur
+    if _executeur is None:
+        _executeur = ThreadPoolExecutor(
+            max_workers=settings.JOBS_WORKERS, thread_name_prefix='jobs'
+        )
+    return _executeur
+
+
+def _executer(fonction, args):
+    # Une tâche en échec est journalisée : elle ne remonte ni dans le pool ni,
+    # avec JOBS_WORKERS = 0, dans la requête qui l'a lancée
+    try:
+        fonction(*args)
+    except Exception:
+        logger.exception("Échec de la tâche %s%r", fonction.__name__, args)
+
+
+def _executer_en_fond(fonction, args):
+    try:
+        _executer(fonction, args)
+    finally:
+        # Chaque thread ouvre sa propre connexion : elle est fermée après la tâche
+        connections.close_all()
+
+
+def lancer_apres_commit(fonction, *args):
+    """
+    Exécute `fonction(*args)` en arrière-plan une fois la transaction courante
+    validée, pour que la tâche voie les lignes qui viennent d'être écrites.
+
+    Les tâches tournent dans un pool de threads du processus (JOBS_WORKERS).
+    Avec JOBS_WORKERS = 0, elles sont exécutées immédiatement après le commit,
+    dans la requête (développement, scripts).
+    """
+    if settings.JOBS_WORKERS <= 0:
+        transaction.on_commit(lambda: _executer(fonction, args))
+    else:
+        transaction.on_commit(lambda: _get_executeur().submit(_executer_en_fond, fonction, args))
@@ -0,0 +1,131 @@
+import csv
+import os
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Comptabilite
+
+# Comptes du plan comptable marocain (CGNC)
+COMPTE_CLIENTS = '3421'
+COMPTE_VENTES = '7111'
+COMPTE_TVA = '4455'
+CODE_JOURNAL = 'VT'
+
+ENTETES = ['journal', 'date', 'piece', 'compte', 'compte_tiers', 'libelle', 'debit', 'credit', 'ecriture']
+
+# Colonnes lues pour chaque écriture : facture et client joints, sans instancier de modèles
+CHAMPS = [
+    'id', 'date_enregistrement', 'montant_total',
+    'commande__numero_commande', 'commande__client__code_client', 'commande__client__nom_societe',
+    'facture__numero_facture', 'facture__date_emission',
+    'facture__montant_ht', 'facture__montant_tva', 'facture__montant_ttc',
+    'facture__client__code_client', 'facture__client__nom_societe',
+]
+
+
+def ecritures_a_exporter():
+    # Filtre couvert par l'index (export_comptable, id)
+    return Comptabilite.objects.filter(export_comptable=False)
+
+
+def _montant(valeur):
+    return f'{valeur:.2f}' if valeur else ''
+
+
+def lignes_journal(ecriture):
+    """
+    Lignes du journal des ventes pour une écriture : débit du compte client
+    (TTC), crédit des ventes (HT) et de la TVA facturée. Sans facture, le
+    montant de l'écriture est passé en vente sans TVA.
+    """
+    valeurs = dict(zip(CHAMPS, ecriture))
+    if valeurs['facture__numero_facture']:
+        date = valeurs['facture__date_emission']
+        piece = valeurs['facture__numero_facture']
+        tiers = valeurs['facture__client__code_client'] or ''
+        nom = valeurs['facture__client__nom_societe']
+        ttc, ht, tva = valeurs['facture__montant_ttc'], valeurs['facture__montant_ht'], valeurs['facture__montant_tva']
+    else:
+        date = valeurs['date_enregistrement']
+        piece = valeurs['commande__numero_commande']
+        tiers = valeurs['commande__client__code_client'] or ''
+        nom = valeurs['commande__client__nom_societe']
+        ttc = ht = valeurs['montant_total']
+        tva = None
+
+    date = timezone.localtime(date).strftime('%d/%m/%Y')
+    libelle = f'{piece} {nom}'[:60]
+    lignes = [
+        [CODE_JOURNAL, date, piece, COMPTE_CLIENTS, tiers, libelle, _montant(ttc), '', valeurs['id']],
+        [CODE_JOURNAL, date, piece, COMPTE_VENTES, '', libelle, '', _montant(ht), valeurs['id']],
+    ]
+    if tva:
+        lignes.append([CODE_JOURNAL, date, piece, COMPTE_TVA, '', libelle, '', _montant(tva), valeurs['id']])
+    return lignes
+
+
+def exporter_journal(sortie, taille_lot=2000):
+    """
+    Écrit dans `sortie` (fichier texte) les écritures non encore exportées,
+    par lots de `taille_lot` lus dans l'ordre des id.
+
+    Chaque lot est lu, écrit et marqué exporté (un UPDATE ... WHERE id IN)
+    dans sa propre transaction : la mémoire reste bornée à un lot, et un
+    export interrompu reprend au premier lot non validé. Les lignes verrouillées
+    par un autre export en cours sont sautées. Retourne le nombre d'écritures
+    exportées.
+    """
+    writer = csv.writer(sortie, delimiter=';')
+    writer.writerow(ENTETES)
+    maintenant = timezone.now()
+    dernier_id = 0
+    total = 0
+    while True:
+        with transaction.atomic():
+            lot = list(
+                ecritures_a_exporter().filter(id__gt=dernier_id)
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('id').values_list(*CHAMPS)[:taille_lot]
+            )
+            if not lot:
+                break
+            for ecriture in lot:
+                writer.writerows(lignes_journal(ecriture))
+            # Le lot est sur disque avant d'être marqué exporté
+            sortie.flush()
+            os.fsync(sortie.fileno())
+            ids = [ecriture[0] for ecriture in lot]
+            Comptabilite.objects.filter(id__in=ids).update(
+                export_comptable=True, date_export_comptable=maintenant
+            )
+        dernier_id = ids[-1]
+        total += len(lot)
+    return total
+
+
+def exporter_journal_stockage(taille_lot=2000):
+    """
+    Exporte le journal dans le stockage (journaux/journal_<date>.csv) et
+    retourne (nom du fichier, nombre d'écritures). Le fichier est conservé :
+    il peut être téléchargé à nouveau. S'il est vide, il est supprimé et le
+    nom retourné est None.
+    """
+    nom = f"journaux/journal_{timezone.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    chemin = default_storage.path(nom)
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    with open(chemin, 'w', newline='', encoding='utf-8') as sortie:
+        total = exporter_journal(sortie, taille_lot)
+    if not total:
+        default_storage.delete(nom)
+        return None, 0
+    return nom, total
+
+
+def journaux_exportes():
+    """Journaux déjà produits, du plus récent au plus ancien."""
+    if not default_storage.exists('journaux'):
+        return []
+    _, fichiers = default_storage.listdir('journaux')
+    return sorted((f'journaux/{fichier}' for fichier in fichiers), reverse=True)
@@ -0,0 +1,104 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Seaux de jetons des tentatives de connexion : (capacité, secondes pour
+# regagner un jeton, échecs consécutifs avant blocage). Une adresse IP peut
+# regrouper plusieurs utilisateurs (réseau d'entreprise) : son seau est plus grand.
+SEAU_IP = (20, 30, 20)
+SEAU_UTILISATEUR = (5, 60, 5)
+
+# Une clé bloquée l'est BLOCAGE_INITIAL secondes, durée doublée à chaque
+# nouvel échec (au plus BLOCAGE_MAX).
+BLOCAGE_INITIAL = 30
+BLOCAGE_MAX = 60 * 60
+
+# Conservation d'un état sans tentative
+DUREE_ETAT = 24 * 60 * 60
+
+
+def _cache():
+    # Cache commun aux processus : les compteurs valent pour tous les workers
+    return caches['partage']
+
+
+def adresse_client(request):
+    """
+    Adresse IP du client pour les seaux. X-Forwarded-For est rempli par le
+    client lui-même : seules les PROXIES_DE_CONFIANCE dernières adresses,
+    ajoutées par nos proxies, sont fiables. Sans proxy, REMOTE_ADDR.
+    """
+    proxies = settings.PROXIES_DE_CONFIANCE
+    sauts = [saut.strip() for saut in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if saut.strip()]
+    if proxies and len(sauts) >= proxies:
+        return sauts[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def cles_connexion(adresse_ip, username):
+    """Clés des seaux d'une tentative : adresse IP et nom d'utilisateur (sans casse)."""
+    nom = hashlib.sha256(username.strip().lower().encode()).hexdigest()
+    return [(f'connexion:ip:{adresse_ip}', SEAU_IP), (f'connexion:nom:{nom}', SEAU_UTILISATEUR)]
+
+
+def _etat(cle, capacite, maintenant):
+    return _cache().get(cle) or {'jetons': capacite, 'maj': maintenant, 'echecs': 0, 'bloque_jusqua': 0}
+
+
+def _recharger(etat, capacite, intervalle, maintenant):
+    etat['jetons'] = min(capacite, etat['jetons'] + (maintenant - etat['maj']) / intervalle)
+    etat['maj'] = maintenant
+
+
+def consommer(cles):
+    """
+    Prélève un jeton dans chaque seau avant la vérification du mot de passe.
+
+    Retourne 0 si la tentative est autorisée, sinon le nombre de secondes à
+    attendre : la tentative est alors refusée sans hachage ni requête.
+    Lecture et écriture ne sont pas atomiques : deux tentatives simultanées
+    peuvent prélever le même jeton, la limite reste approchée.
+    """
+    maintenant = time.time()
+    etats = {}
+    attente = 0
+    for cle, (capacite, intervalle, _) in cles:
+        etat = _etat(cle, capacite, maintenant)
+        _recharger(etat, capacite, intervalle, maintenant)
+        if etat['bloque_jusqua'] > maintenant:
+            attente = max(attente, etat['bloque_jusqua'] - maintenant)
+        elif etat['jetons'] < 1:
+            attente = max(attente, (1 - etat['jetons']) * intervalle)
+        etats[cle] = etat
+    if attente:
+        return int(attente) + 1
+
+    for cle, etat in etats.items():
+        etat['jetons'] -= 1
+    _cache().set_many(etats, DUREE_ETAT)
+    return 0
+
+
+def enregistrer_echec(cles):
+    """Compte un échec ; au-delà du seuil, bloque la clé pour une durée qui double à chaque échec."""
+    maintenant = time.time()
+    etats = {}
+    for cle, (capacite, _, seuil) in cles:
+        etat = _etat(cle, capacite, maintenant)
+        etat['echecs'] += 1
+        depassement = etat['echecs'] - seuil
+        if depassement >= 0:
+            etat['bloque_jusqua'] = maintenant + min(BLOCAGE_INITIAL * 2 ** depassement, BLOCAGE_MAX)
+        etats[cle] = etat
+    _cache().set_many(etats, DUREE_ETAT)
+
+
+def enregistrer_succes(cles):
+    """Connexion réussie : fin des blocages ; le seau de l'adresse IP garde ses jetons."""
+    (cle_ip, (capacite, *_)), (cle_nom, _) = cles
+    etat = _etat(cle_ip, capacite, time.time())
+    etat.update(echecs=0, bloque_jusqua=0)
+    _cache().set(cle_ip, etat, DUREE_ETAT)
+    _cache().delete(cle_nom)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from application.models import Document
+from application.stockage import empreinte
+
+
+class Command(BaseCommand):
+    help = "Déplace les documents existants vers le stockage adressé par contenu et supprime les doublons"
+
+    def handle(self, *args, **options):
+        storage = Document._meta.get_field('fichier').storage
+        anciens = (
+            Document.objects.exclude(fichier='')
+            .values_list('fichier', flat=True).distinct()
+        )
+        deplaces = 0
+        for ancien in [nom for nom in anciens if not empreinte(nom)]:
+            if not storage.exists(ancien):
+                self.stderr.write(f'Fichier introuvable: {ancien}')
+                continue
+            with storage.open(ancien, 'rb') as fichier:
+                nouveau = storage.save(ancien, fichier)
+            with transaction.atomic():
+                Document.objects.filter(fichier=ancien).update(fichier=nouveau)
+            deplaces += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{deplaces} fichier(s) déplacé(s). Les anciens fichiers sont supprimés '
+            f'par la commande purger_fichiers_orphelins.'
+        ))
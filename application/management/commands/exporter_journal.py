@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from application.journal import exporter_journal, exporter_journal_stockage
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporte le journal des ventes (CSV) des écritures comptables non encore "
+        "exportées et les marque exportées. Relancer la commande reprend un export interrompu."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sortie', help="Fichier CSV à écrire (par défaut : journaux/ dans le stockage)")
+        parser.add_argument('--lot', type=int, default=2000, help="Nombre d'écritures par transaction")
+
+    def handle(self, *args, **options):
+        if options['sortie']:
+            with open(options['sortie'], 'w', newline='', encoding='utf-8') as sortie:
+                total = exporter_journal(sortie, options['lot'])
+            nom = options['sortie']
+        else:
+            nom, total = exporter_journal_stockage(options['lot'])
+        if not total:
+            self.stdout.write('Aucune écriture à exporter.')
+            return
+        self.stdout.write(self.style.SUCCESS(f'{total} écriture(s) exportée(s) dans {nom}.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from application.facturation import facturer_commandes_livrees
+from application.models import User
+
+
+class Command(BaseCommand):
+    help = "Génère les factures de toutes les commandes livrées qui n'en ont pas encore"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--utilisateur', help="Nom d'utilisateur enregistré comme créateur des factures")
+        parser.add_argument('--lot', type=int, default=500, help="Nombre de commandes par transaction")
+        parser.add_argument('--mode-paiement', default='virement')
+        parser.add_argument('--delai-jours', type=int, default=30, help="Échéance en jours après émission")
+
+    def handle(self, *args, **options):
+        utilisateur = None
+        if options['utilisateur']:
+            utilisateur = User.objects.filter(username=options['utilisateur']).first()
+            if utilisateur is None:
+                raise CommandError(f"Utilisateur inconnu: {options['utilisateur']}")
+
+        factures = facturer_commandes_livrees(
+            utilisateur,
+            taille_lot=options['lot'],
+            mode_paiement=options['mode_paiement'],
+            delai_jours=options['delai_jours'],
+        )
+        for facture in factures:
+            self.stdout.write(f'{facture.numero_facture}  {facture.montant_ttc} MAD TTC')
+        self.stdout.write(self.style.SUCCESS(f'{len(factures)} facture(s) générée(s).'))
@@ -0,0 +1,52 @@
+import time
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from application import pdf
+from application.factures_pdf import rendre_facture_pdf
+from application.models import Facture
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le coût de mise en place des PDF : import de ReportLab, feuilles "
+        "de style reconstruites à chaque document (ancien code) ou partagées"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repetitions', type=int, default=200)
+        parser.add_argument('--facture', type=int, help="Mesurer aussi le rendu complet de cette facture")
+
+    def handle(self, *args, **options):
+        n = options['repetitions']
+
+        debut = time.perf_counter()
+        pdf.rl()
+        self.stdout.write(f"Import ReportLab (premier document) : {(time.perf_counter() - debut) * 1000:.1f} ms")
+
+        def sans_cache():
+            pdf.vider_caches()
+            pdf.preparer()
+
+        par_document = timeit.timeit(sans_cache, number=n) / n
+        pdf.preparer()
+        partagees = timeit.timeit(pdf.preparer, number=n) / n
+        self.stdout.write(f"Styles reconstruits par document : {par_document * 1e6:.0f} µs")
+        self.stdout.write(f"Styles partagés : {partagees * 1e6:.1f} µs")
+
+        if options['facture']:
+            facture = (
+                Facture.objects.select_related('client')
+                .prefetch_related('ligne_commande__poisson')
+                .filter(id=options['facture']).first()
+            )
+            if facture is None:
+                raise CommandError(f"Facture {options['facture']} introuvable")
+            repetitions = max(n // 10, 1)
+            rendu = timeit.timeit(lambda: rendre_facture_pdf(facture), number=repetitions) / repetitions
+            self.stdout.write(f"Rendu complet de la facture : {rendu * 1000:.1f} ms")
+            self.stdout.write(
+                f"Gain par facture : {(par_document - partagees) * 1000:.2f} ms "
+                f"({(par_document - partagees) / (rendu + par_document - partagees):.0%} du rendu)"
+            )
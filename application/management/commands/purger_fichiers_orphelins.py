@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from application.models import Document
+from application.stockage import purger_fichiers_orphelins
+
+
+class Command(BaseCommand):
+    help = "Supprime les fichiers de documents et aperçus qu'aucun document ne référence plus"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--heures', type=int, default=1, help="Âge minimal des fichiers à supprimer")
+
+    def handle(self, *args, **options):
+        total = purger_fichiers_orphelins(Document, ['fichier', 'apercu'], timedelta(hours=options['heures']))
+        self.stdout.write(self.style.SUCCESS(f'{total} fichier(s) orphelin(s) supprimé(s).'))
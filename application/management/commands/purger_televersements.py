@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from application.televersements import purger_televersements
+
+
+class Command(BaseCommand):
+    help = "Supprime les téléversements par blocs inachevés et leurs fichiers partiels"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--heures', type=int, default=24, help="Âge minimal des téléversements à supprimer")
+
+    def handle(self, *args, **options):
+        total = purger_televersements(timedelta(hours=options['heures']))
+        self.stdout.write(self.style.SUCCESS(f'{total} téléversement(s) supprimé(s).'))
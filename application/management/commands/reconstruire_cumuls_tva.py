@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from application.tva import reconstruire_cumuls_tva
+
+
+class Command(BaseCommand):
+    help = "Reconstruit les cumuls mensuels de TVA à partir des factures"
+
+    def handle(self, *args, **options):
+        total = reconstruire_cumuls_tva()
+        self.stdout.write(self.style.SUCCESS(f'{total} cumul(s) de TVA reconstruit(s).'))
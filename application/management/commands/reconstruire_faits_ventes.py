@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from application.ventes import reconstruire_faits_ventes
+
+
+class Command(BaseCommand):
+    help = "Reconstruit les tables des faits de vente et de commande à partir des commandes et de leurs lignes"
+
+    def handle(self, *args, **options):
+        total = reconstruire_faits_ventes()
+        self.stdout.write(self.style.SUCCESS(f'{total} fait(s) de vente reconstruit(s).'))
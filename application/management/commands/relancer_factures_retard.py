@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from application.relances import relancer_factures_retard
+
+
+class Command(BaseCommand):
+    help = (
+        "Notifie les factures passées en retard de paiement depuis la dernière "
+        "exécution (à planifier, par exemple chaque heure)"
+    )
+
+    def handle(self, *args, **options):
+        factures, notifications = relancer_factures_retard()
+        self.stdout.write(self.style.SUCCESS(
+            f'{factures} facture(s) en retard, {notifications} notification(s) créée(s).'
+        ))
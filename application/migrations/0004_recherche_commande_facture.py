@@ -0,0 +1,68 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:12
+
+from django.db import migrations, models
+
+
+def remplir_recherche(apps, schema_editor):
+    Commande = apps.get_model('application', 'Commande')
+    Facture = apps.get_model('application', 'Facture')
+
+    def texte(*valeurs):
+        return ' '.join(str(v).lower() for v in valeurs if v)
+
+    def remplir(model, champs):
+        lot = []
+        for objet in model.objects.select_related('client').iterator(chunk_size=2000):
+            objet.recherche = texte(*(getattr(objet, c) if c != 'client' else objet.client.nom_societe for c in champs))
+            lot.append(objet)
+            if len(lot) == 2000:
+                model.objects.bulk_update(lot, ['recherche'])
+                lot = []
+        model.objects.bulk_update(lot, ['recherche'])
+
+    remplir(Commande, ['numero_commande', 'client', 'commentaire'])
+    remplir(Facture, ['numero_facture', 'client'])
+
+
+def creer_index_trigramme(apps, schema_editor):
+    # Index pg_trgm uniquement sous PostgreSQL ; SQLite garde un parcours simple
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS application_commande_recherche_trgm '
+        'ON application_commande USING gin (recherche gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS application_facture_recherche_trgm '
+        'ON application_facture USING gin (recherche gin_trgm_ops)'
+    )
+
+
+def supprimer_index_trigramme(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS application_commande_recherche_trgm')
+    schema_editor.execute('DROP INDEX IF EXISTS application_facture_recherche_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0003_alter_user_role'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commande',
+            name='recherche',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='facture',
+            name='recherche',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(remplir_recherche, migrations.RunPython.noop),
+        migrations.RunPython(creer_index_trigramme, supprimer_index_trigramme),
+    ]
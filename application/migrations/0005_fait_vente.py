@@ -0,0 +1,58 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def remplir_faits_ventes(apps, schema_editor):
+    LigneCommande = apps.get_model('application', 'LigneCommande')
+    FaitVente = apps.get_model('application', 'FaitVente')
+
+    lot = []
+    for ligne in LigneCommande.objects.select_related('commande').iterator(chunk_size=5000):
+        commande = ligne.commande
+        lot.append(FaitVente(
+            ligne_id=ligne.id,
+            commande_id=commande.id,
+            client_id=commande.client_id,
+            poisson_id=ligne.poisson_id,
+            date=timezone.localtime(commande.date_creation).date(),
+            type_commande=commande.type_commande,
+            statut=commande.statut,
+            quantite=ligne.quantite,
+            montant=ligne.total_ligne or 0,
+        ))
+        if len(lot) == 5000:
+            FaitVente.objects.bulk_create(lot)
+            lot = []
+    FaitVente.objects.bulk_create(lot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0004_recherche_commande_facture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaitVente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('type_commande', models.CharField(choices=[('EXPORT', 'Export'), ('IMPORT', 'Import'), ('LOCAL', 'Local')], max_length=10)),
+                ('statut', models.CharField(choices=[('BROUILLON', 'Brouillon'), ('CONFIRMEE', 'Confirmée'), ('PREPARATION', 'En préparation'), ('EXPEDIEE', 'Expédiée'), ('LIVREE', 'Livrée'), ('ANNULEE', 'Annulée')], max_length=15)),
+                ('quantite', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('montant', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='application.client')),
+                ('commande', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='faits_vente', to='application.commande')),
+                ('ligne', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fait_vente', to='application.lignecommande')),
+                ('poisson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='application.poisson')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'statut'], name='application_date_b2095c_idx'), models.Index(fields=['date', 'client'], name='application_date_b48416_idx')],
+            },
+        ),
+        migrations.RunPython(remplir_faits_ventes, migrations.RunPython.noop),
+    ]
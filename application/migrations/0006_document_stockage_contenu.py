@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:16
+
+import application.stockage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0005_fait_vente'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='fichier',
+            field=models.FileField(db_index=True, storage=application.stockage.StockageParContenu(), upload_to='documents/'),
+        ),
+    ]
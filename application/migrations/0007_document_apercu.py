@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:17
+
+import application.stockage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0006_document_stockage_contenu'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='apercu',
+            field=models.FileField(blank=True, storage=application.stockage.StockageParContenu(), upload_to='apercus/'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:18
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0007_document_apercu'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Televersement',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('nom_fichier', models.CharField(max_length=255)),
+                ('nom_document', models.CharField(max_length=100)),
+                ('type', models.CharField(choices=[('facture', 'Facture'), ('bon_livraison', 'Bon de Livraison'), ('bon_commande', 'Bon de Commande'), ('certificat_origine', "Certificat d'Origine"), ('licence_export', "Licence d'Export"), ('connaissement', 'Connaissement'), ('autre', 'Autre')], max_length=50)),
+                ('numero_document', models.CharField(blank=True, max_length=50, null=True)),
+                ('taille', models.BigIntegerField()),
+                ('taille_bloc', models.PositiveIntegerField()),
+                ('blocs_recus', models.PositiveIntegerField(default=0)),
+                ('date_creation', models.DateTimeField(default=django.utils.timezone.now)),
+                ('commande', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='application.commande')),
+                ('document', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='application.document')),
+                ('utilisateur', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='application.user')),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+def marquer_bons_generes(apps, schema_editor):
+    # Bons de commande produits par l'ancienne vue de génération : marqués pour
+    # être remplacés à la prochaine génération (les bons téléversés restent)
+    Document = apps.get_model('application', 'Document')
+    Document.objects.filter(
+        type='bon_commande', nom_document__startswith='Bon de commande - '
+    ).update(cle_generation='ancien')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0008_televersement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='cle_generation',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(marquer_bons_generes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0009_document_cle_generation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='facture',
+            index=models.Index(fields=['statut', 'date_echeance'], name='application_statut_d232ca_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def regler_factures_payees(apps, schema_editor):
+    # Les factures déjà marquées payées l'ont été pour leur montant total
+    Facture = apps.get_model('application', 'Facture')
+    Facture.objects.filter(statut='payee').update(montant_regle=F('montant_ttc'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0010_facture_statut_echeance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facture',
+            name='montant_regle',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='LigneReleve',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('empreinte', models.CharField(max_length=64, unique=True)),
+                ('date_operation', models.DateField()),
+                ('libelle', models.CharField(max_length=255)),
+                ('montant', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('date_import', models.DateTimeField(default=django.utils.timezone.now)),
+                ('factures', models.ManyToManyField(blank=True, related_name='lignes_releve', to='application.facture')),
+                ('utilisateur', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='application.user')),
+            ],
+        ),
+        migrations.RunPython(regler_factures_payees, migrations.RunPython.noop),
+    ]
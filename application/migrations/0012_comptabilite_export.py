@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0011_rapprochement_bancaire'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comptabilite',
+            index=models.Index(fields=['export_comptable', 'id'], name='application_export__af8849_idx'),
+        ),
+    ]
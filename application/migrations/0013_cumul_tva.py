@@ -0,0 +1,52 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:36
+
+from django.db import migrations, models
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+
+
+def calculer_cumuls(apps, schema_editor):
+    # Cumuls des factures existantes, en une agrégation groupée
+    Facture = apps.get_model('application', 'Facture')
+    CumulTVA = apps.get_model('application', 'CumulTVA')
+    CumulTVA.objects.bulk_create([
+        CumulTVA(**valeurs)
+        for valeurs in Facture.objects.annotate(
+            mois=TruncMonth('date_emission', output_field=DateField())
+        ).values('mois', 'taux_tva', 'statut').annotate(
+            nombre=Count('id'), montant_ht=Sum('montant_ht'),
+            montant_tva=Sum('montant_tva'), montant_ttc=Sum('montant_ttc'),
+        ).order_by()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0012_comptabilite_export'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CumulTVA',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mois', models.DateField()),
+                ('taux_tva', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('statut', models.CharField(max_length=20)),
+                ('nombre', models.PositiveIntegerField(default=0)),
+                ('montant_ht', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('montant_tva', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('montant_ttc', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='facture',
+            index=models.Index(fields=['date_emission', 'taux_tva', 'statut'], name='application_date_em_248ef5_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cumultva',
+            constraint=models.UniqueConstraint(fields=('mois', 'taux_tva', 'statut'), name='cumul_tva_unique'),
+        ),
+        migrations.RunPython(calculer_cumuls, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0013_cumul_tva'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EtatTache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=50, unique=True)),
+                ('derniere_execution', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='facture',
+            name='date_relance',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
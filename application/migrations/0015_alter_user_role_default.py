@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 00:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0014_relance_retards'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='role',
+            field=models.CharField(choices=[('ADMIN', 'Administrator'), ('COMPTABLE', 'Comptable'), ('GESTIONNAIRE', 'Gestionnaire')], default='GESTIONNAIRE', max_length=15),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-19 02:10
+
+import application.stockage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0015_alter_user_role_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='affichage',
+            field=models.FileField(blank=True, storage=application.stockage.StockageParContenu(), upload_to='affichages/'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.3 on 2026-10-19 01:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def remplir_faits_commande(apps, schema_editor):
+    Commande = apps.get_model('application', 'Commande')
+    FaitCommande = apps.get_model('application', 'FaitCommande')
+
+    lot = []
+    for commande in Commande.objects.iterator(chunk_size=5000):
+        lot.append(FaitCommande(
+            commande_id=commande.id,
+            client_id=commande.client_id,
+            date=timezone.localtime(commande.date_creation).date(),
+            type_commande=commande.type_commande,
+            statut=commande.statut,
+        ))
+        if len(lot) == 5000:
+            FaitCommande.objects.bulk_create(lot)
+            lot = []
+    FaitCommande.objects.bulk_create(lot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0016_document_affichage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaitCommande',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('type_commande', models.CharField(choices=[('EXPORT', 'Export'), ('IMPORT', 'Import'), ('LOCAL', 'Local')], max_length=10)),
+                ('statut', models.CharField(choices=[('BROUILLON', 'Brouillon'), ('CONFIRMEE', 'Confirmée'), ('PREPARATION', 'En préparation'), ('EXPEDIEE', 'Expédiée'), ('LIVREE', 'Livrée'), ('ANNULEE', 'Annulée')], max_length=15)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='application.client')),
+                ('commande', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fait_commande', to='application.commande')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'statut'], name='application_date_f90bdb_idx'), models.Index(fields=['date', 'type_commande'], name='application_date_2ac335_idx'), models.Index(fields=['date', 'client'], name='application_date_4f8d0e_idx')],
+            },
+        ),
+        migrations.RunPython(remplir_faits_commande, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-19 01:14
+
+from django.db import migrations
+from django.db.models import F
+
+
+def garder_version_compressee(apps, schema_editor):
+    # La version recompressée devient le fichier du document ; l'original,
+    # s'il n'est plus référencé, est effacé par purger_fichiers_orphelins
+    Document = apps.get_model('application', 'Document')
+    Document.objects.exclude(affichage='').update(fichier=F('affichage'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0017_fait_commande'),
+    ]
+
+    operations = [
+        migrations.RunPython(garder_version_compressee, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='document',
+            name='affichage',
+        ),
+    ]
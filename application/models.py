@@ -1,13 +1,18 @@
 from datetime import date
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.hashers import make_password
 from django.utils import timezone
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils.functional import cached_property
 from decimal import Decimal
 import uuid
 
+from .recherche import texte_recherche
+from .stockage import stockage_documents
+from .jobs import lancer_apres_commit
+
 class User(models.Model):
     ROLE_CHOICES = [
         ('ADMIN', 'Administrator'),
@@ -28,9 +33,19 @@ class User(models.Model):
             self.password = make_password(self.password)
         super().save(*args, **kwargs)
     
+    @property
+    def is_authenticated(self):
+        # Comme django.contrib.auth : request.user est un User ou un AnonymousUser
+        return True
+
     def __str__(self):
         return f"{self.username} ({self.role})"
 
+@receiver([post_save, post_delete], sender=User)
+def oublier_utilisateur_connecte(sender, instance, **kwargs):
+    from .authentification import oublier_utilisateur
+    oublier_utilisateur(instance.id)
+
 class CLIENT(models.Model):
     ROLE_CHOICES = [
         ('CLIENT', 'ACHETEUR'),
@@ -118,14 +133,20 @@ class Commande(models.Model):
     # Add user tracking
     utilisateur_creation = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='commandes_creees')
     date_modification = models.DateTimeField(auto_now=True)
+    # Texte de recherche (numéro, client, commentaire), voir recherche.py
+    recherche = models.TextField(blank=True, default='', editable=False)
 
     def save(self, *args, **kwargs):
         if not self.numero_commande:
             # Generate a unique command number
             timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
             self.numero_commande = f"CMD{timestamp}"
+        self.recherche = self.texte_recherche()
         super().save(*args, **kwargs)
 
+    def texte_recherche(self):
+        return texte_recherche(self.numero_commande, self.client.nom_societe, self.commentaire)
+
     def __str__(self):
         return f"{self.numero_commande} - {self.client.nom_societe}"
 
@@ -194,7 +215,13 @@ class Document(models.Model):
     ]
     
     commande = models.ForeignKey(Commande, on_delete=models.CASCADE)
-    fichier = models.FileField(upload_to='documents/')
+    # Adressé par contenu (SHA-256) : un même fichier est partagé entre Documents
+    fichier = models.FileField(upload_to='documents/', storage=stockage_documents, db_index=True)
+    # Miniature JPEG générée en arrière-plan (images, première page des PDF)
+    apercu = models.FileField(upload_to='apercus/', storage=stockage_documents, blank=True)
+    # Documents produits par l'application (bon de commande) : empreinte des
+    # données rendues, vide pour les documents téléversés
+    cle_generation = models.CharField(max_length=64, blank=True, default='', editable=False)
     nom_document = models.CharField(max_length=100)
     type = models.CharField(max_length=50, choices=TYPE_CHOICES)
     numero_document = models.CharField(max_length=50, blank=True, null=True)
@@ -208,6 +235,28 @@ class Document(models.Model):
     def __str__(self):
         return f"{self.nom_document} - Commande {self.commande.numero_commande}"
 
+class Televersement(models.Model):
+    """Téléversement d'un document en plusieurs blocs (reprise possible)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    commande = models.ForeignKey(Commande, on_delete=models.CASCADE)
+    utilisateur = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    nom_fichier = models.CharField(max_length=255)
+    nom_document = models.CharField(max_length=100)
+    type = models.CharField(max_length=50, choices=Document.TYPE_CHOICES)
+    numero_document = models.CharField(max_length=50, blank=True, null=True)
+    taille = models.BigIntegerField()
+    taille_bloc = models.PositiveIntegerField()
+    blocs_recus = models.PositiveIntegerField(default=0)
+    document = models.OneToOneField(Document, on_delete=models.SET_NULL, null=True, blank=True)
+    date_creation = models.DateTimeField(default=timezone.now)
+
+    @property
+    def nb_blocs(self):
+        return max(1, -(-self.taille // self.taille_bloc))
+
+    def __str__(self):
+        return f"{self.nom_fichier} ({self.blocs_recus}/{self.nb_blocs})"
+
 class Vehicule(models.Model):
     TYPE_CHOICES = [
         ('CAMION', 'Camion'),   
@@ -264,6 +313,10 @@ class Facture(models.Model):
     taux_tva = models.DecimalField(max_digits=5, decimal_places=2, default=20)
     montant_tva = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     montant_ttc = models.DecimalField(max_digits=10, decimal_places=2)
+    # Total des règlements reçus (rapprochement bancaire, voir rapprochement.py)
+    montant_regle = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Date de la notification de retard de paiement (voir relances.py)
+    date_relance = models.DateTimeField(null=True, blank=True, editable=False)
     date_emission = models.DateTimeField(default=timezone.now)
     date_echeance = models.DateTimeField()
     mode_paiement = models.CharField(max_length=50, choices=[
@@ -282,15 +335,216 @@ class Facture(models.Model):
     
     # Add user tracking
     utilisateur_creation = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    # Texte de recherche (numéro, client), voir recherche.py
+    recherche = models.TextField(blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            # Balance âgée et relances : factures ouvertes par date d'échéance
+            models.Index(fields=['statut', 'date_echeance']),
+            # Recalcul des cumuls mensuels de TVA (voir tva.py)
+            models.Index(fields=['date_emission', 'taux_tva', 'statut']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        facture = super().from_db(db, field_names, values)
+        # Cumul de TVA auquel la facture appartenait au chargement : il est
+        # recalculé aussi si la date, le taux ou le statut changent
+        if {'date_emission', 'taux_tva', 'statut'} <= set(facture.__dict__):
+            facture._cle_cumul = facture.cle_cumul()
+        return facture
 
     def save(self, *args, **kwargs):
         self.montant_tva = self.montant_ht * (self.taux_tva / 100)
         self.montant_ttc = self.montant_ht + self.montant_tva
+        self.recherche = self.texte_recherche()
         super().save(*args, **kwargs)
 
+    def texte_recherche(self):
+        return texte_recherche(self.numero_facture, self.client.nom_societe)
+
+    def cle_cumul(self):
+        """(mois, taux, statut) du cumul de TVA de la facture"""
+        return (timezone.localtime(self.date_emission).date().replace(day=1), self.taux_tva, self.statut)
+
+    @property
+    def reste_a_payer(self):
+        return self.montant_ttc - self.montant_regle
+
     def __str__(self):
         return f"Facture {self.numero_facture} - {self.client.nom_societe}"
 
+class LigneReleve(models.Model):
+    """Ligne de relevé bancaire déjà rapprochée : un relevé réimporté n'est
+    pas appliqué deux fois (voir rapprochement.py)"""
+    empreinte = models.CharField(max_length=64, unique=True)
+    date_operation = models.DateField()
+    libelle = models.CharField(max_length=255)
+    montant = models.DecimalField(max_digits=12, decimal_places=2)
+    factures = models.ManyToManyField(Facture, blank=True, related_name='lignes_releve')
+    date_import = models.DateTimeField(default=timezone.now)
+    utilisateur = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+
+    def __str__(self):
+        return f"Relevé {self.date_operation} - {self.montant} MAD - {self.libelle}"
+
+@receiver([post_save, post_delete], sender=LigneCommande)
+@receiver([post_save, post_delete], sender=Document)
+@receiver([post_save, post_delete], sender=EtapeTransport)
+@receiver([post_save, post_delete], sender=Livraison)
+@receiver([post_save, post_delete], sender=Facture)
+def toucher_commande(sender, instance, **kwargs):
+    """Toute modification d'un élément de la commande met à jour sa date de
+    modification, qui sert de version pour le cache de la page détail."""
+    Commande.objects.filter(id=instance.commande_id).update(date_modification=timezone.now())
+
+@receiver(post_save, sender=Document)
+def traiter_document_ajoute(sender, instance, created, **kwargs):
+    """Compression des images et génération de l'aperçu, en arrière-plan."""
+    if created and instance.fichier:
+        from .apercus import traiter_document
+        lancer_apres_commit(traiter_document, instance.id)
+
+@receiver(post_save, sender=Facture)
+def prerendre_facture_emise(sender, instance, **kwargs):
+    """Le PDF d'une facture émise est préparé en arrière-plan : le premier
+    téléchargement est servi depuis le stockage."""
+    if instance.statut == 'emise' and settings.FACTURES_PDF_PRERENDU:
+        from .factures_pdf import prerendre_facture
+        lancer_apres_commit(prerendre_facture, instance.id)
+
+@receiver(post_save, sender=CLIENT)
+def reindexer_client(sender, instance, created, **kwargs):
+    """Le nom du client fait partie du texte de recherche de ses commandes
+    et factures : il est recalculé avec texte_recherche (même normalisation
+    qu'à l'enregistrement) et réécrit par lots avec bulk_update."""
+    if created:
+        return
+    nom = instance.nom_societe
+    for model, champs in [(Commande, ['numero_commande', 'commentaire']), (Facture, ['numero_facture'])]:
+        lot = []
+        for id_objet, numero, *autres in model.objects.filter(client_id=instance.id).values_list('id', *champs).iterator(chunk_size=2000):
+            lot.append(model(id=id_objet, recherche=texte_recherche(numero, nom, *autres)))
+            if len(lot) == 2000:
+                model.objects.bulk_update(lot, ['recherche'])
+                lot = []
+        model.objects.bulk_update(lot, ['recherche'])
+
+class FaitVente(models.Model):
+    """Table de faits des ventes : une ligne par ligne de commande, avec les
+    attributs de la commande recopiés pour les rapports (voir ventes.py)."""
+    ligne = models.OneToOneField(LigneCommande, on_delete=models.CASCADE, related_name='fait_vente')
+    commande = models.ForeignKey(Commande, on_delete=models.CASCADE, related_name='faits_vente')
+    client = models.ForeignKey(CLIENT, on_delete=models.CASCADE)
+    poisson = models.ForeignKey(POISSON, on_delete=models.CASCADE)
+    date = models.DateField()
+    type_commande = models.CharField(max_length=10, choices=Commande.TYPE_CHOICES)
+    statut = models.CharField(max_length=15, choices=Commande.STATUT_CHOICES)
+    quantite = models.DecimalField(max_digits=10, decimal_places=2)
+    montant = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'statut']),
+            models.Index(fields=['date', 'client']),
+        ]
+
+    def __str__(self):
+        return f"Vente {self.date} - Commande {self.commande_id} - {self.montant} MAD"
+
+    @staticmethod
+    def depuis_ligne(ligne, commande):
+        return FaitVente(
+            ligne_id=ligne.id,
+            commande_id=commande.id,
+            client_id=commande.client_id,
+            poisson_id=ligne.poisson_id,
+            date=timezone.localtime(commande.date_creation).date(),
+            type_commande=commande.type_commande,
+            statut=commande.statut,
+            quantite=ligne.quantite,
+            montant=ligne.total_ligne or 0,
+        )
+
+class FaitCommande(models.Model):
+    """Table de faits des commandes : une ligne par commande, qu'elle ait des
+    lignes ou non. Les comptages du rapport des commandes se font ici, sur la
+    date indexée (voir ventes.py)."""
+    commande = models.OneToOneField(Commande, on_delete=models.CASCADE, related_name='fait_commande')
+    client = models.ForeignKey(CLIENT, on_delete=models.CASCADE)
+    date = models.DateField()
+    type_commande = models.CharField(max_length=10, choices=Commande.TYPE_CHOICES)
+    statut = models.CharField(max_length=15, choices=Commande.STATUT_CHOICES)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'statut']),
+            models.Index(fields=['date', 'type_commande']),
+            models.Index(fields=['date', 'client']),
+        ]
+
+    def __str__(self):
+        return f"Commande {self.commande_id} - {self.date} - {self.statut}"
+
+    @staticmethod
+    def depuis_commande(commande):
+        return FaitCommande(
+            commande_id=commande.id,
+            client_id=commande.client_id,
+            date=timezone.localtime(commande.date_creation).date(),
+            type_commande=commande.type_commande,
+            statut=commande.statut,
+        )
+
+@receiver(post_save, sender=LigneCommande)
+def synchroniser_fait_ligne(sender, instance, **kwargs):
+    fait = FaitVente.depuis_ligne(instance, instance.commande)
+    FaitVente.objects.update_or_create(ligne_id=instance.id, defaults={
+        champ: getattr(fait, champ)
+        for champ in ['commande_id', 'client_id', 'poisson_id', 'date', 'type_commande', 'statut', 'quantite', 'montant']
+    })
+
+@receiver(post_save, sender=Commande)
+def synchroniser_faits_commande(sender, instance, created, **kwargs):
+    fait = FaitCommande.depuis_commande(instance)
+    FaitCommande.objects.update_or_create(commande_id=instance.id, defaults={
+        champ: getattr(fait, champ) for champ in ['client_id', 'date', 'type_commande', 'statut']
+    })
+    if created:
+        return
+    FaitVente.objects.filter(commande_id=instance.id).update(
+        client_id=instance.client_id,
+        date=timezone.localtime(instance.date_creation).date(),
+        type_commande=instance.type_commande,
+        statut=instance.statut,
+    )
+
+class CumulTVA(models.Model):
+    """Cumul mensuel des factures par taux de TVA et statut, tenu à jour à
+    l'enregistrement des factures : la déclaration de TVA d'une période se
+    lit dans quelques lignes (voir tva.py)."""
+    mois = models.DateField()
+    taux_tva = models.DecimalField(max_digits=5, decimal_places=2)
+    statut = models.CharField(max_length=20)
+    nombre = models.PositiveIntegerField(default=0)
+    montant_ht = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    montant_tva = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    montant_ttc = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['mois', 'taux_tva', 'statut'], name='cumul_tva_unique'),
+        ]
+
+    def __str__(self):
+        return f"TVA {self.mois:%m/%Y} - {self.taux_tva}% - {self.statut} - {self.montant_tva} MAD"
+
+@receiver([post_save, post_delete], sender=Facture)
+def mettre_a_jour_cumul_tva(sender, instance, **kwargs):
+    from .tva import mettre_a_jour_cumuls
+    mettre_a_jour_cumuls([instance])
+
 class Notification(models.Model):
     utilisateur = models.ForeignKey(User, on_delete=models.CASCADE)
     message = models.TextField()
@@ -300,6 +554,16 @@ class Notification(models.Model):
     def __str__(self):
         return f"Notification {self.id} - Utilisateur {self.utilisateur.username} - {self.date_notification.strftime('%Y-%m-%d %H:%M:%S')}"
 
+class EtatTache(models.Model):
+    """Dernière exécution d'une tâche planifiée (voir relances.py). Sert
+    aussi de ligne de verrou pour l'attribution des numéros
+    (services.allouer_numeros)."""
+    nom = models.CharField(max_length=50, unique=True)
+    derniere_execution = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.nom} - {self.derniere_execution}"
+
 class Historique(models.Model):
     utilisateur = models.ForeignKey(User, on_delete=models.CASCADE)
     action = models.CharField(max_length=255)
@@ -426,6 +690,10 @@ class Comptabilite(models.Model):
     class Meta:
         verbose_name = "Comptabilité"
         verbose_name_plural = "Comptabilités"
+        indexes = [
+            # Export du journal : écritures non exportées, parcourues par id
+            models.Index(fields=['export_comptable', 'id']),
+        ]
 
     def __str__(self):
         return f"Comptabilité {self.id} - Commande {self.commande.numero_commande}"
\ No newline at end of file
@@ -0,0 +1,303 @@
+"""
+Mise en page PDF commune : factures, bons de commande, dossiers et rapports.
+
+ReportLab n'est importé qu'au premier document produit (`rl()`), et les
+feuilles de style (ParagraphStyle, TableStyle) sont construites une seule
+fois par processus puis partagées : elles ne sont que lues lors du rendu.
+"""
+import io
+from functools import lru_cache
+from types import SimpleNamespace
+
+from django.utils import timezone
+
+# Coordonnées de l'entreprise, colonne de gauche du bloc émetteur / client
+ENTREPRISE = [
+    'VOTRE ENTREPRISE',
+    'Export/Import Poisson',
+    'Casablanca, Maroc',
+    'Tél: +212 xxx xxx xxx',
+    'Email: contact@entreprise.ma',
+]
+
+BLEU = '#2563eb'
+BLEU_FONCE = '#1e40af'
+BLEU_CLAIR = '#f0f9ff'
+GRIS_BORDURE = '#e2e8f0'
+GRIS_LIGNE = '#f8fafc'
+VERT = '#059669'
+VERT_CLAIR = '#f0fdf4'
+
+
+@lru_cache(maxsize=None)
+def rl():
+    """Modules ReportLab utilisés par l'application, importés au premier appel."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    return SimpleNamespace(
+        colors=colors, A4=A4, getSampleStyleSheet=getSampleStyleSheet,
+        ParagraphStyle=ParagraphStyle, inch=inch, ImageReader=ImageReader, canvas=canvas,
+        SimpleDocTemplate=SimpleDocTemplate, Table=Table, TableStyle=TableStyle,
+        Paragraph=Paragraph, Spacer=Spacer,
+    )
+
+
+@lru_cache(maxsize=None)
+def styles():
+    """Feuille de style ReportLab complétée des styles de l'application."""
+    r = rl()
+    feuille = r.getSampleStyleSheet()
+    feuille.add(r.ParagraphStyle(
+        'TitreDocument',
+        parent=feuille['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        textColor=r.colors.HexColor(BLEU),
+        alignment=1  # Centré
+    ))
+    feuille.add(r.ParagraphStyle(
+        'TitreSection',
+        parent=feuille['Normal'],
+        fontSize=12,
+        textColor=r.colors.HexColor(BLEU_FONCE),
+        spaceAfter=12
+    ))
+    feuille.add(r.ParagraphStyle(
+        'TitreRapport',
+        parent=feuille['Heading1'],
+        fontSize=16,
+        spaceAfter=30,
+        alignment=1  # Centré
+    ))
+    return feuille
+
+
+@lru_cache(maxsize=None)
+def _style_parties():
+    r = rl()
+    return r.TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, 4), 'Helvetica-Bold'),
+        ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('TOPPADDING', (0, 0), (-1, -1), 8),
+        ('BACKGROUND', (0, 0), (0, 4), r.colors.HexColor(BLEU_CLAIR)),
+        ('BACKGROUND', (1, 0), (1, 0), r.colors.HexColor(BLEU_CLAIR)),
+        ('LINEBELOW', (0, 5), (-1, 5), 1, r.colors.HexColor(GRIS_BORDURE)),
+        ('FONTNAME', (0, 6), (-1, -1), 'Helvetica-Bold'),
+        ('TEXTCOLOR', (0, 6), (-1, -1), r.colors.HexColor(BLEU)),
+    ])
+
+
+@lru_cache(maxsize=None)
+def _style_lignes(avec_total):
+    r = rl()
+    commandes = [
+        ('BACKGROUND', (0, 0), (-1, 0), r.colors.HexColor(BLEU)),
+        ('TEXTCOLOR', (0, 0), (-1, 0), r.colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 11),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -1), 1, r.colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+    ]
+    if avec_total:
+        commandes += [
+            ('ROWBACKGROUNDS', (0, 1), (-2, -1), [r.colors.white, r.colors.HexColor(GRIS_LIGNE)]),
+            ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),
+            # Ligne de total
+            ('BACKGROUND', (-1, -1), (-1, -1), r.colors.HexColor(VERT_CLAIR)),
+            ('FONTNAME', (-2, -1), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (-2, -1), (-1, -1), 11),
+        ]
+    else:
+        commandes += [
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [r.colors.white, r.colors.HexColor(GRIS_LIGNE)]),
+            ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),  # Montants alignés à droite
+        ]
+    return r.TableStyle(commandes)
+
+
+@lru_cache(maxsize=None)
+def _style_totaux():
+    r = rl()
+    return r.TableStyle([
+        ('ALIGN', (3, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (3, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (3, 0), (-1, -1), 11),
+        ('FONTNAME', (3, -1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (3, -1), (-1, -1), 14),
+        ('BACKGROUND', (3, -1), (-1, -1), r.colors.HexColor(VERT_CLAIR)),
+        ('TEXTCOLOR', (3, -1), (-1, -1), r.colors.HexColor(VERT)),
+        ('LINEABOVE', (3, -1), (-1, -1), 2, r.colors.HexColor(VERT)),
+        ('BOTTOMPADDING', (3, 0), (-1, -1), 10),
+        ('TOPPADDING', (3, 0), (-1, -1), 10),
+        ('GRID', (3, 0), (-1, -1), 1, r.colors.HexColor(GRIS_BORDURE)),
+    ])
+
+
+@lru_cache(maxsize=None)
+def _style_statistiques():
+    r = rl()
+    return r.TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), r.colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), r.colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), r.colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, r.colors.black)
+    ])
+
+
+@lru_cache(maxsize=None)
+def _style_rapport(avec_total):
+    r = rl()
+    commandes = [
+        # En-tête
+        ('BACKGROUND', (0, 0), (-1, 0), r.colors.navy),
+        ('TEXTCOLOR', (0, 0), (-1, 0), r.colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        # Corps du tableau
+        ('BACKGROUND', (0, 1), (-1, -2 if avec_total else -1), r.colors.white),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 1, r.colors.black),
+    ]
+    if avec_total:
+        commandes += [
+            ('BACKGROUND', (0, -1), (-1, -1), r.colors.lightgrey),
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ]
+    return r.TableStyle(commandes)
+
+
+_FEUILLES = (styles, _style_parties, _style_lignes, _style_totaux, _style_statistiques, _style_rapport)
+
+
+def preparer():
+    """Construit toutes les feuilles de style (préchauffage d'un processus, mesures)."""
+    styles()
+    _style_parties()
+    _style_lignes(False)
+    _style_lignes(True)
+    _style_totaux()
+    _style_statistiques()
+    _style_rapport(False)
+    _style_rapport(True)
+
+
+def vider_caches():
+    """Oublie les feuilles de style construites ; la prochaine utilisation les reconstruit."""
+    for feuille in _FEUILLES:
+        feuille.cache_clear()
+
+
+# === Composants ===
+
+def construire(elements, rapport=False):
+    """
+    Assemble les éléments et retourne le PDF (bytes). Les documents
+    (factures, bons) ont des marges fixes et sont produits en mode invariant ;
+    les rapports utilisent la mise en page par défaut.
+    """
+    r = rl()
+    buffer = io.BytesIO()
+    if rapport:
+        doc = r.SimpleDocTemplate(buffer, pagesize=r.A4)
+    else:
+        doc = r.SimpleDocTemplate(buffer, pagesize=r.A4, rightMargin=72, leftMargin=72,
+                                  topMargin=72, bottomMargin=18, invariant=1)
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def espace(hauteur):
+    return rl().Spacer(1, hauteur)
+
+
+def paragraphe(texte, style='Normal'):
+    return rl().Paragraph(texte, styles()[style])
+
+
+def entete_document(titre):
+    return [paragraphe(titre, 'TitreDocument'), espace(20)]
+
+
+def titre_section(titre):
+    return [paragraphe(titre, 'TitreSection'), espace(10)]
+
+
+def bloc_parties(colonne_client, informations):
+    """
+    Bloc émetteur / destinataire : l'entreprise à gauche, `colonne_client`
+    (5 lignes) à droite, puis les lignes `informations` (libellé, valeur).
+    """
+    r = rl()
+    donnees = [list(ligne) for ligne in zip(ENTREPRISE, colonne_client)]
+    donnees.append(['', ''])
+    donnees += [list(ligne) for ligne in informations]
+    table = r.Table(donnees, colWidths=[3 * r.inch, 3 * r.inch])
+    table.setStyle(_style_parties())
+    return table
+
+
+def tableau_lignes(entetes, lignes, total=None):
+    """Tableau des articles ; `total` ajoute une ligne (libellé, montant) en bas."""
+    r = rl()
+    donnees = [entetes] + lignes
+    if total is not None:
+        donnees.append(['', '', '', total[0], total[1]])
+    table = r.Table(donnees, colWidths=[2 * r.inch, 1 * r.inch, 1.5 * r.inch, 1.5 * r.inch, 1.5 * r.inch])
+    table.setStyle(_style_lignes(total is not None))
+    return table
+
+
+def tableau_totaux(totaux):
+    """Totaux alignés sous la dernière colonne ; la dernière ligne est mise en avant."""
+    r = rl()
+    donnees = [['', '', '', libelle, montant] for libelle, montant in totaux]
+    table = r.Table(donnees, colWidths=[1.5 * r.inch] * 5)
+    table.setStyle(_style_totaux())
+    return table
+
+
+def entete_rapport(titre):
+    return [
+        paragraphe(titre, 'TitreRapport'),
+        espace(12),
+        paragraphe(f"Généré le {timezone.now().strftime('%d/%m/%Y à %H:%M')}"),
+        espace(20),
+    ]
+
+
+def tableau_statistiques(lignes):
+    r = rl()
+    table = r.Table([['Statistiques Générales', '']] + lignes, colWidths=[3 * r.inch, 2 * r.inch])
+    table.setStyle(_style_statistiques())
+    return table
+
+
+def tableau_rapport(donnees, largeurs, avec_total=False):
+    """Tableau de rapport ; `largeurs` en pouces, dernière ligne en gras si `avec_total`."""
+    r = rl()
+    table = r.Table(donnees, colWidths=[largeur * r.inch for largeur in largeurs])
+    table.setStyle(_style_rapport(avec_total))
+    return table
+
+
+def pied_rapport(username):
+    return [espace(30), paragraphe(f"Rapport généré par {username} - FishFlow Manager", 'Italic')]
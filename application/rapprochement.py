@@ -0,0 +1,328 @@
+import csv
+import hashlib
+import re
+import unicodedata
+from collections import defaultdict, Counter
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .creances import STATUTS_OUVERTS
+from .imports import _lire_csv, _decimal, _date
+from .models import CLIENT, Commande, Facture, LigneReleve
+from .tva import mettre_a_jour_cumuls
+
+# Colonnes attendues dans le relevé bancaire (CSV)
+COLONNES_OBLIGATOIRES = ['date', 'libelle', 'montant']
+COLONNES_OPTIONNELLES = ['reference']
+
+# Résultats possibles du rapprochement d'une ligne
+EXACT = 'exact'
+MULTIPLE = 'multiple'
+PARTIEL = 'partiel'
+MONTANT_SEUL = 'montant'
+AUCUN = 'aucun'
+DEJA_IMPORTE = 'deja_importe'
+
+
+def _mots(texte):
+    """Mots en majuscules sans accents : « Pêcherie Atlantique » -> {'PECHERIE', 'ATLANTIQUE'}."""
+    texte = unicodedata.normalize('NFKD', texte or '').encode('ascii', 'ignore').decode().upper()
+    return set(re.findall(r'[A-Z0-9]+', texte))
+
+
+class Index:
+    """
+    Factures ouvertes et clients chargés une fois par import, dans des
+    dictionnaires : chaque ligne du relevé est rapprochée sans requête.
+    """
+
+    def __init__(self):
+        factures = list(
+            Facture.objects.filter(statut__in=STATUTS_OUVERTS)
+            .select_related('client').order_by('date_echeance', 'id')
+        )
+        self.factures = {facture.id: facture for facture in factures}
+        # Reste à payer, diminué au fil des lignes rapprochées dans cet import
+        self.restes = {facture.id: facture.reste_a_payer for facture in factures}
+        self.par_numero = {facture.numero_facture.upper(): facture for facture in factures}
+        self.par_montant = defaultdict(list)
+        self.par_client = defaultdict(list)
+        for facture in factures:
+            self.par_montant[facture.reste_a_payer].append(facture)
+            self.par_client[facture.client_id].append(facture)
+
+        # Un client est reconnu quand tous les mots de son nom (ou son ICE)
+        # figurent dans le libellé
+        self.noms_clients = {}
+        self.clients_par_mot = defaultdict(set)
+        self.clients_par_ice = {}
+        for client in CLIENT.objects.filter(id__in=self.par_client).only('id', 'nom_societe', 'numero_ice'):
+            mots = {mot for mot in _mots(client.nom_societe) if len(mot) > 2}
+            if mots:
+                self.noms_clients[client.id] = len(mots)
+                for mot in mots:
+                    self.clients_par_mot[mot].add(client.id)
+            if client.numero_ice:
+                self.clients_par_ice[client.numero_ice.upper()] = client.id
+
+    def ouvertes(self, factures):
+        return [facture for facture in factures if self.restes[facture.id] > 0]
+
+    def factures_citees(self, mots):
+        return self.ouvertes(sorted(
+            {self.par_numero[mot] for mot in mots if mot in self.par_numero},
+            key=lambda facture: (facture.date_echeance, facture.id)
+        ))
+
+    def client(self, mots):
+        """Client reconnu dans le libellé, s'il n'y en a qu'un."""
+        clients = {self.clients_par_ice[mot] for mot in mots if mot in self.clients_par_ice}
+        if not clients:
+            trouves = Counter(client_id for mot in mots for client_id in self.clients_par_mot.get(mot, ()))
+            clients = {client_id for client_id, nombre in trouves.items() if nombre == self.noms_clients[client_id]}
+        return clients.pop() if len(clients) == 1 else None
+
+
+def _repartir(index, montant, factures):
+    """Affecte `montant` aux factures dans l'ordre, dans la limite de leur reste à payer."""
+    affectations = []
+    for facture in factures:
+        if montant <= 0:
+            break
+        part = min(montant, index.restes[facture.id])
+        affectations.append((facture, part))
+        montant -= part
+    return affectations, montant
+
+
+def _rapprocher(index, montant, mots):
+    """Retourne (résultat, critère, affectations, excédent) pour une ligne créditrice."""
+    citees = index.factures_citees(mots)
+    if citees:
+        affectations, excedent = _repartir(index, montant, citees)
+        soldees = all(part == index.restes[facture.id] for facture, part in affectations)
+        if not soldees:
+            resultat = PARTIEL
+        else:
+            resultat = MULTIPLE if len(affectations) > 1 else EXACT
+        return resultat, 'référence', affectations, excedent
+
+    client_id = index.client(mots)
+    if client_id is not None:
+        factures = index.ouvertes(index.par_client[client_id])
+        # Une facture du montant exact, sinon les plus anciennes dont la somme tombe juste
+        for facture in factures:
+            if index.restes[facture.id] == montant:
+                return EXACT, 'client', [(facture, montant)], Decimal('0')
+        cumul = Decimal('0')
+        for nombre, facture in enumerate(factures, start=1):
+            cumul += index.restes[facture.id]
+            if cumul == montant:
+                return MULTIPLE, 'client', [(f, index.restes[f.id]) for f in factures[:nombre]], Decimal('0')
+            if cumul > montant:
+                break
+        if factures and montant < index.restes[factures[0].id]:
+            return PARTIEL, 'client', [(factures[0], montant)], Decimal('0')
+
+    candidates = index.ouvertes(index.par_montant.get(montant, []))
+    if len(candidates) == 1:
+        return MONTANT_SEUL, 'montant', [(candidates[0], montant)], Decimal('0')
+    return AUCUN, '', [], montant
+
+
+def empreinte_ligne(date_operation, montant, libelle, reference, occurrence):
+    valeurs = [date_operation, montant, libelle, reference, occurrence]
+    return hashlib.sha256('|'.join(str(v) for v in valeurs).encode()).hexdigest()
+
+
+def analyser_releve(fichier):
+    """
+    Lit un relevé bancaire CSV et propose, pour chaque ligne créditrice, les
+    factures ouvertes qu'elle règle, sans rien écrire en base.
+
+    Ordre des critères : numéros de facture cités dans le libellé ou la
+    référence (un virement peut en régler plusieurs, ou une partie) ; client
+    reconnu dans le libellé (facture du montant exact, ou ses plus anciennes
+    factures dont la somme correspond, ou règlement partiel de la plus
+    ancienne) ; enfin montant seul s'il ne correspond qu'à une facture.
+
+    Retourne un rapport : {'propositions': [...], 'erreurs': [...], 'nb_lignes': n}
+    """
+    rapport = {'propositions': [], 'erreurs': [], 'nb_lignes': 0}
+
+    try:
+        lecteur = _lire_csv(fichier)
+        lignes = list(lecteur)
+    except (UnicodeDecodeError, csv.Error) as e:
+        rapport['erreurs'].append({'ligne': 0, 'message': f'Fichier illisible: {e}'})
+        return rapport
+
+    manquantes = [c for c in COLONNES_OBLIGATOIRES if c not in lecteur.fieldnames]
+    if manquantes:
+        rapport['erreurs'].append({
+            'ligne': 0,
+            'message': f"Colonnes manquantes: {', '.join(manquantes)}",
+        })
+        return rapport
+
+    rapport['nb_lignes'] = len(lignes)
+    index = Index()
+    occurrences = Counter()
+    credits = []
+
+    # La ligne 1 du fichier est l'en-tête
+    for numero_ligne, ligne in enumerate(lignes, start=2):
+        valeurs = {cle: (val or '').strip() for cle, val in ligne.items() if cle}
+        date_operation = _date(valeurs.get('date', ''))
+        montant = _decimal(valeurs.get('montant'))
+        if date_operation is None or montant is None:
+            rapport['erreurs'].append({
+                'ligne': numero_ligne,
+                'message': f"date ou montant invalide: {valeurs.get('date') or '(vide)'} / {valeurs.get('montant') or '(vide)'}",
+            })
+            continue
+        if montant <= 0:
+            # Débit : hors rapprochement des factures clients
+            continue
+        libelle = valeurs.get('libelle', '')[:255]
+        reference = valeurs.get('reference', '')
+        cle = (date_operation, montant, libelle, reference)
+        occurrences[cle] += 1
+        credits.append((numero_ligne, date_operation, montant, libelle, reference,
+                        empreinte_ligne(*cle, occurrences[cle])))
+
+    deja_importees = set(LigneReleve.objects.filter(
+        empreinte__in=[credit[-1] for credit in credits]
+    ).values_list('empreinte', flat=True))
+
+    for numero_ligne, date_operation, montant, libelle, reference, empreinte in credits:
+        proposition = {
+            'ligne': numero_ligne,
+            'date': date_operation,
+            'montant': montant,
+            'libelle': libelle,
+            'reference': reference,
+            'empreinte': empreinte,
+            'resultat': DEJA_IMPORTE,
+            'critere': '',
+            'affectations': [],
+            'excedent': Decimal('0'),
+        }
+        if empreinte not in deja_importees:
+            resultat, critere, affectations, excedent = _rapprocher(
+                index, montant, _mots(f'{libelle} {reference}')
+            )
+            for facture, part in affectations:
+                index.restes[facture.id] -= part
+            proposition.update(resultat=resultat, critere=critere, affectations=affectations, excedent=excedent)
+        rapport['propositions'].append(proposition)
+
+    return rapport
+
+
+def figer_propositions(rapport):
+    """
+    Propositions à confirmer, sous une forme sérialisable en JSON : elles sont
+    conservées entre l'aperçu et la confirmation, qui applique exactement ce
+    qui a été montré. L'état de chaque facture vu par l'analyse (montant réglé,
+    statut) est conservé avec, pour être revérifié au moment d'appliquer.
+    """
+    factures = {}
+    propositions = []
+    for proposition in rapport['propositions']:
+        if not proposition['affectations']:
+            continue
+        for facture, _ in proposition['affectations']:
+            factures[str(facture.id)] = [str(facture.montant_regle), facture.statut]
+        propositions.append({
+            'ligne': proposition['ligne'],
+            'empreinte': proposition['empreinte'],
+            'date': proposition['date'].isoformat(),
+            'libelle': proposition['libelle'],
+            'montant': str(proposition['montant']),
+            'affectations': [[facture.id, str(part)] for facture, part in proposition['affectations']],
+        })
+    return {'factures': factures, 'propositions': propositions}
+
+
+def appliquer_rapprochement(figees, lignes_acceptees, utilisateur):
+    """
+    Enregistre les règlements des propositions figées (figer_propositions)
+    acceptées (numéros de ligne du fichier) : montant réglé de chaque facture,
+    statut `payee` quand elle est soldée. Les factures sont mises à jour en un
+    seul bulk_update.
+
+    Les factures sont verrouillées puis comparées à l'état vu par l'analyse :
+    une ligne dont une facture a changé entre-temps (autre règlement, statut),
+    ou déjà rapprochée (double confirmation), est refusée et rien n'en est
+    appliqué. Une confirmation concurrente attend le verrou, puis voit les
+    factures modifiées et refuse ses lignes.
+    Retourne (nombre de lignes appliquées, factures mises à jour, lignes refusées).
+    """
+    propositions = [p for p in figees['propositions'] if p['ligne'] in lignes_acceptees]
+    if not propositions:
+        return 0, [], []
+
+    with transaction.atomic():
+        ids = {facture_id for p in propositions for facture_id, _ in p['affectations']}
+        factures = {
+            facture.id: facture
+            for facture in Facture.objects.select_for_update().filter(id__in=ids).order_by('id')
+        }
+        modifiees = set()
+        for facture_id in ids:
+            montant_regle, statut = figees['factures'][str(facture_id)]
+            facture = factures.get(facture_id)
+            if facture is None or facture.montant_regle != Decimal(montant_regle) or facture.statut != statut:
+                modifiees.add(facture_id)
+        deja_importees = set(LigneReleve.objects.filter(
+            empreinte__in=[p['empreinte'] for p in propositions]
+        ).values_list('empreinte', flat=True))
+
+        refusees = [
+            p['ligne'] for p in propositions
+            if p['empreinte'] in deja_importees
+            or any(facture_id in modifiees for facture_id, _ in p['affectations'])
+        ]
+        propositions = [p for p in propositions if p['ligne'] not in refusees]
+        if not propositions:
+            return 0, [], refusees
+
+        mises_a_jour = {}
+        for proposition in propositions:
+            for facture_id, part in proposition['affectations']:
+                facture = factures[facture_id]
+                facture.montant_regle += Decimal(part)
+                if facture.montant_regle >= facture.montant_ttc:
+                    facture.statut = 'payee'
+                mises_a_jour[facture_id] = facture
+        mises_a_jour = list(mises_a_jour.values())
+        Facture.objects.bulk_update(mises_a_jour, ['montant_regle', 'statut'])
+        mettre_a_jour_cumuls(mises_a_jour)
+
+        lignes = LigneReleve.objects.bulk_create([
+            LigneReleve(
+                empreinte=p['empreinte'],
+                date_operation=date.fromisoformat(p['date']),
+                libelle=p['libelle'],
+                montant=Decimal(p['montant']),
+                utilisateur=utilisateur,
+            )
+            for p in propositions
+        ])
+        Lien = LigneReleve.factures.through
+        Lien.objects.bulk_create([
+            Lien(lignereleve_id=ligne.id, facture_id=facture_id)
+            for ligne, p in zip(lignes, propositions)
+            for facture_id, _ in p['affectations']
+        ], ignore_conflicts=True)
+
+        # Pas de signal post_save : la version des pages détail est mise à jour ici
+        Commande.objects.filter(
+            id__in={facture.commande_id for facture in mises_a_jour}
+        ).update(date_modification=timezone.now())
+
+    return len(propositions), mises_a_jour, refusees
@@ -0,0 +1,40 @@
+from django.db.models import Case, When, Value, IntegerField
+
+
+def texte_recherche(*valeurs):
+    """
+    Texte indexé d'un objet : les valeurs recherchables, en minuscules.
+
+    Il est stocké dans la colonne `recherche` du modèle. Sous PostgreSQL, un
+    index GIN pg_trgm sur cette colonne sert les recherches `LIKE '%terme%'` ;
+    ailleurs (SQLite en développement) la même requête fait un simple parcours.
+    """
+    return ' '.join(str(v).lower() for v in valeurs if v)
+
+
+def filtrer_recherche(queryset, terme, champ_numero):
+    """
+    Filtre `queryset` sur sa colonne `recherche` et classe les résultats.
+
+    Chaque mot du terme doit apparaître dans le texte indexé. Les résultats
+    dont le numéro (`champ_numero`) est exactement le terme viennent en
+    premier, puis ceux dont le numéro commence par le terme, puis le reste.
+    `recherche__contains` est volontaire : `icontains` applique UPPER() à la
+    colonne et empêcherait l'utilisation de l'index trigramme.
+    """
+    mots = terme.lower().split()
+    if not mots:
+        return queryset
+
+    for mot in mots:
+        queryset = queryset.filter(recherche__contains=mot)
+
+    terme = terme.strip()
+    return queryset.annotate(
+        rang_recherche=Case(
+            When(**{f'{champ_numero}__iexact': terme}, then=Value(0)),
+            When(**{f'{champ_numero}__istartswith': terme}, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        )
+    ).order_by('rang_recherche', *queryset.query.order_by)
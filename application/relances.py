@@ -0,0 +1,70 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .creances import factures_ouvertes
+from .models import EtatTache, Facture, Notification, User
+
+TACHE = 'relance_retards'
+
+# Rôles notifiés de tous les retards, en plus du créateur de la facture
+ROLES_NOTIFIES = ['ADMIN', 'COMPTABLE']
+
+
+def message_retard(facture):
+    return (
+        f"Facture {facture.numero_facture} ({facture.client.nom_societe}) échue le "
+        f"{timezone.localtime(facture.date_echeance).strftime('%d/%m/%Y')} : "
+        f"{facture.reste_a_payer:.2f} MAD restant dû."
+    )
+
+
+def relancer_factures_retard(maintenant=None, taille_lot=1000):
+    """
+    Notifie les factures ouvertes en retard qui n'ont pas encore été relancées.
+
+    Toutes les factures ouvertes échues sont lues (index statut, date_echeance),
+    quelle que soit la date de leur échéance : une facture échue depuis
+    longtemps mais rouverte ou remise en attente depuis la dernière exécution
+    est donc reprise. Chaque facture notifiée reçoit une date de relance et
+    n'est plus reprise, même si l'exécution est relancée. Les notifications
+    (créateur de la facture s'il est actif, administrateurs et comptables) sont
+    insérées avec bulk_create.
+
+    Retourne (nombre de factures, nombre de notifications).
+    """
+    maintenant = maintenant or timezone.now()
+    with transaction.atomic():
+        # Verrou sur l'état de la tâche : deux exécutions ne se chevauchent pas
+        etat, _ = EtatTache.objects.get_or_create(nom=TACHE)
+        etat = EtatTache.objects.select_for_update().get(id=etat.id)
+
+        factures = list(
+            factures_ouvertes().filter(date_echeance__lt=maintenant, date_relance__isnull=True)
+            .select_related('client', 'utilisateur_creation')
+            .only('id', 'numero_facture', 'date_echeance', 'montant_ttc', 'montant_regle',
+                  'client__nom_societe', 'utilisateur_creation__id', 'utilisateur_creation__actif')
+            .order_by('date_echeance', 'id')
+        )
+
+        notifications = []
+        if factures:
+            responsables = list(
+                User.objects.filter(actif=True, role__in=ROLES_NOTIFIES).values_list('id', flat=True)
+            )
+            for facture in factures:
+                destinataires = set(responsables)
+                createur = facture.utilisateur_creation
+                if createur is not None and createur.actif:
+                    destinataires.add(createur.id)
+                message = message_retard(facture)
+                notifications += [
+                    Notification(utilisateur_id=utilisateur_id, message=message, date_notification=maintenant)
+                    for utilisateur_id in sorted(destinataires)
+                ]
+            Notification.objects.bulk_create(notifications, batch_size=taille_lot)
+            Facture.objects.filter(id__in=[facture.id for facture in factures]).update(date_relance=maintenant)
+
+        etat.derniere_execution = maintenant
+        etat.save(update_fields=['derniere_execution'])
+
+    return len(factures), len(notifications)
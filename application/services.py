@@ -0,0 +1,292 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db.models import Max, OuterRef, Prefetch, Subquery, Sum, prefetch_related_objects
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from .models import (
+    Commande, LigneCommande, POISSON, MouvementStock, Document,
+    Facture, Livraison, EtapeTransport, Vehicule, EtatTache
+)
+from .forms import LigneCommandeBatchForm
+from .ventes import synchroniser_faits_ventes
+
+
+def allouer_numeros(model, champ, prefixe, nombre):
+    """
+    Réserve un bloc de `nombre` numéros uniques pour `model.champ`.
+
+    Les numéros générés par les save() des modèles (PREFIXE + horodatage à la
+    seconde) entrent en collision dès que plusieurs objets sont créés dans la
+    même seconde. Ici, l'horodatage est suivi d'un compteur sur 4 chiffres qui
+    reprend après le plus grand numéro déjà attribué pour cette seconde.
+
+    À appeler dans la transaction qui crée les objets : la ligne EtatTache du
+    champ est verrouillée jusqu'à sa validation, un second appel concurrent
+    attend donc que les numéros du premier soient écrits avant de lire le
+    plus grand.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        raise RuntimeError("allouer_numeros doit être appelé dans transaction.atomic().")
+    verrou, _ = EtatTache.objects.get_or_create(nom=f'numeros:{model._meta.label_lower}.{champ}')
+    EtatTache.objects.select_for_update().get(id=verrou.id)
+
+    base = f"{prefixe}{timezone.now().strftime('%Y%m%d%H%M%S')}"
+    existants = model.objects.filter(**{f'{champ}__startswith': base}).values_list(champ, flat=True)
+    depart = max(
+        (int(numero[len(base):]) for numero in existants if numero[len(base):].isdigit()),
+        default=0,
+    )
+    return [f"{base}{depart + i:04d}" for i in range(1, nombre + 1)]
+
+
+class StockInsuffisantError(Exception):
+    """Levée quand une transition de statut ne peut pas être appliquée faute de stock"""
+
+    def __init__(self, manques):
+        self.manques = manques
+        super().__init__(', '.join(
+            f"{m['produit']} (disponible: {m['disponible']}, demandé: {m['demande']})"
+            for m in manques
+        ))
+
+
+# Effet d'une transition sur le stock : (type de mouvement, signe, motif)
+def _effet_stock(commande, ancien_statut, nouveau_statut):
+    type_commande = commande.type_commande
+    numero = commande.numero_commande
+
+    if nouveau_statut == 'CONFIRMEE' and ancien_statut != 'CONFIRMEE':
+        if type_commande == 'IMPORT':
+            return 'ENTREE', 1, f'Confirmation commande IMPORT {numero}'
+        return 'SORTIE', -1, f'Confirmation commande {type_commande} {numero}'
+
+    if nouveau_statut == 'ANNULEE' and ancien_statut == 'CONFIRMEE':
+        if type_commande == 'IMPORT':
+            return 'AJUSTEMENT', -1, f'Annulation commande IMPORT {numero}'
+        return 'RETOUR', 1, f'Annulation commande {type_commande} {numero}'
+
+    if (nouveau_statut == 'LIVREE' and type_commande in ['EXPORT', 'LOCAL']
+            and ancien_statut != 'CONFIRMEE'):
+        return 'SORTIE', -1, f'Livraison commande {numero}'
+
+    return None
+
+
+def changer_statut(commande_id, nouveau_statut, utilisateur_id):
+    """
+    Applique une transition de statut et les mouvements de stock associés.
+
+    Toutes les lignes sont traitées en bloc : les produits concernés sont
+    verrouillés en une seule requête, le stock est vérifié pour l'ensemble de
+    la commande avant toute écriture, puis les mouvements (un par ligne) et
+    les nouveaux soldes sont écrits avec bulk_create / bulk_update. Le nombre
+    de requêtes ne dépend pas du nombre de lignes. Si un produit manque de
+    stock, rien n'est modifié et StockInsuffisantError est levée.
+
+    Retourne la liste des mouvements créés.
+    """
+    with transaction.atomic():
+        commande = Commande.objects.select_for_update().get(id=commande_id)
+        ancien_statut = commande.statut
+        effet = _effet_stock(commande, ancien_statut, nouveau_statut)
+        mouvements = []
+
+        if effet:
+            type_mouvement, signe, motif = effet
+
+            lignes = list(LigneCommande.objects.filter(
+                commande_id=commande.id
+            ).order_by('id').values_list('poisson_id', 'quantite'))
+
+            if nouveau_statut == 'LIVREE':
+                # Ne pas sortir à nouveau ce qui a déjà été sorti pour cette commande
+                deja_sortis = set(MouvementStock.objects.filter(
+                    commande_id=commande.id,
+                    type_mouvement='SORTIE',
+                    poisson_id__in={poisson_id for poisson_id, _ in lignes},
+                ).values_list('poisson_id', flat=True))
+                lignes = [ligne for ligne in lignes if ligne[0] not in deja_sortis]
+
+            # Quantités agrégées par produit (une commande peut répéter un produit)
+            quantites = defaultdict(Decimal)
+            for poisson_id, quantite in lignes:
+                quantites[poisson_id] += quantite
+
+            # Verrous pris dans l'ordre des id : deux transitions concurrentes
+            # sur des produits communs ne peuvent pas s'interbloquer
+            poissons = POISSON.objects.select_for_update().order_by('id').in_bulk(
+                list(quantites), field_name='id'
+            )
+
+            if signe < 0 and type_mouvement == 'SORTIE':
+                manques = [
+                    {
+                        'produit': poissons[poisson_id].type,
+                        'disponible': poissons[poisson_id].quantite_stock,
+                        'demande': quantite,
+                    }
+                    for poisson_id, quantite in quantites.items()
+                    if poissons[poisson_id].quantite_stock < quantite
+                ]
+                if manques:
+                    raise StockInsuffisantError(manques)
+
+            maintenant = timezone.now()
+            for poisson_id, quantite in quantites.items():
+                poisson = poissons[poisson_id]
+                poisson.quantite_stock += signe * quantite
+                if poisson.quantite_stock < 0:
+                    poisson.quantite_stock = 0
+                poisson.date_modification = maintenant
+
+            # Un mouvement par ligne : l'historique du stock garde le détail de la commande
+            for poisson_id, quantite in lignes:
+                mouvements.append(MouvementStock(
+                    poisson=poissons[poisson_id],
+                    type_mouvement=type_mouvement,
+                    quantite=-quantite if type_mouvement == 'AJUSTEMENT' else quantite,
+                    commande=commande,
+                    utilisateur_id=utilisateur_id,
+                    motif=motif,
+                    date_mouvement=maintenant,
+                ))
+
+            if mouvements:
+                MouvementStock.objects.bulk_create(mouvements)
+                POISSON.objects.bulk_update(
+                    list(poissons.values()), ['quantite_stock', 'date_modification']
+                )
+
+        commande.statut = nouveau_statut
+        commande.save(update_fields=['statut', 'date_modification'])
+
+    return mouvements
+
+
+def ajouter_lignes(commande, lignes_data):
+    """
+    Ajoute plusieurs lignes à une commande en une fois.
+
+    `lignes_data` est une liste de dicts (poisson, quantite, prix_unitaire).
+    Chaque ligne est validée, les prix des produits sont résolus en une seule
+    requête, les totaux sont calculés en mémoire et les lignes insérées avec
+    bulk_create. Si une ligne est invalide, rien n'est inséré.
+
+    Retourne (lignes_creees, erreurs, total_commande) où `erreurs` associe
+    l'index de chaque ligne invalide à ses messages d'erreur.
+    """
+    erreurs = {}
+    valides = []
+    for index, data in enumerate(lignes_data):
+        form = LigneCommandeBatchForm(data)
+        if form.is_valid():
+            valides.append((index, form.cleaned_data))
+        else:
+            erreurs[index] = {champ: [str(m) for m in msgs] for champ, msgs in form.errors.items()}
+
+    poissons = POISSON.objects.filter(actif=True).in_bulk(
+        {data['poisson'] for _, data in valides}
+    )
+
+    lignes = []
+    for index, data in valides:
+        poisson = poissons.get(data['poisson'])
+        if poisson is None:
+            erreurs[index] = {'poisson': ['Produit introuvable ou inactif.']}
+            continue
+        prix_unitaire = data['prix_unitaire'] or poisson.prix
+        lignes.append(LigneCommande(
+            commande=commande,
+            poisson=poisson,
+            quantite=data['quantite'],
+            prix_unitaire=prix_unitaire,
+            total_ligne=data['quantite'] * prix_unitaire,
+        ))
+
+    if erreurs or not lignes:
+        return [], erreurs, None
+
+    with transaction.atomic():
+        LigneCommande.objects.bulk_create(lignes)
+        Commande.objects.filter(id=commande.id).update(date_modification=timezone.now())
+        synchroniser_faits_ventes([commande.id])
+        total_commande = LigneCommande.objects.filter(commande_id=commande.id).aggregate(
+            total=Sum('total_ligne')
+        )['total'] or 0
+
+    return lignes, erreurs, total_commande
+
+
+# Fragments de commandes/detail.html mis en cache par version de commande
+FRAGMENTS_DETAIL_COMMANDE = ['commande_lignes', 'commande_documents', 'commande_suivi']
+
+
+def _prefetch_detail_commande():
+    return [
+        Prefetch('lignecommande_set', queryset=LigneCommande.objects.select_related('poisson')),
+        Prefetch('document_set', queryset=Document.objects.order_by('-date_ajout')),
+        Prefetch('facture_set', queryset=Facture.objects.order_by('-date_emission')),
+        Prefetch('livraison_set', queryset=Livraison.objects.select_related('vehicule')),
+        Prefetch('etapes_transport', queryset=EtapeTransport.objects.order_by('date_depart')),
+    ]
+
+
+def _derniere_modification(model, chemin):
+    """Sous-requête : plus récente date_modification des `model` liés à la commande par `chemin`."""
+    return Subquery(
+        model.objects.filter(**{chemin: OuterRef('pk')})
+        .order_by().values(chemin).annotate(derniere=Max('date_modification')).values('derniere')[:1]
+    )
+
+
+def version_commande(commande):
+    """
+    Version de l'affichage d'une commande.
+
+    Les lignes, documents, factures, livraisons et étapes de transport mettent
+    à jour Commande.date_modification quand ils changent (voir
+    models.toucher_commande) ; la date de modification du client couvre les
+    informations client affichées. Les produits et véhicules, partagés entre
+    commandes, ne la touchent pas : leur plus récente modification est lue par
+    charger_detail_commande (annotations produits_modifies, vehicules_modifies).
+    """
+    dates = [
+        commande.date_modification,
+        commande.client.date_modification,
+        getattr(commande, 'produits_modifies', None),
+        getattr(commande, 'vehicules_modifies', None),
+    ]
+    return '-'.join(str(date.timestamp()) if date else '0' for date in dates)
+
+
+def charger_detail_commande(commande_id):
+    """
+    Charge une commande pour la page détail.
+
+    La commande est lue avec son client et son créateur en une requête. Les
+    collections filles ne sont préchargées (une requête par collection) que si
+    un des fragments de la page n'est pas déjà en cache pour cette version.
+
+    Retourne (commande, version).
+    """
+    commande = get_object_or_404(
+        Commande.objects.select_related('client', 'utilisateur_creation').annotate(
+            produits_modifies=_derniere_modification(POISSON, 'lignecommande__commande'),
+            vehicules_modifies=_derniere_modification(Vehicule, 'livraison__commande'),
+        ),
+        id=commande_id
+    )
+    version = version_commande(commande)
+    cles = [
+        make_template_fragment_key(fragment, [commande.id, version])
+        for fragment in FRAGMENTS_DETAIL_COMMANDE
+    ]
+    if len(cache.get_many(cles)) < len(cles):
+        prefetch_related_objects([commande], *_prefetch_detail_commande())
+    return commande, version
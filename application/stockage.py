@@ -0,0 +1,164 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.deconstruct import deconstructible
+
+_NOM_EMPREINTE_RE = re.compile(r'(?:^|/)([0-9a-f]{64})(?:\.[^/]*)?$')
+
+
+def empreinte(nom):
+    """Retourne le SHA-256 contenu dans un nom de fichier adressé par contenu, sinon None."""
+    correspondance = _NOM_EMPREINTE_RE.search(nom or '')
+    return correspondance.group(1) if correspondance else None
+
+
+@deconstructible
+class StockageParContenu(FileSystemStorage):
+    """
+    Stockage adressé par contenu : chaque fichier est enregistré sous
+    `<dossier>/<2 premiers caractères>/<sha256><extension>`.
+
+    Un contenu déjà présent n'est pas réécrit ; plusieurs Documents pointent
+    alors vers le même fichier. Les fichiers ne sont jamais supprimés pendant
+    une requête : `purger_fichiers_orphelins` efface ceux qu'aucune ligne ne
+    référence plus.
+    """
+
+    def _save(self, name, content):
+        sha = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for bloc in content.chunks():
+            sha.update(bloc)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        dossier, nom_original = os.path.split(name)
+        extension = os.path.splitext(nom_original)[1].lower()
+        digest = sha.hexdigest()
+        name = os.path.join(dossier, digest[:2], f'{digest}{extension}').replace('\\', '/')
+
+        if self.exists(name):
+            # Un fichier réutilisé redevient récent : la purge des orphelins
+            # ne le supprime pas avant que la ligne qui le référence soit validée
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass
+        return super()._save(name, content)
+
+
+stockage_documents = StockageParContenu()
+
+# Fichier temporaire d'une écriture interrompue : supprimé après ce délai
+DUREE_TEMPORAIRE = 60 * 60
+
+
+def publier_fichier(nom, ecrire, storage=default_storage):
+    """
+    Crée le fichier `nom` du stockage de façon atomique : `ecrire(fichier)`
+    remplit un fichier temporaire du même dossier, renommé ensuite avec
+    os.replace. Un lecteur voit l'ancien état ou le fichier complet, jamais
+    un fichier partiel, et deux écritures concurrentes d'un même nom (même
+    clé, donc même contenu) ne se gênent pas. Si le fichier existe déjà, il
+    est gardé tel quel. Retourne `nom`.
+    """
+    chemin = storage.path(nom)
+    if os.path.exists(chemin):
+        return nom
+    dossier = os.path.dirname(chemin)
+    os.makedirs(dossier, exist_ok=True)
+    descripteur, temporaire = tempfile.mkstemp(dir=dossier, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(descripteur, 'wb') as fichier:
+            ecrire(fichier)
+        os.chmod(temporaire, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        os.replace(temporaire, chemin)
+    except BaseException:
+        if os.path.exists(temporaire):
+            os.unlink(temporaire)
+        raise
+    return nom
+
+
+def supprimer_versions_precedentes(nom, storage=default_storage):
+    """
+    Supprime les autres versions du dossier de `nom` (une version par clé)
+    plus anciennes que `nom`. Une version écrite après `nom` par une autre
+    exécution est conservée, ainsi que les fichiers temporaires récents.
+    """
+    chemin = storage.path(nom)
+    dossier = os.path.dirname(chemin)
+    try:
+        reference = os.path.getmtime(chemin)
+    except FileNotFoundError:
+        return
+    limite_temporaires = time.time() - DUREE_TEMPORAIRE
+    for entree in os.scandir(dossier):
+        if not entree.is_file() or entree.path == chemin:
+            continue
+        try:
+            modifie = entree.stat().st_mtime
+            if entree.name.endswith('.tmp'):
+                if modifie < limite_temporaires:
+                    os.unlink(entree.path)
+            elif modifie < reference:
+                os.unlink(entree.path)
+        except FileNotFoundError:
+            # Déjà supprimé par une exécution concurrente
+            pass
+
+
+def _reference(nom, modele, champs):
+    return any(modele.objects.filter(**{champ: nom}).exists() for champ in champs)
+
+
+def purger_fichiers_orphelins(modele, champs, age):
+    """
+    Supprime les fichiers du stockage des `champs` de `modele` qu'aucune ligne
+    ne référence et qui n'ont pas été écrits ou réutilisés depuis `age`.
+
+    Un fichier candidat est d'abord renommé (opération atomique) puis revérifié :
+    s'il a été réutilisé entre-temps (date de modification récente ou ligne
+    validée), il est remis en place, sinon il est supprimé. Un enregistrement
+    concurrent du même contenu ne trouve donc jamais un fichier sur le point
+    de disparaître. Retourne le nombre de fichiers supprimés.
+    """
+    storage = modele._meta.get_field(champs[0]).storage
+    limite = time.time() - age.total_seconds()
+    references = set()
+    for champ in champs:
+        references.update(modele.objects.exclude(**{champ: ''}).values_list(champ, flat=True))
+
+    supprimes = 0
+    dossiers = {modele._meta.get_field(champ).upload_to.rstrip('/') for champ in champs}
+    for dossier in dossiers:
+        racine = storage.path(dossier)
+        for chemin_dossier, _, fichiers in os.walk(racine):
+            for fichier in fichiers:
+                chemin = os.path.join(chemin_dossier, fichier)
+                nom = os.path.relpath(chemin, storage.location).replace('\\', '/')
+                try:
+                    if nom in references or fichier.endswith('.orphelin') or os.path.getmtime(chemin) >= limite:
+                        continue
+                    quarantaine = f'{chemin}.orphelin'
+                    os.rename(chemin, quarantaine)
+                except FileNotFoundError:
+                    continue
+                if os.path.getmtime(quarantaine) >= limite or _reference(nom, modele, champs):
+                    # Réutilisé pendant la vérification : remis en place, sauf
+                    # si le même contenu vient d'être réécrit à son nom
+                    if os.path.exists(chemin):
+                        os.unlink(quarantaine)
+                    else:
+                        os.replace(quarantaine, chemin)
+                    continue
+                os.unlink(quarantaine)
+                supprimes += 1
+    return supprimes
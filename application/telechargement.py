@@ -0,0 +1,127 @@
+import mimetypes
+import re
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse, Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, content_disposition_header, parse_http_date_safe
+
+TAILLE_BLOC = 64 * 1024
+_PLAGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _lire_plage(fichier, debut, longueur):
+    try:
+        fichier.seek(debut)
+        reste = longueur
+        while reste > 0:
+            bloc = fichier.read(min(TAILLE_BLOC, reste))
+            if not bloc:
+                break
+            reste -= len(bloc)
+            yield bloc
+    finally:
+        fichier.close()
+
+
+def _plage_demandee(request, taille, etag, last_modified):
+    """Retourne (debut, fin) pour un en-tête Range valide, None pour servir tout
+    le fichier, ou False si la plage ne peut pas être satisfaite."""
+    entete = request.META.get('HTTP_RANGE', '').strip()
+    if not entete:
+        return None
+
+    # If-Range : la plage n'est servie que si le fichier n'a pas changé
+    si_plage = request.META.get('HTTP_IF_RANGE', '').strip()
+    if si_plage:
+        if si_plage.startswith(('"', 'W/')):
+            if si_plage != etag:
+                return None
+        elif last_modified is None or parse_http_date_safe(si_plage) != last_modified:
+            return None
+
+    # Une seule plage est gérée ; les demandes multiples reçoivent le fichier entier
+    correspondance = _PLAGE_RE.match(entete)
+    if not correspondance:
+        return None
+    debut, fin = correspondance.groups()
+    if debut == '':
+        if fin == '' or int(fin) == 0:
+            return False
+        debut, fin = max(taille - int(fin), 0), taille - 1
+    else:
+        debut = int(debut)
+        fin = min(int(fin), taille - 1) if fin else taille - 1
+    if debut >= taille or debut > fin:
+        return False
+    return debut, fin
+
+
+def reponse_fichier(request, nom, nom_telechargement, content_type=None, etag=None, en_ligne=False,
+                    storage=default_storage):
+    """
+    Sert un fichier du stockage sans le charger en mémoire.
+
+    - Avec DOCUMENTS_SENDFILE = 'nginx' ou 'apache', le transfert est confié au
+      serveur frontal (X-Accel-Redirect / X-Sendfile) et le worker est libéré.
+    - Sinon le fichier est envoyé par blocs (FileResponse). Les en-têtes ETag et
+      Last-Modified permettent les réponses 304, et un en-tête Range donne une
+      réponse 206 partielle (reprise de téléchargement, lecteurs PDF).
+
+    `en_ligne` affiche le fichier dans le navigateur au lieu de le télécharger.
+    `storage` est celui du champ du fichier (`document.fichier.storage`).
+    """
+    if not nom or not storage.exists(nom):
+        raise Http404("Document non trouvé")
+
+    content_type = content_type or mimetypes.guess_type(nom)[0] or 'application/octet-stream'
+    disposition = content_disposition_header(not en_ligne, nom_telechargement)
+
+    mode = getattr(settings, 'DOCUMENTS_SENDFILE', '')
+    if mode in ('nginx', 'apache'):
+        response = HttpResponse(content_type=content_type)
+        if mode == 'nginx':
+            response['X-Accel-Redirect'] = f"{settings.DOCUMENTS_SENDFILE_PREFIX.rstrip('/')}/{nom}"
+        else:
+            response['X-Sendfile'] = storage.path(nom)
+        response['Content-Disposition'] = disposition
+        return response
+
+    taille = storage.size(nom)
+    try:
+        last_modified = int(storage.get_modified_time(nom).timestamp())
+    except NotImplementedError:
+        last_modified = None
+    if etag is None:
+        etag = f'"{taille:x}-{last_modified or 0:x}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    plage = _plage_demandee(request, taille, etag, last_modified)
+    if plage is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{taille}'
+        return response
+
+    fichier = storage.open(nom, 'rb')
+    if plage is None:
+        response = FileResponse(fichier, content_type=content_type)
+        response.block_size = TAILLE_BLOC
+        response['Content-Length'] = taille
+    else:
+        debut, fin = plage
+        response = StreamingHttpResponse(
+            _lire_plage(fichier, debut, fin - debut + 1), status=206, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {debut}-{fin}/{taille}'
+        response['Content-Length'] = fin - debut + 1
+
+    response['Content-Disposition'] = disposition
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,116 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Document, Televersement
+
+TAILLE_LECTURE = 64 * 1024
+
+
+class TeleversementError(Exception):
+    """Bloc refusé ou téléversement incomplet"""
+
+
+def chemin_partiel(televersement):
+    return os.path.join(settings.TELEVERSEMENTS_DIR, f'{televersement.id}.part')
+
+
+def creer_televersement(commande, utilisateur, donnees):
+    """Ouvre un téléversement à partir des données validées de TeleversementForm."""
+    os.makedirs(settings.TELEVERSEMENTS_DIR, exist_ok=True)
+    televersement = Televersement.objects.create(
+        commande=commande,
+        utilisateur=utilisateur,
+        taille_bloc=settings.TELEVERSEMENT_TAILLE_BLOC,
+        **donnees
+    )
+    # Fichier partiel créé à sa taille finale : chaque bloc s'écrit à son offset
+    with open(chemin_partiel(televersement), 'wb') as fichier:
+        fichier.truncate(televersement.taille)
+    return televersement
+
+
+def ecrire_bloc(televersement, numero, flux):
+    """
+    Écrit le bloc `numero` lu depuis `flux` (le corps de la requête) à sa
+    place dans le fichier partiel, sans le charger entièrement en mémoire.
+
+    Les blocs sont acceptés dans l'ordre : un bloc déjà reçu est ignoré (renvoi
+    après une coupure), un bloc en avance est refusé. Retourne le nombre de
+    blocs reçus.
+    """
+    if televersement.document_id:
+        raise TeleversementError('Téléversement déjà terminé.')
+    if numero < televersement.blocs_recus:
+        return televersement.blocs_recus
+    if numero > televersement.blocs_recus or numero >= televersement.nb_blocs:
+        raise TeleversementError(f'Bloc {televersement.blocs_recus} attendu, bloc {numero} reçu.')
+
+    debut = numero * televersement.taille_bloc
+    attendu = min(televersement.taille_bloc, televersement.taille - debut)
+    recu = 0
+    with open(chemin_partiel(televersement), 'r+b') as fichier:
+        fichier.seek(debut)
+        while recu <= attendu:
+            bloc = flux.read(TAILLE_LECTURE)
+            if not bloc:
+                break
+            fichier.write(bloc[:max(attendu - recu, 0)])
+            recu += len(bloc)
+    if recu != attendu:
+        raise TeleversementError(f'Bloc {numero} : {recu} octets reçus, {attendu} attendus.')
+
+    # Deux envois simultanés du même bloc écrivent les mêmes octets ; seul le
+    # compteur doit être protégé
+    with transaction.atomic():
+        televersement = Televersement.objects.select_for_update().get(id=televersement.id)
+        if televersement.blocs_recus == numero:
+            televersement.blocs_recus = numero + 1
+            televersement.save(update_fields=['blocs_recus'])
+    return televersement.blocs_recus
+
+
+def terminer_televersement(televersement):
+    """Crée le Document à partir du fichier assemblé et supprime le fichier partiel."""
+    with transaction.atomic():
+        televersement = Televersement.objects.select_for_update().get(id=televersement.id)
+        if televersement.document_id:
+            return televersement.document
+        if televersement.blocs_recus < televersement.nb_blocs:
+            raise TeleversementError(
+                f'{televersement.blocs_recus} bloc(s) reçu(s) sur {televersement.nb_blocs}.'
+            )
+
+        chemin = chemin_partiel(televersement)
+        document = Document(
+            commande=televersement.commande,
+            nom_document=televersement.nom_document,
+            type=televersement.type,
+            numero_document=televersement.numero_document,
+            utilisateur=televersement.utilisateur,
+        )
+        with open(chemin, 'rb') as fichier:
+            document.fichier.save(televersement.nom_fichier, File(fichier), save=False)
+        document.save()
+        televersement.document = document
+        televersement.save(update_fields=['document'])
+
+    os.remove(chemin)
+    return document
+
+
+def purger_televersements(age=timedelta(days=1)):
+    """Supprime les téléversements inachevés plus anciens que `age`. Retourne leur nombre."""
+    abandonnes = list(Televersement.objects.filter(
+        document__isnull=True, date_creation__lt=timezone.now() - age
+    ))
+    for televersement in abandonnes:
+        chemin = chemin_partiel(televersement)
+        if os.path.exists(chemin):
+            os.remove(chemin)
+    Televersement.objects.filter(id__in=[t.id for t in abandonnes]).delete()
+    return len(abandonnes)
@@ -1,3 +1,860 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from .apercus import traiter_document
+from . import audit, pdf
+from .bons_commande import demander_bon_commande, en_generation, rendre_bon_commande_pdf
+from .creances import balance_agee
+from .dossiers import obtenir_dossier
+from .exports import factures_a_exporter, nouvel_export, executer_export
+from .facturation import commandes_a_facturer, facturer_commandes_livrees
+from .factures_pdf import obtenir_facture_pdf
+from .imports import analyser_csv, importer_commandes
+from .journal import exporter_journal
+from .limitation import SEAU_UTILISATEUR
+from .middleware import AuditMiddleware
+from .models import (
+    User, CLIENT, POISSON, Commande, LigneCommande, MouvementStock, Document, Comptabilite,
+    Facture, CumulTVA, FaitCommande, FaitVente, LigneReleve, Notification, AuditLog
+)
+from .rapprochement import (
+    EXACT, DEJA_IMPORTE, analyser_releve, appliquer_rapprochement, figer_propositions
+)
+from .recherche import filtrer_recherche
+from .relances import relancer_factures_retard
+from .services import allouer_numeros, changer_statut, charger_detail_commande, StockInsuffisantError
+from .stockage import purger_fichiers_orphelins
+from .telechargement import reponse_fichier
+from .ventes import synchroniser_faits_ventes
+
+MEDIA_TEST = tempfile.mkdtemp(prefix='media_tests_')
+
+CACHES_TEST = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+    'partage': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-partage'},
+}
+
+
+@override_settings(CACHES=CACHES_TEST, MEDIA_ROOT=MEDIA_TEST)
+class BaseTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_TEST, ignore_errors=True)
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['partage'].clear()
+        self.user = User.objects.create(
+            username='gestionnaire', user_email='gestionnaire@example.com', password='secret'
+        )
+        self.client_societe = CLIENT.objects.create(nom_societe='Acme', email='acme@example.com')
+        self.poisson = POISSON.objects.create(type='Sardine', prix=Decimal('10'), quantite_stock=Decimal('10'))
+
+    def creer_commande(self, *quantites, type_commande='EXPORT'):
+        commande = Commande.objects.create(
+            numero_commande=f'CMDTEST{Commande.objects.count() + 1}',
+            type_commande=type_commande,
+            client=self.client_societe,
+            utilisateur_creation=self.user,
+        )
+        for quantite in quantites:
+            LigneCommande.objects.create(
+                commande=commande, poisson=self.poisson,
+                quantite=Decimal(quantite), prix_unitaire=Decimal('10')
+            )
+        return commande
+
+    def creer_facture(self, numero, montant_ht='100', statut='emise', echeance_jours=30, **champs):
+        maintenant = timezone.now()
+        return Facture.objects.create(
+            commande=self.creer_commande('1'), client=self.client_societe, numero_facture=numero,
+            montant_ht=Decimal(montant_ht), taux_tva=Decimal('20'), montant_ttc=Decimal('0'),
+            date_emission=maintenant, date_echeance=maintenant + timedelta(days=echeance_jours),
+            mode_paiement='virement', statut=statut, **champs
+        )
+
+    def connecter(self):
+        self.client.post('/login/', {'username': 'gestionnaire', 'password': 'secret'})
+
+
+class ChangerStatutTests(BaseTestCase):
+
+    def test_stock_insuffisant_ne_modifie_rien(self):
+        commande = self.creer_commande('4', '8')
+
+        with self.assertRaises(StockInsuffisantError) as erreur:
+            changer_statut(commande.id, 'CONFIRMEE', self.user.id)
+
+        self.assertEqual(erreur.exception.manques[0]['demande'], Decimal('12'))
+        commande.refresh_from_db()
+        self.poisson.refresh_from_db()
+        self.assertEqual(commande.statut, 'BROUILLON')
+        self.assertEqual(self.poisson.quantite_stock, Decimal('10'))
+        self.assertFalse(MouvementStock.objects.filter(commande=commande).exists())
+
+    def test_confirmation_un_mouvement_par_ligne(self):
+        commande = self.creer_commande('3', '4')
+
+        mouvements = changer_statut(commande.id, 'CONFIRMEE', self.user.id)
+
+        self.poisson.refresh_from_db()
+        self.assertEqual(len(mouvements), 2)
+        self.assertEqual(self.poisson.quantite_stock, Decimal('3'))
+        self.assertEqual(Commande.objects.get(id=commande.id).statut, 'CONFIRMEE')
+
+
+class AjouterLignesTests(BaseTestCase):
+
+    def poster(self, commande, lignes):
+        return self.client.post(
+            f'/commandes/{commande.id}/lignes/lot/', json.dumps({'lignes': lignes}),
+            content_type='application/json'
+        )
+
+    def test_lignes_inserees_au_prix_du_produit_par_defaut(self):
+        commande = self.creer_commande()
+        self.connecter()
+
+        reponse = self.poster(commande, [
+            {'poisson': self.poisson.id, 'quantite': '2'},
+            {'poisson': self.poisson.id, 'quantite': '1', 'prix_unitaire': '7.50'},
+        ])
+
+        self.assertEqual(reponse.json()['lignes_creees'], 2)
+        self.assertEqual(reponse.json()['total_commande'], 27.5)
+        self.assertEqual(
+            sorted(FaitVente.objects.filter(commande=commande).values_list('montant', flat=True)),
+            [Decimal('7.5'), Decimal('20')]
+        )
+
+    def test_une_ligne_invalide_n_insere_rien(self):
+        commande = self.creer_commande()
+        self.connecter()
+
+        reponse = self.poster(commande, [
+            {'poisson': self.poisson.id, 'quantite': '2'},
+            {'poisson': self.poisson.id + 1000, 'quantite': '1'},
+        ])
+
+        self.assertEqual(reponse.status_code, 400)
+        self.assertEqual(list(reponse.json()['erreurs']), ['1'])
+        self.assertFalse(LigneCommande.objects.filter(commande=commande).exists())
+
+
+class ImportCommandesTests(BaseTestCase):
+
+    def analyser(self, *lignes):
+        contenu = '\n'.join(('reference;client;produit;quantite;prix_unitaire',) + lignes)
+        return analyser_csv(ContentFile(contenu.encode('utf-8-sig')))
+
+    def test_lignes_regroupees_par_reference_puis_importees(self):
+        client, produit = self.client_societe.code_client, self.poisson.code_produit
+        rapport = self.analyser(
+            f'A1;{client};{produit};2;', f'A1;{client};{produit};1;7,5', f'B2;{client};{produit};3;',
+        )
+        self.assertEqual(rapport['erreurs'], [])
+        self.assertEqual([c['total'] for c in rapport['commandes']], [Decimal('27.5'), Decimal('30')])
+
+        commandes = importer_commandes(rapport, self.user)
+
+        self.assertEqual(len({commande.numero_commande for commande in commandes}), 2)
+        self.assertEqual(LigneCommande.objects.filter(commande=commandes[0]).count(), 2)
+        self.assertIn('Réf. client: A1', Commande.objects.get(id=commandes[0].id).commentaire)
+        self.assertEqual(FaitCommande.objects.filter(commande__in=commandes).count(), 2)
+
+    def test_erreurs_signalees_par_ligne_et_import_refuse(self):
+        rapport = self.analyser(
+            f'A1;{self.client_societe.code_client};{self.poisson.code_produit};2;', 'A2;INCONNU;XX;0;',
+        )
+
+        self.assertEqual(rapport['erreurs'][0]['ligne'], 3)
+        self.assertIn('client inconnu', rapport['erreurs'][0]['message'])
+        with self.assertRaises(ValueError):
+            importer_commandes(rapport, self.user)
+        self.assertEqual(Commande.objects.count(), 0)
+
+
+class DetailCommandeTests(BaseTestCase):
+
+    def test_version_change_avec_les_lignes_et_les_produits(self):
+        commande = self.creer_commande('1')
+        _, version_initiale = charger_detail_commande(commande.id)
+
+        LigneCommande.objects.create(
+            commande=commande, poisson=self.poisson, quantite=Decimal('2'), prix_unitaire=Decimal('10')
+        )
+        _, version_ligne = charger_detail_commande(commande.id)
+        self.poisson.type = 'Anchois'
+        self.poisson.save()
+        _, version_produit = charger_detail_commande(commande.id)
+
+        self.assertEqual(len({version_initiale, version_ligne, version_produit}), 3)
+
+    def test_fragment_en_cache_rafraichi_apres_modification(self):
+        commande = self.creer_commande('1')
+        self.connecter()
+        self.assertContains(self.client.get(f'/commandes/{commande.id}/'), 'Sardine')
+
+        self.poisson.type = 'Anchois'
+        self.poisson.save()
+
+        reponse = self.client.get(f'/commandes/{commande.id}/')
+        self.assertContains(reponse, 'Anchois')
+        self.assertNotContains(reponse, 'Sardine')
+
+
+class RechercheCommandesTests(BaseTestCase):
+
+    def rechercher(self, terme):
+        commandes = Commande.objects.order_by('-numero_commande')
+        return list(filtrer_recherche(commandes, terme, 'numero_commande').values_list('numero_commande', flat=True))
+
+    def test_mots_cherches_dans_numero_client_et_commentaire(self):
+        premiere = self.creer_commande()
+        premiere.commentaire = 'Livraison Port de Tanger'
+        premiere.save()
+        self.creer_commande()
+
+        self.assertEqual(self.rechercher('acme TANGER'), [premiere.numero_commande])
+        self.assertEqual(len(self.rechercher('Acme')), 2)
+
+    def test_numero_exact_classe_en_premier(self):
+        for _ in range(11):
+            self.creer_commande()
+
+        self.assertEqual(self.rechercher('CMDTEST1')[:2], ['CMDTEST1', 'CMDTEST11'])
+
+    def test_renommer_le_client_reindexe_ses_commandes(self):
+        commande = self.creer_commande()
+
+        self.client_societe.nom_societe = 'Pêcheries du Nord'
+        self.client_societe.save()
+
+        self.assertEqual(self.rechercher('pêcheries'), [commande.numero_commande])
+        self.assertEqual(self.rechercher('acme'), [])
+
+
+class AllouerNumerosTests(BaseTestCase):
+
+    def test_numeros_uniques_entre_deux_appels(self):
+        with transaction.atomic():
+            premiers = allouer_numeros(Commande, 'numero_commande', 'CMD', 3)
+            Commande.objects.bulk_create([
+                Commande(numero_commande=numero, type_commande='EXPORT', client=self.client_societe)
+                for numero in premiers
+            ])
+            suivants = allouer_numeros(Commande, 'numero_commande', 'CMD', 3)
+
+        self.assertEqual(len(set(premiers + suivants)), 6)
+
+
+class LimitationConnexionTests(BaseTestCase):
+
+    def test_trop_de_tentatives_renvoie_429(self):
+        for _ in range(SEAU_UTILISATEUR[2]):
+            reponse = self.client.post('/login/', {'username': 'gestionnaire', 'password': 'faux'})
+            self.assertEqual(reponse.status_code, 200)
+
+        reponse = self.client.post('/login/', {'username': 'gestionnaire', 'password': 'secret'})
+
+        self.assertEqual(reponse.status_code, 429)
+        self.assertIn('Retry-After', reponse)
+        self.assertNotIn('user_id', self.client.session)
+
+    @override_settings(PROXIES_DE_CONFIANCE=0)
+    def test_x_forwarded_for_ne_contourne_pas_la_limite(self):
+        for numero in range(3):
+            self.client.post(
+                '/login/', {'username': f'inconnu{numero}', 'password': 'faux'},
+                HTTP_X_FORWARDED_FOR=f'203.0.113.{numero}'
+            )
+
+        # Sans proxy de confiance, l'en-tête est ignoré : un seul seau, celui de REMOTE_ADDR
+        self.assertEqual(caches['partage'].get('connexion:ip:127.0.0.1')['echecs'], 3)
+        self.assertIsNone(caches['partage'].get('connexion:ip:203.0.113.0'))
+
+
+class AuthentificationTests(BaseTestCase):
+
+    def test_utilisateur_desactive_deconnecte_malgre_le_cache(self):
+        self.connecter()
+        self.assertEqual(self.client.get('/commandes/').status_code, 200)
+
+        self.user.actif = False
+        self.user.save()
+        reponse = self.client.get('/commandes/')
+
+        self.assertRedirects(reponse, '/login/', fetch_redirect_response=False)
+        self.assertNotIn('user_id', self.client.session)
+
+    def test_vue_json_sans_connexion_renvoie_401(self):
+        reponse = self.client.get('/factures/export/inconnu/')
+
+        self.assertEqual(reponse.status_code, 401)
+
+
+class SessionsTests(BaseTestCase):
+
+    def test_session_dans_le_cache_partage_sans_ecriture_en_consultation(self):
+        from django.contrib.sessions.models import Session
+
+        self.connecter()
+        cle = self.client.cookies['sessionid'].value
+
+        self.assertEqual(
+            caches['partage'].get(f'django.contrib.sessions.cache{cle}')['user_id'], self.user.id
+        )
+        self.assertFalse(Session.objects.exists())
+        reponse = self.client.get('/commandes/')
+        self.assertNotIn('sessionid', reponse.cookies)
+
+    def test_messages_dans_un_cookie(self):
+        self.connecter()
+
+        reponse = self.client.post('/commandes/ajouter/', {
+            'type_commande': 'LOCAL', 'client': self.client_societe.id,
+        })
+
+        self.assertEqual(reponse.status_code, 302)
+        self.assertIn('messages', reponse.cookies)
+        self.assertNotIn('_messages', self.client.session)
+
+
+class JournalAuditTests(BaseTestCase):
+
+    def journaliser(self, numero):
+        return audit.journaliser(
+            utilisateur=self.user, action='UPDATE', model_name='COMMANDE', object_id=numero, object_repr='x' * 300
+        )
+
+    def test_entrees_ecrites_en_un_lot_a_la_fin_de_la_reponse(self):
+        def vue(request):
+            for numero in range(3):
+                self.journaliser(numero)
+            self.assertFalse(AuditLog.objects.exists())
+            raise ValueError('échec de la vue')
+
+        # Une requête pour la vérification dans la vue, une seule insertion ensuite
+        with self.assertNumQueries(2), self.assertRaises(ValueError):
+            AuditMiddleware(vue)(RequestFactory().get('/'))
+
+        self.assertEqual(sorted(AuditLog.objects.values_list('object_id', flat=True)), [0, 1, 2])
+        self.assertEqual(len(AuditLog.objects.first().object_repr), 200)
+
+    @override_settings(AUDIT_TAILLE_LOT=2)
+    def test_lot_plein_ecrit_pendant_la_requete(self):
+        audit.ouvrir_requete()
+        try:
+            for numero in range(3):
+                self.journaliser(numero)
+            self.assertEqual(AuditLog.objects.count(), 2)
+        finally:
+            audit.fermer_requete()
+        self.assertEqual(AuditLog.objects.count(), 3)
+
+    def test_entree_hors_requete_ecrite_aussitot(self):
+        self.journaliser(7)
+        self.assertTrue(AuditLog.objects.filter(object_id=7).exists())
+
+
+class TelechargementDocumentTests(BaseTestCase):
+
+    def test_requete_range_renvoie_206(self):
+        commande = self.creer_commande('1')
+        contenu = bytes(range(256)) * 4
+        document = Document.objects.create(
+            commande=commande, nom_document='scan', type='autre',
+            fichier=ContentFile(contenu, name='scan.bin'),
+        )
+        self.connecter()
+
+        reponse = self.client.get(f'/documents/{document.id}/telecharger/', HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(reponse.status_code, 206)
+        self.assertEqual(reponse['Content-Range'], f'bytes 10-19/{len(contenu)}')
+        self.assertEqual(b''.join(reponse.streaming_content), contenu[10:20])
+
+    def test_telechargement_complet(self):
+        commande = self.creer_commande('1')
+        document = Document.objects.create(
+            commande=commande, nom_document='scan', type='autre',
+            fichier=ContentFile(b'contenu', name='scan.bin'),
+        )
+        self.connecter()
+
+        reponse = self.client.get(f'/documents/{document.id}/telecharger/')
+
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(b''.join(reponse.streaming_content), b'contenu')
+
+    def test_fichier_servi_depuis_le_stockage_du_champ(self):
+        storage = FileSystemStorage(location=os.path.join(MEDIA_TEST, 'autre_stockage'))
+        nom = storage.save('autre/scan.bin', ContentFile(b'hors du stockage par defaut'))
+        self.assertFalse(default_storage.exists(nom))
+
+        reponse = reponse_fichier(RequestFactory().get('/'), nom, 'scan.bin', storage=storage)
+
+        self.assertEqual(reponse['Content-Length'], str(len(b'hors du stockage par defaut')))
+        self.assertEqual(b''.join(reponse.streaming_content), b'hors du stockage par defaut')
+
+
+@override_settings(TELEVERSEMENT_TAILLE_BLOC=4, TELEVERSEMENTS_DIR=os.path.join(MEDIA_TEST, 'televersements'))
+class TeleversementTests(BaseTestCase):
+
+    def envoyer(self, televersement_id, numero, contenu):
+        return self.client.put(
+            f'/televersements/{televersement_id}/blocs/{numero}/', contenu,
+            content_type='application/octet-stream'
+        )
+
+    def test_reprise_apres_coupure_puis_assemblage(self):
+        commande = self.creer_commande('1')
+        contenu = b'0123456789'
+        self.connecter()
+        ouverture = self.client.post(
+            f'/commandes/{commande.id}/documents/televersements/',
+            json.dumps({'nom_fichier': 'bl.pdf', 'taille': len(contenu), 'nom_document': 'BL', 'type': 'autre'}),
+            content_type='application/json'
+        ).json()
+        televersement_id = ouverture['id']
+        self.assertEqual(ouverture['nb_blocs'], 3)
+
+        self.envoyer(televersement_id, 0, contenu[:4])
+        self.assertEqual(self.client.post(f'/televersements/{televersement_id}/terminer/').status_code, 409)
+        # Reprise : l'état indique le prochain bloc, un bloc en avance est refusé
+        self.assertEqual(self.client.get(f'/televersements/{televersement_id}/').json()['blocs_recus'], 1)
+        self.assertEqual(self.envoyer(televersement_id, 2, contenu[8:]).status_code, 409)
+        self.envoyer(televersement_id, 0, contenu[:4])
+        self.envoyer(televersement_id, 1, contenu[4:8])
+        self.envoyer(televersement_id, 2, contenu[8:])
+
+        reponse = self.client.post(f'/televersements/{televersement_id}/terminer/')
+
+        document = Document.objects.get(id=reponse.json()['document_id'])
+        with document.fichier.open('rb') as fichier:
+            self.assertEqual(fichier.read(), contenu)
+        self.assertEqual(os.listdir(os.path.join(MEDIA_TEST, 'televersements')), [])
+
+
+class StockageDocumentsTests(BaseTestCase):
+
+    def test_contenu_identique_partage_un_fichier_purge_une_fois_orphelin(self):
+        commande = self.creer_commande('1')
+        documents = [
+            Document.objects.create(
+                commande=commande, nom_document=nom, type='autre',
+                fichier=ContentFile(b'meme contenu', name=f'{nom}.bin'),
+            )
+            for nom in ('premier', 'second')
+        ]
+        self.assertEqual(documents[0].fichier.name, documents[1].fichier.name)
+        storage = documents[0].fichier.storage
+        nom = documents[0].fichier.name
+
+        documents[0].delete()
+        self.assertEqual(purger_fichiers_orphelins(Document, ['fichier'], timedelta(0)), 0)
+        self.assertTrue(storage.exists(nom))
+
+        documents[1].delete()
+        self.assertEqual(purger_fichiers_orphelins(Document, ['fichier'], timedelta(0)), 1)
+        self.assertFalse(storage.exists(nom))
+
+
+class BonCommandeTests(BaseTestCase):
+
+    def test_rendu_invariant_avec_les_styles_partages(self):
+        from pypdf import PdfReader
+
+        commande = self.creer_commande('2', '3')
+        lignes = list(commande.lignecommande_set.select_related('poisson'))
+
+        contenu = rendre_bon_commande_pdf(commande, lignes)
+
+        self.assertEqual(rendre_bon_commande_pdf(commande, lignes), contenu)
+        self.assertIs(pdf.styles(), pdf.styles())
+        texte = PdfReader(io.BytesIO(contenu)).pages[0].extract_text()
+        self.assertIn(f'BON DE COMMANDE N° {commande.numero_commande}', texte)
+        self.assertIn('50.00', texte)
+
+    def test_une_seule_generation_programmee_par_commande(self):
+        commande = self.creer_commande('1')
+
+        self.assertTrue(demander_bon_commande(commande.id, self.user.id))
+        self.assertFalse(demander_bon_commande(commande.id, self.user.id))
+
+        self.assertTrue(en_generation(commande.id))
+        self.assertTrue(caches['partage'].get(f'bon_commande:{commande.id}'))
+        self.assertIsNone(caches['default'].get(f'bon_commande:{commande.id}'))
+
+
+class DossierCommandeTests(BaseTestCase):
+
+    def test_dossier_assemble_toutes_les_pieces_apres_la_page_de_garde(self):
+        from PIL import Image
+        from pypdf import PdfReader
+        from reportlab.pdfgen import canvas
+
+        commande = self.creer_commande('1')
+        tampon = io.BytesIO()
+        page = canvas.Canvas(tampon)
+        for texte in ('Page un', 'Page deux'):
+            page.drawString(100, 700, texte)
+            page.showPage()
+        page.save()
+        image = io.BytesIO()
+        Image.new('RGB', (40, 30), 'blue').save(image, 'PNG')
+        for nom, fichier in (
+            ('contrat', ContentFile(tampon.getvalue(), name='contrat.pdf')),
+            ('photo', ContentFile(image.getvalue(), name='photo.png')),
+            ('notes', ContentFile(b'texte', name='notes.txt')),
+        ):
+            Document.objects.create(commande=commande, nom_document=nom, type='autre', fichier=fichier)
+
+        nom, _ = obtenir_dossier(Commande.objects.select_related('client').get(id=commande.id))
+
+        with default_storage.open(nom, 'rb') as fichier:
+            lecteur = PdfReader(fichier)
+            textes = [page.extract_text().strip() for page in lecteur.pages]
+        self.assertEqual(len(textes), 4)
+        self.assertIn('Dossier de la commande', textes[0])
+        self.assertIn('notes', textes[0].split('Non incluses')[1])
+        self.assertEqual((textes[1], textes[2]), ('Page un', 'Page deux'))
+
+
+class TraitementDocumentTests(BaseTestCase):
+
+    @override_settings(DOCUMENTS_IMAGE_MAX_PX=100)
+    def test_image_compressee_remplace_le_fichier_televerse(self):
+        from PIL import Image
+
+        original = io.BytesIO()
+        Image.effect_noise((400, 300), 64).convert('RGB').save(original, 'JPEG', quality=100)
+        document = Document.objects.create(
+            commande=self.creer_commande('1'), nom_document='scan', type='autre',
+            fichier=ContentFile(original.getvalue(), name='scan.jpg'),
+        )
+        ancien = document.fichier.name
+
+        traiter_document(document.id)
+
+        document.refresh_from_db()
+        self.assertNotEqual(document.fichier.name, ancien)
+        self.assertLess(document.fichier.size, len(original.getvalue()))
+        with Image.open(document.fichier) as image:
+            self.assertEqual(image.size, (100, 75))
+        self.assertTrue(document.apercu)
+        # Seul le fichier compressé est conservé : l'original est orphelin
+        self.assertEqual(purger_fichiers_orphelins(Document, ['fichier', 'apercu'], timedelta(0)), 1)
+        self.assertFalse(document.fichier.storage.exists(ancien))
+
+
+class CumulTVATests(BaseTestCase):
+
+    def test_cumul_recalcule_apres_changement_de_statut(self):
+        commande = self.creer_commande('1')
+        maintenant = timezone.now()
+        facture = Facture.objects.create(
+            commande=commande, client=self.client_societe, numero_facture='FACTEST1',
+            montant_ht=Decimal('100'), taux_tva=Decimal('20'),
+            montant_tva=Decimal('20'), montant_ttc=Decimal('120'),
+            date_emission=maintenant, date_echeance=maintenant + timedelta(days=30),
+            mode_paiement='virement', statut='emise',
+        )
+        mois = timezone.localtime(maintenant).date().replace(day=1)
+        emise = CumulTVA.objects.get(mois=mois, statut='emise')
+        self.assertEqual((emise.nombre, emise.montant_tva), (1, Decimal('20')))
+
+        facture.statut = 'payee'
+        facture.save()
+
+        self.assertFalse(CumulTVA.objects.filter(mois=mois, statut='emise').exists())
+        payee = CumulTVA.objects.get(mois=mois, statut='payee')
+        self.assertEqual((payee.nombre, payee.montant_ttc), (1, Decimal('120')))
+
+    def test_cumul_additionne_puis_retire_les_factures(self):
+        commande = self.creer_commande('1')
+        maintenant = timezone.now()
+        factures = [
+            Facture.objects.create(
+                commande=commande, client=self.client_societe, numero_facture=f'FACTEST{numero}',
+                montant_ht=Decimal('100'), taux_tva=Decimal('20'),
+                date_emission=maintenant, date_echeance=maintenant + timedelta(days=30),
+                mode_paiement='virement', statut='emise', montant_ttc=Decimal('0'),
+            )
+            for numero in (1, 2)
+        ]
+        mois = timezone.localtime(maintenant).date().replace(day=1)
+        cumul = CumulTVA.objects.get(mois=mois, statut='emise')
+        self.assertEqual((cumul.nombre, cumul.montant_tva), (2, Decimal('40')))
+
+        factures[0].delete()
+
+        cumul = CumulTVA.objects.get(mois=mois, statut='emise')
+        self.assertEqual((cumul.nombre, cumul.montant_ht), (1, Decimal('100')))
+        self.assertEqual(CumulTVA.objects.count(), 1)
+
+
+class FacturationLotTests(BaseTestCase):
+
+    def livrer(self, *quantites):
+        commande = self.creer_commande(*quantites)
+        commande.statut = 'LIVREE'
+        commande.save()
+        return commande
+
+    def test_commandes_livrees_facturees_par_lots(self):
+        premiere, seconde = self.livrer('1', '2'), self.livrer('4')
+        self.creer_commande('5')
+
+        factures = facturer_commandes_livrees(self.user, taille_lot=1)
+
+        self.assertEqual(len(factures), 2)
+        self.assertEqual(len({facture.numero_facture for facture in factures}), 2)
+        facture = Facture.objects.get(commande=premiere)
+        self.assertEqual((facture.montant_ht, facture.montant_ttc), (Decimal('30'), Decimal('36')))
+        self.assertEqual(facture.ligne_commande.count(), 2)
+        self.assertEqual(Facture.objects.get(commande=seconde).montant_ht, Decimal('40'))
+        self.assertEqual(CumulTVA.objects.get().nombre, 2)
+        self.assertFalse(commandes_a_facturer().exists())
+        self.assertEqual(facturer_commandes_livrees(self.user), [])
+
+
+class BalanceAgeeTests(BaseTestCase):
+
+    def test_reste_du_reparti_par_tranche_de_retard(self):
+        self.creer_facture('FAC1', echeance_jours=10)
+        self.creer_facture('FAC2', echeance_jours=-10, montant_regle=Decimal('20'))
+        self.creer_facture('FAC3', echeance_jours=-45, statut='envoyee')
+        self.creer_facture('FAC4', echeance_jours=-100)
+        self.creer_facture('FAC5', echeance_jours=-100, statut='payee')
+
+        lignes, total = balance_agee()
+
+        self.assertEqual(len(lignes), 1)
+        ligne = lignes[0]
+        self.assertEqual(
+            [ligne[cle] for cle in ('courant', 'j1_30', 'j31_60', 'j61_90', 'plus_90')],
+            [Decimal('120'), Decimal('100'), Decimal('120'), Decimal('0'), Decimal('120')]
+        )
+        self.assertEqual((ligne['nombre'], ligne['j1_30_nombre']), (4, 1))
+        self.assertEqual(total['total'], Decimal('460'))
+
+
+class _SortieInterrompue:
+    """Fichier de sortie dont le n-ième flush échoue (coupure pendant l'export)."""
+
+    def __init__(self, fichier, coupure):
+        self.fichier = fichier
+        self.coupure = coupure
+
+    def write(self, texte):
+        return self.fichier.write(texte)
+
+    def fileno(self):
+        return self.fichier.fileno()
+
+    def flush(self):
+        self.coupure -= 1
+        if self.coupure == 0:
+            raise OSError('disque plein')
+        self.fichier.flush()
+
+
+class RelancesTests(BaseTestCase):
+
+    def test_factures_en_retard_relancees_une_seule_fois(self):
+        comptable = User.objects.create(
+            username='compta', user_email='compta@example.com', password='secret', role='COMPTABLE'
+        )
+        ancienne = self.creer_facture('FAC1', echeance_jours=-400, utilisateur_creation=self.user)
+        self.creer_facture('FAC2', echeance_jours=5)
+        self.creer_facture('FAC3', echeance_jours=-5, statut='payee')
+
+        self.assertEqual(relancer_factures_retard(), (1, 2))
+
+        self.assertEqual(
+            set(Notification.objects.values_list('utilisateur_id', flat=True)), {self.user.id, comptable.id}
+        )
+        self.assertIn('FAC1', Notification.objects.first().message)
+        ancienne.refresh_from_db()
+        self.assertIsNotNone(ancienne.date_relance)
+        self.assertEqual(relancer_factures_retard(), (0, 0))
+
+
+class JournalComptableTests(BaseTestCase):
+
+    def test_export_interrompu_reprend_au_lot_non_valide(self):
+        facture = self.creer_facture('FAC1')
+        for _ in range(3):
+            Comptabilite.objects.create(commande=facture.commande, facture=facture, montant_total=Decimal('120'))
+
+        with tempfile.TemporaryFile('w+') as fichier:
+            with self.assertRaises(OSError):
+                exporter_journal(_SortieInterrompue(fichier, coupure=2), taille_lot=2)
+        self.assertEqual(Comptabilite.objects.filter(export_comptable=True).count(), 2)
+
+        with tempfile.TemporaryFile('w+') as fichier:
+            total = exporter_journal(fichier, taille_lot=2)
+            fichier.seek(0)
+            lignes = fichier.read().splitlines()
+
+        self.assertEqual(total, 1)
+        # En-tête, puis client (TTC), ventes (HT) et TVA
+        self.assertEqual([ligne.split(';')[3] for ligne in lignes[1:]], ['3421', '7111', '4455'])
+        self.assertEqual(lignes[1].split(';')[6], '120.00')
+        self.assertFalse(Comptabilite.objects.filter(export_comptable=False).exists())
+
+
+class FacturePdfTests(BaseTestCase):
+
+    def test_pdf_conserve_tant_que_la_facture_ne_change_pas(self):
+        maintenant = timezone.now()
+        facture = Facture.objects.create(
+            commande=self.creer_commande('1'), client=self.client_societe, numero_facture='FACTEST1',
+            montant_ht=Decimal('10'), taux_tva=Decimal('20'), montant_ttc=Decimal('0'),
+            date_emission=maintenant, date_echeance=maintenant + timedelta(days=30),
+            mode_paiement='virement', statut='emise',
+        )
+        self.connecter()
+        url = f'/factures/{facture.id}/pdf/'
+
+        premiere = self.client.get(url)
+        self.assertTrue(b''.join(premiere.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=premiere['ETag']).status_code, 304)
+
+        facture.statut = 'payee'
+        facture.save()
+        seconde = self.client.get(url)
+
+        self.assertNotEqual(seconde['ETag'], premiere['ETag'])
+        # Une seule version conservée par facture
+        self.assertEqual(len(default_storage.listdir(f'factures/{facture.id}')[1]), 1)
+
+
+class ExportFacturesTests(BaseTestCase):
+
+    def test_export_en_arriere_plan_publie_son_etat_dans_le_cache_partage(self):
+        commande = self.creer_commande('1')
+        maintenant = timezone.now()
+        facture = Facture.objects.create(
+            commande=commande, client=self.client_societe, numero_facture='FACTEST1',
+            montant_ht=Decimal('10'), taux_tva=Decimal('20'), montant_ttc=Decimal('0'),
+            date_emission=maintenant, date_echeance=maintenant + timedelta(days=30),
+            mode_paiement='virement', statut='emise',
+        )
+        # PDF déjà stocké : l'export le relit sans démarrer de processus de rendu
+        obtenir_facture_pdf(factures_a_exporter().get(id=facture.id))
+
+        export_id = nouvel_export(1)
+        executer_export(export_id, {'statut': 'emise'})
+
+        etat = caches['partage'].get(f'export_factures:{export_id}')
+        self.assertEqual((etat['faits'], etat['termine']), (1, True))
+        self.connecter()
+        reponse = self.client.get(f'/factures/export/{export_id}/', {'telecharger': 1})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(reponse.streaming_content)))
+        self.assertEqual(archive.namelist(), ['facture_FACTEST1_Acme.pdf'])
+
+
+class RapprochementTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        maintenant = timezone.now()
+        self.facture = Facture.objects.create(
+            commande=self.creer_commande('1'), client=self.client_societe, numero_facture='FAC0001',
+            montant_ht=Decimal('100'), taux_tva=Decimal('20'), montant_ttc=Decimal('0'),
+            date_emission=maintenant, date_echeance=maintenant + timedelta(days=30),
+            mode_paiement='virement', statut='emise',
+        )
+        self.releve = 'date;libelle;montant\n2026-01-15;VIR ACME FAC0001;120,00\n'
+
+    def analyser(self):
+        return analyser_releve(ContentFile(self.releve.encode()))
+
+    def test_confirmation_applique_l_apercu_une_seule_fois(self):
+        self.connecter()
+        self.client.post('/factures/rapprochement/', {
+            'fichier': ContentFile(self.releve.encode(), name='releve.csv')
+        })
+        reponse = self.client.post('/factures/rapprochement/', {'confirmer': '1', 'accepter': ['2']})
+
+        self.assertEqual(reponse.status_code, 302)
+        self.facture.refresh_from_db()
+        self.assertEqual((self.facture.montant_regle, self.facture.statut), (Decimal('120'), 'payee'))
+        self.assertEqual(LigneReleve.objects.get().factures.get(), self.facture)
+        self.assertEqual(self.analyser()['propositions'][0]['resultat'], DEJA_IMPORTE)
+
+    def test_ligne_refusee_si_la_facture_a_change_depuis_l_apercu(self):
+        rapport = self.analyser()
+        self.assertEqual(rapport['propositions'][0]['resultat'], EXACT)
+        figees = figer_propositions(rapport)
+        Facture.objects.filter(id=self.facture.id).update(montant_regle=Decimal('50'))
+
+        nb_lignes, factures, refusees = appliquer_rapprochement(figees, {2}, self.user)
+
+        self.assertEqual((nb_lignes, factures, refusees), (0, [], [2]))
+        self.facture.refresh_from_db()
+        self.assertEqual(self.facture.montant_regle, Decimal('50'))
+        self.assertFalse(LigneReleve.objects.exists())
+
+    def test_double_confirmation_refusee(self):
+        figees = figer_propositions(self.analyser())
+        self.assertEqual(appliquer_rapprochement(figees, {2}, self.user)[0], 1)
+
+        self.assertEqual(appliquer_rapprochement(figees, {2}, self.user)[0], 0)
+        self.facture.refresh_from_db()
+        self.assertEqual(self.facture.montant_regle, Decimal('120'))
+        self.assertEqual(LigneReleve.objects.count(), 1)
+
+
+class FaitsVentesTests(BaseTestCase):
+
+    def test_rapport_compte_les_commandes_sans_ligne(self):
+        self.creer_commande()
+        livree = self.creer_commande('2')
+        livree.statut = 'LIVREE'
+        livree.save()
+        self.connecter()
+
+        aujourdhui = timezone.localdate()
+        reponse = self.client.get('/commandes/rapport/', {'date_debut': aujourdhui, 'date_fin': aujourdhui})
+
+        stats = reponse.context['stats']
+        self.assertEqual(stats['total_commandes'], 2)
+        self.assertEqual(
+            {ligne['statut']: ligne['count'] for ligne in stats['commandes_par_statut']},
+            {'BROUILLON': 1, 'LIVREE': 1}
+        )
+        self.assertEqual(stats['ca_total'], Decimal('20'))
+        self.assertEqual(stats['top_clients'][0]['nb_commandes'], 2)
+
+    def test_synchronisation_apres_ecriture_en_masse(self):
+        commande = Commande.objects.bulk_create([
+            Commande(numero_commande='CMDMASSE', type_commande='LOCAL', client=self.client_societe)
+        ])[0]
+        LigneCommande.objects.bulk_create([
+            LigneCommande(commande=commande, poisson=self.poisson, quantite=Decimal('1'),
+                          prix_unitaire=Decimal('5'), total_ligne=Decimal('5')),
+        ])
+        self.assertFalse(FaitCommande.objects.filter(commande=commande).exists())
+
+        synchroniser_faits_ventes([commande.id])
+
+        self.assertEqual(FaitCommande.objects.get(commande=commande).type_commande, 'LOCAL')
+        self.assertEqual(FaitVente.objects.get(commande=commande).montant, Decimal('5'))
@@ -0,0 +1,151 @@
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import pdf
+from .models import Facture, CumulTVA
+
+# Factures retenues dans la déclaration : émises, qu'elles soient réglées ou non
+STATUTS_DECLARES = ['emise', 'envoyee', 'payee']
+
+MONTANTS = ['montant_ht', 'montant_tva', 'montant_ttc']
+
+
+def mois_suivant(mois):
+    return mois.replace(year=mois.year + 1, month=1) if mois.month == 12 else mois.replace(month=mois.month + 1)
+
+
+def _debut(mois):
+    return timezone.make_aware(datetime.combine(mois, time.min))
+
+
+def _sommes():
+    sommes = {champ: Sum(champ) for champ in MONTANTS}
+    sommes['nombre'] = Count('id')
+    return sommes
+
+
+def _verrouiller_cumul(mois, taux_tva, statut):
+    """
+    Verrouille la ligne du cumul jusqu'à la fin de la transaction, en la créant
+    vide si elle n'existe pas. Une ligne supprimée par une transaction validée
+    pendant l'attente du verrou est recréée.
+    """
+    while True:
+        # get_or_create absorbe l'IntegrityError de deux créations simultanées
+        cumul, _ = CumulTVA.objects.get_or_create(mois=mois, taux_tva=taux_tva, statut=statut)
+        cumul = CumulTVA.objects.select_for_update().filter(id=cumul.id).first()
+        if cumul is not None:
+            return cumul
+
+
+def recalculer_cumul(mois, taux_tva, statut):
+    """
+    Recalcule un cumul à partir de ses factures ; le supprime s'il n'en reste
+    aucune. La ligne du cumul est verrouillée avant l'agrégation : une seconde
+    transaction sur le même cumul attend la validation de la première, puis
+    agrège en voyant ses factures. Aucun total n'en écrase un autre.
+    """
+    cumul = _verrouiller_cumul(mois, taux_tva, statut)
+    valeurs = Facture.objects.filter(
+        date_emission__gte=_debut(mois), date_emission__lt=_debut(mois_suivant(mois)),
+        taux_tva=taux_tva, statut=statut,
+    ).aggregate(**_sommes())
+    if not valeurs['nombre']:
+        cumul.delete()
+        return
+    for champ, valeur in valeurs.items():
+        setattr(cumul, champ, valeur)
+    cumul.save()
+
+
+def mettre_a_jour_cumuls(factures):
+    """
+    Recalcule les cumuls touchés par des factures enregistrées ou supprimées :
+    leur cumul actuel et, si la date, le taux ou le statut ont changé depuis
+    le chargement, leur cumul précédent.
+
+    Appelé par le signal post_save / post_delete de Facture ; les chemins qui
+    écrivent en masse (bulk_create, bulk_update) l'appellent eux-mêmes. Les
+    cumuls sont verrouillés dans un ordre fixe : deux transactions qui en
+    touchent plusieurs ne peuvent pas s'interbloquer.
+    """
+    cles = set()
+    for facture in factures:
+        cles.add(facture.cle_cumul())
+        if hasattr(facture, '_cle_cumul'):
+            cles.add(facture._cle_cumul)
+    with transaction.atomic():
+        for cle in sorted(cles, key=str):
+            recalculer_cumul(*cle)
+    for facture in factures:
+        facture._cle_cumul = facture.cle_cumul()
+
+
+def reconstruire_cumuls_tva():
+    """Reconstruit entièrement les cumuls (une agrégation groupée). Retourne le nombre de cumuls."""
+    with transaction.atomic():
+        CumulTVA.objects.all().delete()
+        cumuls = CumulTVA.objects.bulk_create([
+            CumulTVA(**valeurs)
+            for valeurs in Facture.objects.annotate(
+                mois=TruncMonth('date_emission', output_field=DateField())
+            ).values('mois', 'taux_tva', 'statut').annotate(**_sommes()).order_by()
+        ])
+    return len(cumuls)
+
+
+def declaration_tva(debut, fin):
+    """
+    Déclaration de TVA des mois `debut` à `fin` inclus (premiers jours des
+    mois), lue dans les cumuls mensuels.
+
+    Retourne (par_taux, par_mois, total) : totaux par taux, détail par mois
+    et par taux, et total général.
+    """
+    cumuls = CumulTVA.objects.filter(mois__range=[debut, fin], statut__in=STATUTS_DECLARES)
+    sommes = _sommes()
+    sommes['nombre'] = Sum('nombre')
+    par_mois = list(cumuls.values('mois', 'taux_tva').annotate(**sommes).order_by('mois', 'taux_tva'))
+
+    par_taux = {}
+    for ligne in par_mois:
+        cumul = par_taux.setdefault(ligne['taux_tva'], dict.fromkeys(MONTANTS + ['nombre'], 0))
+        for champ in MONTANTS + ['nombre']:
+            cumul[champ] += ligne[champ]
+    par_taux = [dict(valeurs, taux_tva=taux) for taux, valeurs in sorted(par_taux.items())]
+    total = {champ: sum((ligne[champ] for ligne in par_taux), Decimal('0')) for champ in MONTANTS}
+    total['nombre'] = sum(ligne['nombre'] for ligne in par_taux)
+    return par_taux, par_mois, total
+
+
+def rendre_declaration_pdf(debut, fin, par_taux, par_mois, total, username):
+    """PDF de la déclaration de TVA (bytes)."""
+    story = pdf.entete_rapport("DÉCLARATION DE TVA")
+    story.append(pdf.paragraphe(f"Période : {debut:%m/%Y} à {fin:%m/%Y}"))
+    story.append(pdf.espace(20))
+
+    entetes = ['Taux', 'Factures', 'Montant HT', 'TVA', 'Montant TTC']
+    data = [entetes]
+    for ligne in par_taux:
+        data.append([f"{ligne['taux_tva']:.2f} %", str(ligne['nombre'])] + [f"{ligne[champ]:.2f}" for champ in MONTANTS])
+    data.append(['TOTAL', str(total['nombre'])] + [f"{total[champ]:.2f}" for champ in MONTANTS])
+    story.append(pdf.paragraphe("TOTAUX PAR TAUX", 'Heading2'))
+    story.append(pdf.espace(12))
+    story.append(pdf.tableau_rapport(data, [1, 0.8, 1.4, 1.4, 1.4], avec_total=True))
+    story.append(pdf.espace(30))
+
+    data = [['Mois'] + entetes]
+    for ligne in par_mois:
+        data.append([f"{ligne['mois']:%m/%Y}", f"{ligne['taux_tva']:.2f} %", str(ligne['nombre'])]
+                    + [f"{ligne[champ]:.2f}" for champ in MONTANTS])
+    story.append(pdf.paragraphe("DÉTAIL PAR MOIS", 'Heading2'))
+    story.append(pdf.espace(12))
+    story.append(pdf.tableau_rapport(data, [0.9, 0.8, 0.8, 1.3, 1.3, 1.3]))
+
+    story += pdf.pied_rapport(username)
+    return pdf.construire(story, rapport=True)
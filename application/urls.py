@@ -10,13 +10,17 @@ from .Client import (
     modifier_client, desactiver_client, rapport_clients_pdf, api_clients_stats
 )
 from .Commande import (
-    commande_dashboard, liste_commandes, ajouter_commande, detail_commande,
-    modifier_commande, ajouter_ligne_commande, modifier_ligne_commande,
-    supprimer_ligne_commande, ajouter_document, telecharger_document,
-    supprimer_document, generer_facture, detail_facture, liste_factures,
+    commande_dashboard, liste_commandes, ajouter_commande, importer_commandes_csv, detail_commande,
+    modifier_commande, ajouter_ligne_commande, ajouter_lignes_commande, modifier_ligne_commande,
+    supprimer_ligne_commande, ajouter_document, telecharger_document, apercu_document,
+    televersement_document, bloc_televersement, terminer_televersement_document,
+    supprimer_document, generer_facture, detail_facture, liste_factures, facturation_lot,
+    export_factures, etat_export_factures, balance_agee_factures, rapprochement_bancaire,
+    declaration_tva_factures,
+    journal_comptable, telecharger_journal,
     ajouter_livraison, ajouter_etape_transport, changer_statut_commande,
     rapport_commandes, api_commandes_data, telecharger_facture_pdf,
-    generer_bon_commande, telecharger_bon_commande
+    generer_bon_commande, telecharger_bon_commande, telecharger_dossier
 )
 
 urlpatterns = [
@@ -54,6 +58,7 @@ urlpatterns = [
     path('commandes/', commande_dashboard, name='commande_dashboard'),
     path('commandes/liste/', liste_commandes, name='liste_commandes'),
     path('commandes/ajouter/', ajouter_commande, name='ajouter_commande'),
+    path('commandes/importer/', importer_commandes_csv, name='importer_commandes_csv'),
     path('commandes/<int:commande_id>/', detail_commande, name='detail_commande'),
     path('commandes/<int:commande_id>/modifier/', modifier_commande, name='modifier_commande'),
     path('commandes/<int:commande_id>/statut/', changer_statut_commande, name='changer_statut_commande'),
@@ -61,15 +66,22 @@ urlpatterns = [
     # Bon de commande
     path('commandes/<int:commande_id>/bon-commande/generer/', generer_bon_commande, name='generer_bon_commande'),
     path('commandes/<int:commande_id>/bon-commande/telecharger/', telecharger_bon_commande, name='telecharger_bon_commande'),
+    path('commandes/<int:commande_id>/dossier/', telecharger_dossier, name='telecharger_dossier'),
     
     # Order lines management
     path('commandes/<int:commande_id>/lignes/ajouter/', ajouter_ligne_commande, name='ajouter_ligne_commande'),
+    path('commandes/<int:commande_id>/lignes/lot/', ajouter_lignes_commande, name='ajouter_lignes_commande'),
     path('commandes/lignes/<int:ligne_id>/modifier/', modifier_ligne_commande, name='modifier_ligne_commande'),
     path('commandes/lignes/<int:ligne_id>/supprimer/', supprimer_ligne_commande, name='supprimer_ligne_commande'),
     
     # Document management
     path('commandes/<int:commande_id>/documents/ajouter/', ajouter_document, name='ajouter_document'),
+    path('commandes/<int:commande_id>/documents/televersements/', televersement_document, name='televersement_document'),
+    path('televersements/<uuid:televersement_id>/', bloc_televersement, name='etat_televersement'),
+    path('televersements/<uuid:televersement_id>/blocs/<int:numero>/', bloc_televersement, name='bloc_televersement'),
+    path('televersements/<uuid:televersement_id>/terminer/', terminer_televersement_document, name='terminer_televersement'),
     path('documents/<int:document_id>/telecharger/', telecharger_document, name='telecharger_document'),
+    path('documents/<int:document_id>/apercu/', apercu_document, name='apercu_document'),
     path('documents/<int:document_id>/supprimer/', supprimer_document, name='supprimer_document'),
     
     # Invoice management
@@ -77,6 +89,14 @@ urlpatterns = [
     path('factures/<int:facture_id>/', detail_facture, name='detail_facture'),
     path('factures/<int:facture_id>/pdf/', telecharger_facture_pdf, name='telecharger_facture_pdf'),
     path('factures/', liste_factures, name='liste_factures'),
+    path('factures/facturation-lot/', facturation_lot, name='facturation_lot'),
+    path('factures/export/', export_factures, name='export_factures'),
+    path('factures/balance-agee/', balance_agee_factures, name='balance_agee_factures'),
+    path('factures/rapprochement/', rapprochement_bancaire, name='rapprochement_bancaire'),
+    path('factures/tva/', declaration_tva_factures, name='declaration_tva_factures'),
+    path('comptabilite/journal/', journal_comptable, name='journal_comptable'),
+    path('comptabilite/journal/<str:nom>/', telecharger_journal, name='telecharger_journal'),
+    path('factures/export/<str:export_id>/', etat_export_factures, name='etat_export_factures'),
     
     # Delivery and transport
     path('commandes/<int:commande_id>/livraison/ajouter/', ajouter_livraison, name='ajouter_livraison'),
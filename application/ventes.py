@@ -0,0 +1,62 @@
+from django.db import transaction
+
+from .models import Commande, LigneCommande, FaitCommande, FaitVente
+
+
+def synchroniser_faits_ventes(commande_ids):
+    """
+    Recalcule les faits de vente et de commande des commandes données.
+
+    Les enregistrements unitaires sont suivis par les signaux de models.py ;
+    cette fonction sert aux chemins qui écrivent en masse (bulk_create) et ne
+    déclenchent donc pas de signaux.
+    """
+    commande_ids = list(commande_ids)
+    commandes = Commande.objects.in_bulk(commande_ids)
+    lignes = LigneCommande.objects.filter(commande_id__in=commande_ids).only(
+        'id', 'commande_id', 'poisson_id', 'quantite', 'total_ligne'
+    )
+    with transaction.atomic():
+        FaitVente.objects.filter(commande_id__in=commande_ids).delete()
+        FaitVente.objects.bulk_create(
+            [FaitVente.depuis_ligne(ligne, commandes[ligne.commande_id]) for ligne in lignes],
+            batch_size=1000
+        )
+        FaitCommande.objects.filter(commande_id__in=commande_ids).delete()
+        FaitCommande.objects.bulk_create(
+            [FaitCommande.depuis_commande(commande) for commande in commandes.values()],
+            batch_size=1000
+        )
+
+
+def reconstruire_faits_ventes(taille_lot=5000):
+    """Reconstruit entièrement les tables des faits de vente et de commande.
+    Retourne le nombre de faits de vente créés."""
+    total = 0
+    with transaction.atomic():
+        FaitCommande.objects.all().delete()
+        lot = []
+        commandes = Commande.objects.only('id', 'client_id', 'date_creation', 'type_commande', 'statut')
+        for commande in commandes.iterator(chunk_size=taille_lot):
+            lot.append(FaitCommande.depuis_commande(commande))
+            if len(lot) >= taille_lot:
+                FaitCommande.objects.bulk_create(lot)
+                lot = []
+        FaitCommande.objects.bulk_create(lot)
+
+        FaitVente.objects.all().delete()
+        lot = []
+        lignes = LigneCommande.objects.select_related('commande').only(
+            'id', 'poisson_id', 'quantite', 'total_ligne',
+            'commande__id', 'commande__client_id', 'commande__date_creation',
+            'commande__type_commande', 'commande__statut',
+        )
+        for ligne in lignes.iterator(chunk_size=taille_lot):
+            lot.append(FaitVente.depuis_ligne(ligne, ligne.commande))
+            if len(lot) >= taille_lot:
+                FaitVente.objects.bulk_create(lot)
+                total += len(lot)
+                lot = []
+        FaitVente.objects.bulk_create(lot)
+        total += len(lot)
+    return total
@@ -1,28 +1,20 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.contrib.auth.hashers import check_password
+from django.contrib.auth.hashers import check_password, make_password
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from datetime import datetime, timedelta
-from .models import User, AuditLog, Commande, CLIENT, POISSON, Facture
+from .models import User, Commande, CLIENT, POISSON, Facture
 from .forms import LoginForm, RegisterForm, UserProfileForm
+from . import audit
+from .authentification import connexion_requise
+from .limitation import adresse_client, cles_connexion, consommer, enregistrer_echec, enregistrer_succes
 import json
 
-# Custom login required decorator
-def custom_login_required(view_func):
-    def wrapper(request, *args, **kwargs):
-        if not request.session.get('user_id'):
-            messages.error(request, 'Vous devez être connecté pour accéder à cette page.')
-            return redirect('login')
-        return view_func(request, *args, **kwargs)
-    return wrapper
-
 def home_view(request):
     """Home page view - redirects authenticated users to dashboard"""
-    user_id = request.session.get('user_id')
-    
-    if user_id:
+    if request.user.is_authenticated:
         # User is authenticated, redirect to dashboard
         return redirect('dashboard')
     
@@ -44,16 +36,31 @@ def login_view(request):
         if form.is_valid():
             username = form.cleaned_data['username']
             password = form.cleaned_data['password']
+            cles = cles_connexion(get_client_ip(request), username)
+            
+            # Trop de tentatives : refus immédiat, sans requête ni hachage du mot de passe
+            attente = consommer(cles)
+            if attente:
+                messages.error(request, f'Trop de tentatives de connexion. Réessayez dans {attente} secondes.')
+                response = render(request, 'auth/login.html', {'form': form}, status=429)
+                response['Retry-After'] = str(attente)
+                return response
             
             try:
                 user = User.objects.get(username=username, actif=True)
-                if check_password(password, user.password):
+                
+                def rehacher(mot_de_passe):
+                    # Paramètres du hachage modifiés (PBKDF2_ITERATIONS) : réencodage transparent
+                    user.password = make_password(mot_de_passe)
+                    user.save(update_fields=['password'])
+                
+                if check_password(password, user.password, setter=rehacher):
+                    enregistrer_succes(cles)
+                    # Seul l'id est gardé : nom et rôle sont lus par le middleware
                     request.session['user_id'] = user.id
-                    request.session['username'] = user.username
-                    request.session['role'] = user.role
                     
                     # Log authentication
-                    AuditLog.objects.create(
+                    audit.journaliser(
                         utilisateur=user,
                         action='VIEW',
                         model_name='Auth',
@@ -70,8 +77,10 @@ def login_view(request):
                     else:
                         return redirect('dashboard')
                 else:
+                    enregistrer_echec(cles)
                     messages.error(request, 'Mot de passe incorrect.')
             except User.DoesNotExist:
+                enregistrer_echec(cles)
                 messages.error(request, 'Utilisateur non trouvé ou inactif.')
     else:
         form = LoginForm()
@@ -79,32 +88,26 @@ def login_view(request):
     return render(request, 'auth/login.html', {'form': form})
 
 
-@custom_login_required
+@connexion_requise
 def logout_view(request):
-    user_id = request.session.get('user_id')
-    if user_id:
-        try:
-            user = User.objects.get(id=user_id)
-            # Log logout
-            AuditLog.objects.create(
-                utilisateur=user,
-                action='VIEW',
-                model_name='Auth',
-                object_id=user.id,
-                object_repr=f"Logout: {user.username}",
-                adresse_ip=get_client_ip(request)
-            )
-        except User.DoesNotExist:
-            pass
+    user = request.user
+    # Log logout
+    audit.journaliser(
+        utilisateur=user,
+        action='VIEW',
+        model_name='Auth',
+        object_id=user.id,
+        object_repr=f"Logout: {user.username}",
+        adresse_ip=get_client_ip(request)
+    )
     
     request.session.flush()
     messages.success(request, 'Déconnexion réussie.')
     return redirect('home')
 
-@custom_login_required
+@connexion_requise
 def dashboard_view(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    user = request.user
     
     # Get dashboard statistics
     total_commandes = Commande.objects.count()
@@ -128,10 +131,10 @@ def dashboard_view(request):
     
     return render(request, 'dashboard/dashboard.html', context)
 
-@custom_login_required
+@connexion_requise
 def profile_view(request):
-    user_id = request.session.get('user_id')
-    user = User.objects.get(id=user_id)
+    # Le formulaire lit et réécrit tous les champs : utilisateur complet
+    user = User.objects.get(id=request.user.id)
     
     if request.method == 'POST':
         form = UserProfileForm(request.POST, instance=user)
@@ -145,10 +148,5 @@ def profile_view(request):
     return render(request, 'auth/profile.html', {'form': form, 'user': user})
 
 def get_client_ip(request):
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+    return adresse_client(request)
     
@@ -56,11 +56,13 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'application.middleware.AuditMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'application.middleware.AuthentificationMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -124,6 +126,16 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Hachage des mots de passe : PBKDF2-SHA256 au nombre d'itérations réglable.
+# Un mot de passe encodé avec d'autres paramètres est réencodé à la connexion
+# suivante, sans réinitialisation.
+PBKDF2_ITERATIONS = int(os.getenv('PBKDF2_ITERATIONS', 870000))
+PASSWORD_HASHERS = [
+    'application.hashers.PBKDF2PasswordHasherReglable',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -151,6 +163,9 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 # Security settings suitable for proxy setups like Render
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+# Nombre de proxies devant l'application qui ajoutent l'adresse du client à
+# X-Forwarded-For (1 sur Render). 0 : seule REMOTE_ADDR est utilisée.
+PROXIES_DE_CONFIANCE = int(os.getenv('PROXIES_DE_CONFIANCE', 0))
 if not DEBUG:
     SESSION_COOKIE_SECURE = True
     CSRF_COOKIE_SECURE = True
@@ -160,6 +175,85 @@ LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
 LOGOUT_REDIRECT_URL = '/login/'
 
+# Caches. 'default' (fragments de pages, états des tâches de fond) et 'partage'
+# (sessions, données communes à tous les processus gunicorn) : Redis si
+# REDIS_URL est défini (paquet redis requis) ; sinon 'default' reste en mémoire
+# du processus et 'partage' est un cache fichiers local (développement, une
+# seule machine).
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL},
+        'partage': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL, 'KEY_PREFIX': 'partage'},
+    }
+else:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'partage': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', BASE_DIR / 'cache'),
+        },
+    }
+
+# Sessions hors base de données : dans le cache 'partage' par défaut, ou dans
+# un cookie signé (SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies).
+# Une session n'est écrite que lorsque son contenu change (connexion, imports
+# en attente) : une page consultée ne provoque aucune écriture.
+SESSION_ENGINE = os.getenv('SESSION_ENGINE', 'django.contrib.sessions.backends.cache')
+SESSION_CACHE_ALIAS = 'partage'
+SESSION_SAVE_EVERY_REQUEST = False
+
+# Messages flash dans un cookie (jamais dans la session)
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Durée de vie (secondes) des fragments mis en cache de la page détail commande.
+# Les clés incluent la version de la commande : un changement invalide le cache.
+COMMANDE_DETAIL_CACHE_TIMEOUT = int(os.getenv('COMMANDE_DETAIL_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Téléchargement des documents : '' (servi par Django, par blocs), 'nginx'
+# (X-Accel-Redirect vers DOCUMENTS_SENDFILE_PREFIX, location "internal") ou
+# 'apache' (X-Sendfile avec le chemin absolu du fichier, mod_xsendfile).
+DOCUMENTS_SENDFILE = os.getenv('DOCUMENTS_SENDFILE', '')
+DOCUMENTS_SENDFILE_PREFIX = os.getenv('DOCUMENTS_SENDFILE_PREFIX', '/protected-media/')
+
+# Utilisateur connecté (application/authentification.py) : durée (secondes) du
+# cache par processus. Un enregistrement l'invalide dans le processus courant ;
+# dans les autres, une désactivation prend effet au plus tard après ce délai.
+UTILISATEURS_CACHE_DUREE = int(os.getenv('UTILISATEURS_CACHE_DUREE', 30))
+
+# Journal d'audit (application/audit.py) : les entrées d'une requête sont
+# écrites en un bulk_create à la fin de la réponse. Avec AUDIT_DIFFERE, elles
+# sont regroupées entre requêtes et écrites par un thread toutes les
+# AUDIT_INTERVALLE secondes ou par lots de AUDIT_TAILLE_LOT, et à l'arrêt du processus.
+AUDIT_DIFFERE = os.getenv('AUDIT_DIFFERE', 'False') == 'True'
+AUDIT_INTERVALLE = int(os.getenv('AUDIT_INTERVALLE', 5))
+AUDIT_TAILLE_LOT = 500
+
+# Tâches de fond (application/jobs.py) : nombre de threads par processus.
+# 0 exécute les tâches directement après le commit, dans la requête.
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 2))
+
+# Images téléversées : côté maximal (px) et qualité JPEG après recompression,
+# et taille des miniatures affichées sur la page détail commande. Les fichiers
+# qu'aucun document ne référence plus sont supprimés par la commande
+# purger_fichiers_orphelins.
+DOCUMENTS_IMAGE_MAX_PX = 2000
+DOCUMENTS_IMAGE_QUALITE = 80
+DOCUMENTS_APERCU_PX = 320
+
+# Téléversement par blocs : taille d'un bloc, taille maximale d'un fichier et
+# dossier des fichiers partiels (purgés par la commande purger_televersements).
+TELEVERSEMENT_TAILLE_BLOC = 2 * 1024 * 1024
+TELEVERSEMENT_TAILLE_MAX = 200 * 1024 * 1024
+TELEVERSEMENTS_DIR = Path(os.getenv('TELEVERSEMENTS_DIR', BASE_DIR / 'televersements'))
+
+# Les PDF des factures sont conservés dans le stockage (factures/<id>/<clé>.pdf) ;
+# à True, ils sont rendus en arrière-plan dès que la facture passe à « émise ».
+FACTURES_PDF_PRERENDU = os.getenv('FACTURES_PDF_PRERENDU', 'True') == 'True'
+
+# Export ZIP des factures : nombre de processus de rendu PDF (0 = tous les cœurs).
+EXPORT_PROCESSUS = int(os.getenv('EXPORT_PROCESSUS', 0))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 